@@ -3,6 +3,7 @@
 
 import * as THREE from 'three';
 import { OBJLoader2 } from 'wwobjloader2';
+import { MeshBVH } from 'three-mesh-bvh';
 import { CometView } from '../view/CometView.js';
 import { wrapMaterialWithProjector, makeProjectorDepthRT} from '../utils/ProjectedImages.js';
 import { COMETGREYVAL, COMETCOLOR } from '../core/constants.js'; 
@@ -14,6 +15,47 @@ function loadOBJ(url) {
   });
 }
 
+// Prebuilt BVH (extras/cometvis/bvh.py): 32-byte header (magic "CPBVH1\0\0", version,
+// triangle count, node count, vertex count, triangle checksum), the reordered index
+// buffer, then the root node buffer.
+function fetchBVH(url) {
+  return fetch(url)
+    .then(resp => resp.ok ? resp.arrayBuffer() : null)
+    .catch(() => null);
+}
+
+// Sum of a 32-bit hash of each triangle's indices: the same for any order of the
+// triangles, so it matches the BVH's reordered index (bvh.py triangle_checksum).
+function triangleChecksum(index, count) {
+  let sum = 0;
+  for (let i = 0; i < count; i += 3) {
+    let h = Math.imul(index[i], 0x9E3779B1) ^ index[i + 1];
+    h = Math.imul(h, 0x85EBCA77) ^ index[i + 2];
+    h = Math.imul(h, 0xC2B2AE35);
+    h ^= h >>> 16;
+    sum = (sum + (h >>> 0)) >>> 0;
+  }
+  return sum;
+}
+
+function deserializeBVH(buffer, geom) {
+  if (buffer.byteLength < 32) return null;
+  const view = new DataView(buffer);
+  const magic = new TextDecoder().decode(new Uint8Array(buffer, 0, 6));
+  const version = view.getUint32(8, true);
+  const nTris = view.getUint32(12, true);
+  const nNodes = view.getUint32(16, true);
+  const nVerts = view.getUint32(20, true);
+  const checksum = view.getUint32(24, true);
+  if (magic !== 'CPBVH1' || version !== 2 || buffer.byteLength < 32 + nTris * 12 + nNodes * 32) return null;
+  // Only use a tree built from this geometry (not, say, the model before compact or renumber)
+  if (!geom.index || geom.index.count !== nTris * 3 || geom.attributes.position.count !== nVerts) return null;
+  if (triangleChecksum(geom.index.array, geom.index.count) !== checksum) return null;
+  const index = new Uint32Array(buffer, 32, nTris * 3);
+  const root = buffer.slice(32 + nTris * 12, 32 + nTris * 12 + nNodes * 32);
+  return MeshBVH.deserialize({ roots: [root], index }, geom, { setIndex: true });
+}
+
 /**
  * Kick off the comet model load and attach it when ready.
  * Returns a Promise which can be ignored OR await later if needed.
@@ -22,6 +64,7 @@ function loadOBJ(url) {
 export async function loadCometModel(sceneMgr, ROI, missionDict) {
   const filename = missionDict.missionFolder + missionDict.model;
   const filenameAbs = new URL(filename, window.location.href).href;
+  const bvhPromise = missionDict.bvh ? fetchBVH(new URL(missionDict.missionFolder + missionDict.bvh, window.location.href).href) : null;
   const object3d = await loadOBJ(filenameAbs);
 
   // Build geometry + color buffer
@@ -61,7 +104,14 @@ export async function loadCometModel(sceneMgr, ROI, missionDict) {
   handle.setDepthRenderTarget(depthRT);
 
   const mesh = new THREE.Mesh(geom, mat);
-  mesh.geometry.computeBoundsTree();   // necessary for three-mesh-bvh
+  const bvhBuffer = bvhPromise ? await bvhPromise : null;
+  const boundsTree = bvhBuffer ? deserializeBVH(bvhBuffer, mesh.geometry) : null;
+  if (boundsTree)
+    mesh.geometry.boundsTree = boundsTree;   // built offline, so no rebuild on each load
+  else {
+    if (missionDict.bvh) console.warn(`BVH ${missionDict.bvh} missing or not for this model; building it.`);
+    mesh.geometry.computeBoundsTree();   // necessary for three-mesh-bvh
+  }
 
   // Save projector handle and mesh radius for later use
   CometView.installCometInfo(handle, mesh.geometry);
@@ -0,0 +1,4 @@
+# cometvis - offline visibility-table tools. These reproduce, in Python, what
+#   the client computes in preprocessing mode (see client/src/core/Preprocessor.js),
+#   so visTables can be built and checked without a browser. Run the tools from
+#   the extras folder, e.g.:  python -m cometvis.build_vistable --catalog preprocess.json
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+
+# bench_checkvis.py - spatial search throughput: NumPy check_vis2 vs. the C library.
+#
+# Loads a visTable (synthetic, a catalog's, or a given file), makes ROI masks
+# of several sizes, and runs check_vis2 through both paths (checkvis.py) with
+# the same filter array and mustMatch, checking that they clear the same bits.
+# Reports rows/s and latency percentiles per ROI size.
+#
+#   python -m cometvis.bench_checkvis                     # synthetic table
+#   python -m cometvis.bench_checkvis --mission cg67p
+#   python -m cometvis.bench_checkvis --vis visTable.bin --model model.obj
+
+import os
+import math
+import time
+import shutil
+import argparse
+import tempfile
+
+import numpy as np
+
+from cometvis.checkvis import CheckVis2Library, check_vis2
+from cometvis.datasets import DATA_DIR, fetch_datasets, preprocess_instrument
+from cometvis.objmodel import load_obj
+from cometvis.synthetic import bumpy_model, random_table, roi
+from cometvis.vistable import open_rows, pack_row, row_bytes
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark check_vis2: NumPy vs. the C library.")
+    src = ap.add_mutually_exclusive_group()
+    src.add_argument("--catalog", help="use the first instrument's finished visTable")
+    src.add_argument("--mission")
+    src.add_argument("--vis", help="a visTable file (with --model)")
+    ap.add_argument("--model", help="OBJ model of --vis")
+    ap.add_argument("--data", default=DATA_DIR)
+    ap.add_argument("--images", type=int, default=5000, help="synthetic table rows")
+    ap.add_argument("--model-res", type=int, default=200, help="synthetic model latitude bands")
+    ap.add_argument("--sizes", default="10,100,1000,10000", help="ROI sizes in vertices")
+    ap.add_argument("--overlap", type=float, default=75, help="percent overlap (client default: 75)")
+    ap.add_argument("--selected", type=float, default=1.0, help="fraction of rows set in the filter array")
+    ap.add_argument("--queries", type=int, default=20, help="ROIs per size")
+    ap.add_argument("--lib", help="C library (default: the server's prebuilt one for this platform)")
+    args = ap.parse_args()
+
+    work = tempfile.mkdtemp(prefix="cometvis-checkvis-")
+    try:
+        if args.vis:
+            if not args.model:
+                ap.error("--vis needs --model")
+            model, vis_file = load_obj(args.model), args.vis
+            nverts = model.nverts
+        elif args.catalog or args.mission:
+            instr = preprocess_instrument(fetch_datasets(args.data, args.catalog, args.mission), args.data)
+            model, vis_file, nverts = load_obj(instr.model_path), instr.vis_path, instr.nverts
+        else:
+            model = bumpy_model(args.model_res)
+            vis_file, nverts = os.path.join(work, "visTable.bin"), model.nverts
+            random_table(model, vis_file, os.path.join(work, "meta.json"), args.images)
+        rows = np.array(open_rows(vis_file, nverts))
+        nrows, rb = rows.shape
+        print(f"{nrows} rows of {rb} bytes ({rows.nbytes / 2**20:.0f} MB), {nverts} vertices")
+
+        paths = {"numpy": lambda must, f, q: check_vis2(rows, must, f, q)}
+        try:
+            lib = CheckVis2Library(args.lib)
+            lib.load(0, vis_file, nrows, row_bytes(nverts))
+            paths["C"] = lambda must, f, q: lib.check_vis2(0, must, f, q)
+        except OSError as e:
+            print(f"C library not available ({e}); timing NumPy only")
+
+        rng = np.random.default_rng(0)
+        positions = model.positions.astype(np.float64)
+        print(f"{'ROI':>7} {'path':>6} {'Mrows/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'kept':>7}")
+        for k in (int(s) for s in args.sizes.split(",")):
+            must = max(1, math.ceil(k * args.overlap / 100))
+            times = {name: [] for name in paths}
+            kept = 0
+            for _ in range(args.queries):
+                mask = np.zeros(nverts, dtype=bool)
+                mask[roi(positions, rng.integers(model.nverts), k)] = True
+                query = np.frombuffer(pack_row(mask, nverts), dtype=np.uint8)
+                filt = np.packbits(rng.random(math.ceil(nrows / 8) * 8) < args.selected, bitorder="little")
+                results = {}
+                for name, fn in paths.items():
+                    f = filt.copy()
+                    t0 = time.perf_counter()
+                    fn(must, f, query)
+                    times[name].append(time.perf_counter() - t0)
+                    results[name] = f
+                if "C" in results and not np.array_equal(results["C"], results["numpy"]):
+                    raise SystemExit(f"ROI of {k} vertices: NumPy and C results differ")
+                kept += int(np.unpackbits(results["numpy"], bitorder="little")[:nrows].sum())
+            for name, t in times.items():
+                t = np.array(t)
+                p50, p95, p99 = np.percentile(t, [50, 95, 99]) * 1e3
+                print(f"{k:>7} {name:>6} {nrows / np.median(t) / 1e6:>8.2f} {p50:>8.2f} {p95:>8.2f} {p99:>8.2f} "
+                      f"{kept / args.queries:>7.0f}")
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
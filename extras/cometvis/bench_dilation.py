@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+
+# bench_dilation.py - paint dilation: face scan (one_ring, the client's
+#   expandPaint) vs. the CSR adjacency gather (ObjModel.dilate), on visible
+#   sets of several sizes, checking that both give the same vertices.
+#
+#   python -m cometvis.bench_dilation                     # synthetic model
+#   python -m cometvis.bench_dilation --model model.obj --rings 1,2
+
+import math
+import time
+import argparse
+
+import numpy as np
+
+from cometvis.objmodel import load_obj, one_ring
+from cometvis.synthetic import bumpy_model
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark paint dilation: face scan vs. CSR adjacency.")
+    ap.add_argument("--model", help="OBJ model (default: synthetic)")
+    ap.add_argument("--model-res", type=int, default=300, help="synthetic model latitude bands")
+    ap.add_argument("--caps", default="2,10,30", help="visible-set sizes, as cap half-angles in degrees")
+    ap.add_argument("--rings", default="1,2,3")
+    ap.add_argument("--masks", type=int, default=10, help="masks per cap size")
+    args = ap.parse_args()
+
+    model = load_obj(args.model) if args.model else bumpy_model(args.model_res)
+    t0 = time.perf_counter()
+    indptr, _ = model.adjacency()
+    print(f"{model.nverts} vertices, {len(model.faces)} triangles; adjacency built in "
+          f"{(time.perf_counter() - t0) * 1e3:.0f} ms (mean degree {indptr[-1] / model.nverts:.1f})")
+
+    p = model.positions.astype(np.float64)
+    unit = p / np.linalg.norm(p, axis=1)[:, None]
+    rng = np.random.default_rng(0)
+    print(f"{'cap':>5} {'visible':>8} {'rings':>6} {'face scan ms':>13} {'CSR ms':>8} {'speedup':>8}")
+    for cap in (float(c) for c in args.caps.split(",")):
+        masks = []
+        for _ in range(args.masks):
+            d = rng.normal(size=3)
+            masks.append(unit @ (d / np.linalg.norm(d)) > math.cos(math.radians(cap)))
+        for rings in (int(r) for r in args.rings.split(",")):
+            t_scan = t_csr = 0.0
+            for mask in masks:
+                t0 = time.perf_counter()
+                ref = mask
+                for _ in range(rings):
+                    ref = one_ring(model.faces, ref)
+                t1 = time.perf_counter()
+                out = model.dilate(mask, rings)
+                t2 = time.perf_counter()
+                if not np.array_equal(ref, out):
+                    raise SystemExit(f"cap {cap}, {rings} rings: results differ")
+                t_scan, t_csr = t_scan + t1 - t0, t_csr + t2 - t1
+            visible = np.mean([m.sum() for m in masks])
+            print(f"{cap:>5g} {visible:>8.0f} {rings:>6} {t_scan / len(masks) * 1e3:>13.2f} "
+                  f"{t_csr / len(masks) * 1e3:>8.2f} {t_scan / t_csr:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+
+# bench_engines.py - throughput and agreement of the visibility engines.
+#
+# Runs each engine over the same images (one process, so the numbers are per
+# core) and compares its visible sets with the raycast engine, which is the
+# client's algorithm. Reports images/s, and per engine the fraction of
+# vertices whose visibility differs, before and after the one-ring expansion,
+# how many images' rows come out identical, and the most vertices any one
+# row differs by. The zbuffer engine runs at every --zbuf-scales and
+# --zbuf-tols setting (and with --zbuf-approx, also without the exact test of
+# ambiguous vertices), which is how its defaults were chosen.
+#
+#   python -m cometvis.bench_engines                       # synthetic dataset
+#   python -m cometvis.bench_engines --catalog preprocess.json --images 50
+#   python -m cometvis.bench_engines --engines raycast,zbuffer --zbuf-scales 0.25,0.5,1 --zbuf-tols 2,4,8
+
+import time
+import shutil
+import argparse
+import tempfile
+
+import numpy as np
+
+from cometvis.datasets import DATA_DIR, fetch_datasets, preprocess_instrument
+from cometvis.objmodel import load_obj, one_ring
+from cometvis.synthetic import make_dataset
+from cometvis.visibility import View, make_engine, visible_vertices
+
+
+def run_engine(engine, model, instr, entries):
+    masks = []
+    t0 = time.perf_counter()
+    for e in entries:
+        mask, _, _ = visible_vertices(model, View(e, instr.xfov, instr.yfov), engine)
+        masks.append(mask)
+    return masks, time.perf_counter() - t0
+
+
+def disagreement(masks, ref_masks, faces=None):
+    """(fraction of vertices that differ, rows identical, most vertices differing in one row)."""
+    diff = total = same = worst = 0
+    for m, r in zip(masks, ref_masks):
+        if faces is not None:
+            m, r = one_ring(faces, m), one_ring(faces, r)
+        n = np.count_nonzero(m != r)
+        diff += n
+        total += np.count_nonzero(m | r)
+        same += n == 0
+        worst = max(worst, n)
+    return diff / max(total, 1), same, worst
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark the visibility engines against the raycast engine.")
+    src = ap.add_mutually_exclusive_group()
+    src.add_argument("--catalog")
+    src.add_argument("--mission")
+    ap.add_argument("--data", default=DATA_DIR)
+    ap.add_argument("--images", type=int, default=40, help="number of images (evenly spaced through the metadata)")
+    ap.add_argument("--engines", default="raycast,zbuffer")
+    ap.add_argument("--zbuf-scales", default="0.5,1.0", help="zbuffer raster scales to try")
+    ap.add_argument("--zbuf-tols", default="4", help="zbuffer depth tolerances (pixel footprints) to try")
+    ap.add_argument("--zbuf-approx", action="store_true", help="also run zbuffer with the depth test alone")
+    ap.add_argument("--model-res", type=int, default=120, help="synthetic model latitude bands")
+    args = ap.parse_args()
+
+    work = None if args.catalog or args.mission else tempfile.mkdtemp(prefix="cometvis-bench-")
+    try:
+        if work is None:
+            data_dir, catalog = args.data, args.catalog
+        else:
+            data_dir, catalog = work, make_dataset(work, images=args.images, res=args.model_res)
+        instr = preprocess_instrument(fetch_datasets(data_dir, catalog, args.mission), data_dir)
+        entries = instr.load_metadata()
+        step = max(1, len(entries) // args.images)
+        entries = entries[::step][:args.images]
+        model = load_obj(instr.model_path)
+        print(f"{model.nverts} vertices, {len(model.faces)} triangles, {len(entries)} images, "
+              f"defaultRes {instr.default_res:g}")
+
+        runs = []
+        for name in args.engines.split(","):
+            if name == "zbuffer":
+                for exact in (True, False) if args.zbuf_approx else (True,):
+                    for scale in (float(s) for s in args.zbuf_scales.split(",")):
+                        for tol in (float(t) for t in args.zbuf_tols.split(",")):
+                            engine = make_engine(name, model, default_res=instr.default_res, scale=scale, tol_px=tol,
+                                                 exact=exact)
+                            runs.append((f"zbuffer{'' if exact else '~'} x{scale:g} t{tol:g}", engine))
+            else:
+                runs.append((name, make_engine(name, model, default_res=instr.default_res)))
+
+        ref = None
+        print(f"{'engine':>20} {'images/s':>9} {'visible/img':>12} {'differ':>9} {'differ (1-ring)':>16} "
+              f"{'rows same':>10} {'max/row':>8}")
+        for label, engine in runs:
+            masks, secs = run_engine(engine, model, instr, entries)
+            if ref is None and label == "raycast":
+                ref = masks
+            vis = np.mean([m.sum() for m in masks])
+            if ref is not None and masks is not ref:
+                (d0, _, _), (d1, same, worst) = disagreement(masks, ref), disagreement(masks, ref, model.faces)
+                cmp = f"{d0:9.3%} {d1:16.3%} {f'{same}/{len(masks)}':>10} {worst:8d}"
+            else:
+                cmp = f"{'(ref)':>9} {'':>16} {'':>10} {'':>8}"
+            print(f"{label:>20} {len(entries) / secs:9.2f} {vis:12.0f} {cmp}", flush=True)
+    finally:
+        if work:
+            shutil.rmtree(work, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+
+# bench_invindex.py - ROI query time: full-table scan vs. the inverted index.
+#
+# For ROIs of increasing size (the k vertices nearest a random vertex, like a
+# painted patch), times the checkvis2-style scan of every row (vistable.
+# match_counts) against counting over the ROI's postings (invindex.py), with
+# mustMatch = ceil(k * overlap / 100) as the client computes it, and checks
+# that both select the same images.
+#
+#   python -m cometvis.bench_invindex                     # synthetic table
+#   python -m cometvis.bench_invindex --mission cg67p --sizes 10,100,1000
+
+import os
+import math
+import time
+import shutil
+import argparse
+import tempfile
+
+import numpy as np
+
+from cometvis.datasets import DATA_DIR, fetch_datasets, preprocess_instrument
+from cometvis.invindex import build_index
+from cometvis.objmodel import load_obj
+from cometvis.synthetic import best_time, bumpy_model, random_table, roi
+from cometvis.vistable import match_counts, open_rows, pack_row
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark ROI queries: table scan vs. inverted index.")
+    src = ap.add_mutually_exclusive_group()
+    src.add_argument("--catalog", help="use the first instrument's finished visTable")
+    src.add_argument("--mission")
+    ap.add_argument("--data", default=DATA_DIR)
+    ap.add_argument("--images", type=int, default=5000, help="synthetic table rows")
+    ap.add_argument("--model-res", type=int, default=200, help="synthetic model latitude bands")
+    ap.add_argument("--sizes", default="10,100,1000,10000", help="ROI sizes in vertices")
+    ap.add_argument("--overlap", type=float, default=75, help="percent overlap (client default: 75)")
+    ap.add_argument("--queries", type=int, default=5, help="ROIs per size")
+    ap.add_argument("--repeat", type=int, default=3)
+    args = ap.parse_args()
+
+    work = tempfile.mkdtemp(prefix="cometvis-inv-")
+    try:
+        if args.catalog or args.mission:
+            instr = preprocess_instrument(fetch_datasets(args.data, args.catalog, args.mission), args.data)
+            model, vis_file, nverts = load_obj(instr.model_path), instr.vis_path, instr.nverts
+        else:
+            model = bumpy_model(args.model_res)
+            vis_file, nverts = os.path.join(work, "visTable.bin"), model.nverts
+            random_table(model, vis_file, os.path.join(work, "meta.json"), args.images)
+        rows = open_rows(vis_file, nverts)
+        print(f"{len(rows)} rows of {rows.shape[1]} bytes ({rows.nbytes / 2**20:.0f} MB), {nverts} vertices")
+
+        t0 = time.perf_counter()
+        index = build_index(rows, nverts, os.path.join(work, "index"))
+        print(f"Index: {len(index.images)} postings, {index.images.nbytes / 2**20:.0f} MB, "
+              f"built in {time.perf_counter() - t0:.1f}s")
+
+        rng = np.random.default_rng(0)
+        positions = model.positions.astype(np.float64)
+        print(f"{'ROI':>7} {'mustMatch':>9} {'scan ms':>9} {'index ms':>9} {'speedup':>8} {'matches':>8}")
+        for k in (int(s) for s in args.sizes.split(",")):
+            must = max(1, math.ceil(k * args.overlap / 100))
+            t_scan = t_index = 0.0
+            matches = 0
+            for _ in range(args.queries):
+                verts = roi(positions, rng.integers(model.nverts), k)
+                mask = np.zeros(nverts, dtype=bool)
+                mask[verts] = True
+                query = np.frombuffer(pack_row(mask, nverts), dtype=np.uint8)
+                ts, scan = best_time(lambda: match_counts(rows, query) >= must, args.repeat)
+                ti, hits = best_time(lambda: index.match(verts, must, len(rows)), args.repeat)
+                if not np.array_equal(scan, hits):
+                    raise SystemExit(f"ROI of {k} vertices: index and scan disagree")
+                t_scan, t_index, matches = t_scan + ts, t_index + ti, matches + int(hits.sum())
+            t_scan, t_index = t_scan / args.queries * 1e3, t_index / args.queries * 1e3
+            print(f"{k:>7} {must:>9} {t_scan:>9.2f} {t_index:>9.2f} {t_scan / t_index:>7.1f}x "
+                  f"{matches / args.queries:>8.0f}")
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+
+# bench_metapack.py - loading metadata: JSON vs. the columnar .cpmeta bundle.
+#
+# Times json.load plus gathering the vectors the client builds (sc, su, b1,
+# b2, dates), against mapping the bundle and viewing the same columns, and
+# reports the peak memory each takes (tracemalloc) and the file sizes.
+#
+#   python -m cometvis.bench_metapack                     # 100k synthetic entries
+#   python -m cometvis.bench_metapack --meta imageMetadata_phase2.json
+
+import os
+import json
+import shutil
+import argparse
+import tempfile
+import tracemalloc
+
+import numpy as np
+
+from cometvis.metapack import MetaPack, ti_seconds, write_metapack
+from cometvis.synthetic import best_time, random_entries
+
+COLUMNS = ("sc", "su", "b1", "b2")
+
+
+def load_json(path):
+    with open(path, "r", encoding="utf-8") as f:
+        entries = json.load(f)
+    cols = {name: np.array([e[name] for e in entries]) for name in COLUMNS if name in entries[0]}
+    cols["t"] = ti_seconds([e["ti"] for e in entries])
+    return entries, cols
+
+
+def load_pack(path):
+    pack = MetaPack(path)
+    cols = {name: np.array(pack.column(name)) for name in COLUMNS + ("t",) if name in pack}
+    return pack.column("nm"), cols
+
+
+def peak_memory(fn, *args):
+    tracemalloc.start()
+    result = fn(*args)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    del result
+    return peak
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark metadata loading: JSON vs. .cpmeta.")
+    ap.add_argument("--meta", help="a metadata JSON file (default: synthetic)")
+    ap.add_argument("--entries", type=int, default=100000, help="synthetic entries")
+    ap.add_argument("--repeat", type=int, default=3)
+    args = ap.parse_args()
+
+    work = tempfile.mkdtemp(prefix="cometvis-metapack-")
+    try:
+        meta = args.meta
+        if not meta:
+            meta = os.path.join(work, "meta.json")
+            entries = random_entries(args.entries)
+            rng = np.random.default_rng(0)
+            for e in entries:       # phase 2 fields, float32 bounds like the builder's
+                b = np.sort(rng.uniform(-2, 2, (2, 3)).astype(np.float32), axis=0)
+                e.update(b1=b[0].tolist(), b2=b[1].tolist(), d1=float(rng.uniform(8, 60)))
+                e["d2"] = e["d1"] + 2.0
+            with open(meta, "w", encoding="utf-8") as f:
+                json.dump(entries, f, separators=(",", ":"))
+        pack = os.path.join(work, "meta.cpmeta")
+        with open(meta, "r", encoding="utf-8") as f:
+            write_metapack(json.load(f), pack)
+
+        _, ref = load_json(meta)
+        _, got = load_pack(pack)
+        for name in ref:
+            if not np.array_equal(ref[name], got[name], equal_nan=True):
+                raise SystemExit(f"Column {name} differs between JSON and bundle")
+
+        t_json, _ = best_time(lambda: load_json(meta), args.repeat)
+        t_pack, _ = best_time(lambda: load_pack(pack), args.repeat)
+        m_json, m_pack = peak_memory(load_json, meta), peak_memory(load_pack, pack)
+        print(f"{len(got['t'])} entries")
+        print(f"{'':>8} {'MB':>8} {'load ms':>9} {'peak MB':>9}")
+        print(f"{'JSON':>8} {os.path.getsize(meta) / 2**20:8.1f} {t_json * 1e3:9.1f} {m_json / 2**20:9.1f}")
+        print(f"{'.cpmeta':>8} {os.path.getsize(pack) / 2**20:8.1f} {t_pack * 1e3:9.1f} {m_pack / 2**20:9.1f}")
+        print(f"Bundle loads {t_json / t_pack:.1f}x faster with {m_json / max(m_pack, 1):.1f}x less peak memory")
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
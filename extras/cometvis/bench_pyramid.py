@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+
+# bench_pyramid.py - how many fine rows the coarse patch level (pyramid.py)
+#   lets an ROI search skip, and what that does to query time, checking the
+#   results against a full scan of the fine table.
+#
+#   python -m cometvis.bench_pyramid                      # synthetic table
+#   python -m cometvis.bench_pyramid --mission cg67p --patch-sizes 128,512
+
+import os
+import math
+import time
+import shutil
+import argparse
+import tempfile
+
+import numpy as np
+
+from cometvis.datasets import DATA_DIR, fetch_datasets, preprocess_instrument
+from cometvis.objmodel import load_obj
+from cometvis.pyramid import Pyramid
+from cometvis.synthetic import best_time, bumpy_model, random_table, roi
+from cometvis.vistable import match_counts, open_rows, pack_row
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark ROI queries with and without the coarse patch level.")
+    src = ap.add_mutually_exclusive_group()
+    src.add_argument("--catalog", help="use the first instrument's finished visTable")
+    src.add_argument("--mission")
+    ap.add_argument("--data", default=DATA_DIR)
+    ap.add_argument("--images", type=int, default=5000, help="synthetic table rows")
+    ap.add_argument("--model-res", type=int, default=200, help="synthetic model latitude bands")
+    ap.add_argument("--patch-sizes", default="64,256,1024", help="vertices per patch to try")
+    ap.add_argument("--sizes", default="10,100,1000,10000", help="ROI sizes in vertices")
+    ap.add_argument("--overlap", type=float, default=75, help="percent overlap (client default: 75)")
+    ap.add_argument("--queries", type=int, default=5, help="ROIs per size")
+    ap.add_argument("--repeat", type=int, default=3)
+    args = ap.parse_args()
+
+    work = tempfile.mkdtemp(prefix="cometvis-pyr-")
+    try:
+        if args.catalog or args.mission:
+            instr = preprocess_instrument(fetch_datasets(args.data, args.catalog, args.mission), args.data)
+            model, vis_file, nverts = load_obj(instr.model_path), instr.vis_path, instr.nverts
+        else:
+            model = bumpy_model(args.model_res)
+            vis_file, nverts = os.path.join(work, "visTable.bin"), model.nverts
+            random_table(model, vis_file, os.path.join(work, "meta.json"), args.images)
+        rows = np.array(open_rows(vis_file, nverts))
+        positions = model.positions.astype(np.float64)
+        print(f"{len(rows)} rows of {rows.shape[1]} bytes, {nverts} vertices")
+
+        for patch_size in (int(s) for s in args.patch_sizes.split(",")):
+            t0 = time.perf_counter()
+            pyr = Pyramid.build(rows, model.positions, patch_size)
+            print(f"\nPatch size {patch_size}: {pyr.npatch} patches, coarse level {pyr.coarse.nbytes / 2**20:.1f} MB "
+                  f"({pyr.coarse.nbytes / rows.nbytes:.1%} of fine), built in {time.perf_counter() - t0:.1f}s")
+            print(f"{'ROI':>7} {'mustMatch':>9} {'rows skipped':>13} {'scan ms':>9} {'pyramid ms':>11} {'speedup':>8}")
+            rng = np.random.default_rng(0)
+            for k in (int(s) for s in args.sizes.split(",")):
+                must = max(1, math.ceil(k * args.overlap / 100))
+                skipped = t_scan = t_pyr = 0.0
+                for _ in range(args.queries):
+                    verts = roi(positions, rng.integers(model.nverts), k)
+                    mask = np.zeros(nverts, dtype=bool)
+                    mask[verts] = True
+                    query = np.frombuffer(pack_row(mask, nverts), dtype=np.uint8)
+                    ts, scan = best_time(lambda: match_counts(rows, query) >= must, args.repeat)
+                    tp, hits = best_time(lambda: pyr.match(rows, verts, query, must), args.repeat)
+                    if not np.array_equal(scan, hits):
+                        raise SystemExit(f"ROI of {k} vertices: pyramid and scan disagree")
+                    skipped += 1 - pyr.candidates(verts, must).mean()
+                    t_scan, t_pyr = t_scan + ts, t_pyr + tp
+                n = args.queries
+                print(f"{k:>7} {must:>9} {skipped / n:>12.1%} {t_scan / n * 1e3:>9.2f} {t_pyr / n * 1e3:>11.2f} "
+                      f"{t_scan / t_pyr:>7.1f}x")
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
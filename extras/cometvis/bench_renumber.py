@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+
+# bench_renumber.py - what curve renumbering (renumber.py) does for queries.
+#
+# For the same ROIs before and after renumbering, reports how many words the
+# ROI spans, how many words of each row checkvis2 reads before its early exit
+# (nMatched >= mustMatch, or the end of the row), the same for a scan that
+# visits only the query's nonzero words, and how many nonzero words the rows
+# have (the size of a sparse table, sparsetable.py). Most rows never reach
+# mustMatch, so checkvis2 as written reads whole rows either way; the scan
+# restricted to the ROI's words is where the renumbering pays off.
+#
+#   python -m cometvis.bench_renumber                     # synthetic model and table
+#   python -m cometvis.bench_renumber --model m.obj --vis visTable.bin
+
+import os
+import math
+import shutil
+import argparse
+import tempfile
+
+import numpy as np
+
+from cometvis.objmodel import load_obj
+from cometvis.renumber import permute_table, write_renumbered_obj
+from cometvis.sparsetable import _popcount64
+from cometvis.synthetic import bumpy_model, random_table, roi, write_obj
+from cometvis.vistable import chunks, open_rows, pack_row
+
+
+def words_touched(rows, query, must, query_words_only=False):
+    """Words checkvis2 reads in each row for this query (or, optionally, only the query's nonzero words)."""
+    q = np.frombuffer(query, dtype=np.uint64)
+    cols = np.nonzero(q)[0] if query_words_only else np.arange(len(q))
+    out = np.zeros(len(rows), dtype=np.int64)
+    for sl in chunks(rows):
+        words = np.ascontiguousarray(np.asarray(rows[sl]).view(np.uint64)[:, cols] & q[cols])
+        hits = _popcount64(words)
+        done = np.cumsum(hits, axis=1) >= must
+        out[sl] = np.where(done.any(axis=1), done.argmax(axis=1) + 1, len(cols))
+    return out
+
+
+def nonzero_words(rows):
+    return sum(int(np.count_nonzero(np.asarray(rows[sl]).view(np.uint64))) for sl in chunks(rows))
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Words touched per query before and after curve renumbering.")
+    ap.add_argument("--model", help="OBJ model (with --vis)")
+    ap.add_argument("--vis", help="visTable of the model")
+    ap.add_argument("--images", type=int, default=2000, help="synthetic table rows")
+    ap.add_argument("--model-res", type=int, default=200, help="synthetic model latitude bands")
+    ap.add_argument("--curve", choices=("hilbert", "morton"), default="hilbert")
+    ap.add_argument("--sizes", default="10,100,1000,10000", help="ROI sizes in vertices")
+    ap.add_argument("--overlap", type=float, default=75, help="percent overlap (client default: 75)")
+    ap.add_argument("--queries", type=int, default=5, help="ROIs per size")
+    args = ap.parse_args()
+
+    work = tempfile.mkdtemp(prefix="cometvis-renum-")
+    try:
+        if args.model:
+            model_file, vis_file = args.model, args.vis
+            model = load_obj(model_file)
+        else:
+            model_file, vis_file = os.path.join(work, "model.obj"), os.path.join(work, "visTable.bin")
+            write_obj(bumpy_model(args.model_res), model_file)
+            model = load_obj(model_file)            # client numbering: scattered
+            random_table(model, vis_file, os.path.join(work, "meta.json"), args.images)
+        nverts = model.nverts
+        _, perm = write_renumbered_obj(model_file, model, os.path.join(work, "renumbered.obj"), args.curve)
+        before = open_rows(vis_file, nverts)
+        permute_table(before, perm, nverts, os.path.join(work, "renumbered.bin"))
+        after = open_rows(os.path.join(work, "renumbered.bin"), nverts)
+        nwords = before.shape[1] // 8
+
+        print(f"{len(before)} rows, {nverts} vertices, {nwords} words per row")
+        print(f"Nonzero words per row: before {nonzero_words(before) / len(before):.1f}, "
+              f"after {nonzero_words(after) / len(after):.1f}")
+        rng = np.random.default_rng(0)
+        positions = model.positions.astype(np.float64)
+        print(f"{'ROI':>7} {'ROI words':>19} {'checkvis2 words/row':>21} {'ROI-words scan/row':>21}")
+        print(f"{'':>7} {'before':>9} {'after':>9} {'before':>10} {'after':>10} {'before':>10} {'after':>10}")
+        for k in (int(s) for s in args.sizes.split(",")):
+            must = max(1, math.ceil(k * args.overlap / 100))
+            span = [0, 0]
+            read = [0.0, 0.0]
+            read_roi = [0.0, 0.0]
+            for _ in range(args.queries):
+                mask = np.zeros(nverts, dtype=bool)
+                mask[roi(positions, rng.integers(nverts), k)] = True
+                for j, (rows, m) in enumerate(((before, mask), (after, mask[perm]))):
+                    query = pack_row(m, nverts)
+                    span[j] += np.count_nonzero(np.frombuffer(query, dtype=np.uint64))
+                    read[j] += words_touched(rows, query, must).mean()
+                    read_roi[j] += words_touched(rows, query, must, query_words_only=True).mean()
+            print(f"{k:>7} {span[0] / args.queries:>9.0f} {span[1] / args.queries:>9.0f} "
+                  f"{read[0] / args.queries:>10.0f} {read[1] / args.queries:>10.0f} "
+                  f"{read_roi[0] / args.queries:>10.1f} {read_roi[1] / args.queries:>10.1f}")
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
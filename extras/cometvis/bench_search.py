@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+
+# bench_search.py - batched region searches (search.py): one call for many
+#   regions vs. one call per region, by table scan and by inverted index.
+#
+# Writes a synthetic mission (or uses a catalog's first mission), then runs a
+# batch of ROI searches with the client's default overlap and the m2 and
+# emission filters three ways: a search() call per region over the table, one
+# search() call for the whole batch over the table, and one call with the
+# vertex -> image index built. All three must give the same images.
+#
+#   python -m cometvis.bench_search                       # synthetic mission
+#   python -m cometvis.bench_search --mission cg67p --regions 1000 --roi 500
+
+import os
+import shutil
+import argparse
+import tempfile
+
+import numpy as np
+
+from cometvis.datasets import DATA_DIR
+from cometvis.invindex import build_index, index_path
+from cometvis.objmodel import load_obj
+from cometvis.search import Mission
+from cometvis.synthetic import best_time, make_dataset, random_table, roi
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark batched region searches.")
+    src = ap.add_mutually_exclusive_group()
+    src.add_argument("--catalog")
+    src.add_argument("--mission")
+    ap.add_argument("--data", default=DATA_DIR)
+    ap.add_argument("--images", type=int, default=5000, help="synthetic table rows")
+    ap.add_argument("--model-res", type=int, default=150, help="synthetic model latitude bands")
+    ap.add_argument("--regions", type=int, default=200, help="regions per batch")
+    ap.add_argument("--roi", type=int, default=300, help="region size in vertices")
+    ap.add_argument("--overlap", type=float, default=75)
+    args = ap.parse_args()
+
+    work = tempfile.mkdtemp(prefix="cometvis-search-")
+    try:
+        data = args.data
+        if not (args.catalog or args.mission):
+            data = os.path.join(work, "data")
+            make_dataset(data, 0, args.model_res)
+            cam = os.path.join(data, "synth", "cam")
+            random_table(load_obj(os.path.join(data, "synth", "model.obj")), os.path.join(cam, "visTable.bin"),
+                         os.path.join(cam, "imageMetadata_phase1.json"), args.images)
+            args.mission = "synth"
+        mission = Mission.open(data, args.catalog, args.mission)
+        images = mission.images[0]
+        if images.index is not None:
+            raise SystemExit(f"{index_path(images.instr.vis_path)} exists; move it aside to time the table scan")
+        print(f"{len(mission.positions)} vertices, {images.count} images ({images.rows.nbytes / 2**20:.0f} MB table), "
+              f"{args.regions} regions of {args.roi} vertices")
+
+        rng = np.random.default_rng(0)
+        positions = mission.positions.astype(np.float64)
+        regions = [mission.region(vertices=roi(positions, rng.integers(len(positions)), args.roi))
+                   for _ in range(args.regions)]
+        filters = {"percent": args.overlap, "m2": (0, 10), "emission": (0, 70)}
+
+        t_each, each = best_time(lambda: [mission.search([r], **filters)[0] for r in regions], 1)
+        t_batch, batch = best_time(lambda: mission.search(regions, **filters), 1)
+        images.index = build_index(images.rows, images.instr.nverts, os.path.join(work, "index"))
+        t_index, indexed = best_time(lambda: mission.search(regions, **filters), 1)
+        for name, got in (("batched", batch), ("indexed", indexed)):
+            if any(not np.array_equal(a[images.name], b[images.name]) for a, b in zip(each, got)):
+                raise SystemExit(f"{name} results differ from per-region results")
+        hits = np.mean([len(r[images.name]) for r in batch])
+        print(f"{'method':>24} {'total s':>8} {'ms/region':>10}")
+        for name, t in (("per-region scan", t_each), ("batched scan", t_batch), ("batched, inverted index", t_index)):
+            print(f"{name:>24} {t:>8.2f} {t / args.regions * 1e3:>10.2f}")
+        print(f"{hits:.1f} images per region pass")
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
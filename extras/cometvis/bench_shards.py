@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+
+# bench_shards.py - time-window spatial search: monthly shards vs. the whole table.
+#
+# Shards a visTable (synthetic, or a catalog's first instrument) by month,
+# then runs ROI queries restricted to windows of several lengths both ways,
+# checking that they return the same rows, and reports the time and the rows
+# each reads.
+#
+#   python -m cometvis.bench_shards                       # synthetic table, ~27 months
+#   python -m cometvis.bench_shards --mission cg67p --windows 1,3,12
+
+import os
+import math
+import shutil
+import argparse
+import tempfile
+
+import numpy as np
+
+from cometvis.datasets import DATA_DIR, fetch_datasets, preprocess_instrument
+from cometvis.metapack import ti_seconds
+from cometvis.objmodel import load_obj
+from cometvis.shards import INDEX_NAME, ShardSet, full_search, write_shards
+from cometvis.synthetic import best_time, bumpy_model, random_table, roi
+from cometvis.vistable import load_meta, open_rows, pack_row
+
+MONTH = 30.44 * 86400
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark time-window searches: monthly shards vs. the full table.")
+    src = ap.add_mutually_exclusive_group()
+    src.add_argument("--catalog")
+    src.add_argument("--mission")
+    ap.add_argument("--data", default=DATA_DIR)
+    ap.add_argument("--images", type=int, default=20000, help="synthetic table rows (one per hour)")
+    ap.add_argument("--model-res", type=int, default=150, help="synthetic model latitude bands")
+    ap.add_argument("--windows", default="1,3,12", help="window lengths in months")
+    ap.add_argument("--roi", type=int, default=1000, help="ROI size in vertices")
+    ap.add_argument("--overlap", type=float, default=75)
+    ap.add_argument("--queries", type=int, default=10, help="queries per window length")
+    args = ap.parse_args()
+
+    work = tempfile.mkdtemp(prefix="cometvis-shards-")
+    try:
+        if args.catalog or args.mission:
+            instr = preprocess_instrument(fetch_datasets(args.data, args.catalog, args.mission), args.data)
+            model, nverts = load_obj(instr.model_path), instr.nverts
+            vis_file, meta_file = instr.vis_path, instr.meta_path
+        else:
+            model = bumpy_model(args.model_res)
+            nverts = model.nverts
+            vis_file, meta_file = os.path.join(work, "visTable.bin"), os.path.join(work, "meta.json")
+            random_table(model, vis_file, meta_file, args.images)
+        meta = load_meta(meta_file)
+        rows = open_rows(vis_file, nverts, len(meta))
+        t = ti_seconds([e.get("ti") for e in meta])
+        index = write_shards(rows, meta, nverts, os.path.join(work, "shards"))
+        shards = ShardSet(os.path.join(work, "shards", INDEX_NAME))
+        print(f"{len(rows)} rows, {len(index['shards'])} monthly shards "
+              f"({index['shards'][0]['month']}-{index['shards'][-1]['month']})")
+
+        rng = np.random.default_rng(0)
+        positions = model.positions.astype(np.float64)
+        must = max(1, math.ceil(args.roi * args.overlap / 100))
+        lo, hi = np.nanmin(t), np.nanmax(t)
+        print(f"{'months':>7} {'shards':>7} {'rows read':>10} {'full ms':>8} {'shards ms':>10} "
+              f"{'speedup':>8} {'hits':>6}")
+        for months in (float(w) for w in args.windows.split(",")):
+            t_full = t_shard = 0.0
+            nshards = nrows = hits = 0
+            for _ in range(args.queries):
+                mask = np.zeros(nverts, dtype=bool)
+                mask[roi(positions, rng.integers(model.nverts), args.roi)] = True
+                query = pack_row(mask, nverts)
+                t0 = rng.uniform(lo, max(lo, hi - months * MONTH))
+                t1 = t0 + months * MONTH
+                tf, ref = best_time(lambda: full_search(rows, t, query, must, t0, t1), 1)
+                ts, got = best_time(lambda: shards.search(query, must, t0, t1), 1)
+                if not np.array_equal(ref, got):
+                    raise SystemExit(f"{months:g}-month window: shard and full results differ")
+                sel = shards.select(t0, t1)
+                t_full, t_shard = t_full + tf, t_shard + ts
+                nshards, nrows, hits = nshards + len(sel), nrows + sum(s["rows"] for s in sel), hits + len(got)
+            q = args.queries
+            print(f"{months:>7g} {nshards / q:>7.1f} {nrows / q:>10.0f} {t_full / q * 1e3:>8.1f} "
+                  f"{t_shard / q * 1e3:>10.1f} {t_full / t_shard:>7.1f}x {hits / q:>6.0f}")
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
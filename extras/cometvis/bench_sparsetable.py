@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+
+# bench_sparsetable.py - dense visTable vs. the sparse-word format (sparsetable.py):
+#   size on disk, load time, and ROI query latency, checking that both formats
+#   select the same images.
+#
+#   python -m cometvis.bench_sparsetable                  # synthetic table
+#   python -m cometvis.bench_sparsetable --mission cg67p
+
+import os
+import math
+import time
+import shutil
+import argparse
+import tempfile
+
+import numpy as np
+
+from cometvis.datasets import DATA_DIR, fetch_datasets, preprocess_instrument
+from cometvis.objmodel import load_obj
+from cometvis.sparsetable import SparseTable
+from cometvis.synthetic import best_time, bumpy_model, random_table, roi
+from cometvis.vistable import match_counts, open_rows, pack_row, row_bytes
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark the sparse-word visTable format against the dense one.")
+    src = ap.add_mutually_exclusive_group()
+    src.add_argument("--catalog", help="use the first instrument's finished visTable")
+    src.add_argument("--mission")
+    ap.add_argument("--data", default=DATA_DIR)
+    ap.add_argument("--images", type=int, default=5000, help="synthetic table rows")
+    ap.add_argument("--model-res", type=int, default=200, help="synthetic model latitude bands")
+    ap.add_argument("--sizes", default="10,1000,10000", help="ROI sizes in vertices")
+    ap.add_argument("--overlap", type=float, default=75, help="percent overlap (client default: 75)")
+    ap.add_argument("--queries", type=int, default=5, help="ROIs per size")
+    ap.add_argument("--repeat", type=int, default=3)
+    args = ap.parse_args()
+
+    work = tempfile.mkdtemp(prefix="cometvis-sparse-")
+    try:
+        if args.catalog or args.mission:
+            instr = preprocess_instrument(fetch_datasets(args.data, args.catalog, args.mission), args.data)
+            model, vis_file, nverts = load_obj(instr.model_path), instr.vis_path, instr.nverts
+        else:
+            model = bumpy_model(args.model_res)
+            vis_file, nverts = os.path.join(work, "visTable.bin"), model.nverts
+            random_table(model, vis_file, os.path.join(work, "meta.json"), args.images)
+        sparse_file = os.path.join(work, "visTable.npz")
+
+        t0 = time.perf_counter()
+        SparseTable.encode(open_rows(vis_file, nverts), nverts).save(sparse_file)
+        t_encode = time.perf_counter() - t0
+        t_dense, dense = best_time(lambda: np.fromfile(vis_file, dtype=np.uint8).reshape(-1, row_bytes(nverts)),
+                                   args.repeat)
+        t_sparse, sparse = best_time(lambda: SparseTable.load(sparse_file), args.repeat)
+        dense_size, sparse_size = os.path.getsize(vis_file), os.path.getsize(sparse_file)
+        print(f"{len(dense)} rows, {nverts} vertices; {len(sparse.word_value)} of {dense.size // 8} words nonzero "
+              f"(encoded in {t_encode:.1f}s)")
+        print(f"{'':>8} {'MB':>9} {'load ms':>9}")
+        print(f"{'dense':>8} {dense_size / 2**20:>9.1f} {t_dense * 1e3:>9.1f}")
+        print(f"{'sparse':>8} {sparse_size / 2**20:>9.1f} {t_sparse * 1e3:>9.1f}   "
+              f"({sparse_size / dense_size:.1%} of dense)")
+
+        rng = np.random.default_rng(0)
+        positions = model.positions.astype(np.float64)
+        print(f"{'ROI':>7} {'mustMatch':>9} {'dense ms':>9} {'sparse ms':>10} {'speedup':>8}")
+        for k in (int(s) for s in args.sizes.split(",")):
+            must = max(1, math.ceil(k * args.overlap / 100))
+            t_d = t_s = 0.0
+            for _ in range(args.queries):
+                mask = np.zeros(nverts, dtype=bool)
+                mask[roi(positions, rng.integers(model.nverts), k)] = True
+                query = np.frombuffer(pack_row(mask, nverts), dtype=np.uint8)
+                td, a = best_time(lambda: match_counts(dense, query) >= must, args.repeat)
+                ts, b = best_time(lambda: sparse.match(query, must), args.repeat)
+                if not np.array_equal(a, b):
+                    raise SystemExit(f"ROI of {k} vertices: sparse and dense disagree")
+                t_d, t_s = t_d + td, t_s + ts
+            print(f"{k:>7} {must:>9} {t_d / args.queries * 1e3:>9.2f} {t_s / args.queries * 1e3:>10.2f} "
+                  f"{t_d / t_s:>7.1f}x")
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
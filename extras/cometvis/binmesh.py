@@ -0,0 +1,169 @@
+# binmesh.py - a compact binary version of a mission's OBJ shape model.
+#
+# The client downloads the text OBJ, parses it with OBJLoader2 and computes
+# vertex normals on every page load. A .cpmesh file holds the same mesh,
+# already in the client's vertex order (objmodel.py), so visTable bit i is
+# still vertex i:
+#
+#   header      64 bytes, little-endian:
+#                 magic "CPMESH1\0", version (u32), flags (u32), nVerts (u32),
+#                 vertex count (u32), triangle count (u32), position bits (u32),
+#                 index stream bytes (u32), bounding box min xyz, max xyz (6 x f32),
+#                 4 reserved bytes
+#   positions   position bits 16: u16 x 3 per vertex, quantized over the bounding box
+#               position bits 32: f32 x 3 per vertex (exact)
+#   normals     i16 x 3 per vertex (x / 32767), what computeVertexNormals gives
+#   indices     the triangle index stream, delta-encoded, zigzagged and
+#               written as LEB128 varints (the loader numbers vertices in face
+#               order, so most deltas fit in a byte or two)
+#
+# nVerts is the catalog's value (the visTable row length in bits), which can
+# exceed the vertex count. Sections start on 4-byte boundaries.
+#
+#   python -m cometvis.binmesh <model.obj> <out.cpmesh> [--bits 16|32] [--nverts N]
+
+import os
+import time
+import struct
+import argparse
+
+import numpy as np
+
+from cometvis.objmodel import ObjModel, load_obj
+
+MAGIC = b"CPMESH1\0"
+VERSION = 1
+HEADER = struct.Struct("<8sIIIIIII6f4x")
+FLAG_NORMALS = 1
+
+
+def _pad4(n):
+    return -n % 4
+
+
+def vertex_normals(model):
+    """Unit vertex normals: area-weighted sums of face normals, like computeVertexNormals."""
+    fn = model.face_normals()
+    n = np.zeros((model.nverts, 3))
+    for k in range(3):
+        np.add.at(n, model.faces[:, k], fn)
+    length = np.linalg.norm(n, axis=1)
+    return n / np.where(length > 0, length, 1)[:, None]
+
+
+def encode_varints(values):
+    """LEB128 bytes of non-negative integers."""
+    v = np.asarray(values, dtype=np.uint64)
+    n = np.ones(len(v), dtype=np.int64)
+    for k in range(1, 10):
+        n += v >= np.uint64(1 << (7 * k))
+    out = np.zeros(int(n.sum()), dtype=np.uint8)
+    at = np.cumsum(n) - n
+    for k in range(int(n.max()) if len(n) else 0):
+        sel = np.nonzero(n > k)[0]
+        byte = (v[sel] >> np.uint64(7 * k)) & np.uint64(0x7F)
+        more = (n[sel] > k + 1).astype(np.uint64) << np.uint64(7)
+        out[at[sel] + k] = byte | more
+    return out
+
+
+def decode_varints(data):
+    b = np.asarray(data, dtype=np.uint8)
+    if b.size == 0:
+        return np.zeros(0, dtype=np.uint64)
+    ends = np.nonzero(b < 0x80)[0]
+    starts = np.concatenate([[0], ends[:-1] + 1])
+    pos = np.arange(len(b)) - np.repeat(starts, ends - starts + 1)
+    chunks = (b & 0x7F).astype(np.uint64) << (pos.astype(np.uint64) * np.uint64(7))
+    return np.bitwise_or.reduceat(chunks, starts)
+
+
+def encode_indices(faces):
+    flat = faces.ravel().astype(np.int64)
+    delta = np.diff(flat, prepend=0)
+    zigzag = (delta << 1) ^ (delta >> 63)
+    return encode_varints(zigzag.astype(np.uint64))
+
+
+def decode_indices(data, ntris):
+    z = decode_varints(data)
+    delta = (z >> np.uint64(1)).astype(np.int64) ^ -(z & np.uint64(1)).astype(np.int64)
+    return np.cumsum(delta).astype(np.int32).reshape(ntris, 3)
+
+
+def write_binmesh(model, path, bits=16, nverts=None):
+    lo, hi = model.positions.min(axis=0), model.positions.max(axis=0)
+    if bits == 16:
+        span = np.where(hi > lo, hi - lo, 1).astype(np.float64)
+        pos = np.round((model.positions - lo) / span * 65535).astype("<u2")
+    else:
+        pos = model.positions.astype("<f4")
+    normals = np.round(vertex_normals(model) * 32767).astype("<i2")
+    index = encode_indices(model.faces)
+    header = HEADER.pack(MAGIC, VERSION, FLAG_NORMALS, nverts or model.nverts, model.nverts,
+                         len(model.faces), bits, len(index), *lo.tolist(), *hi.tolist())
+    with open(path, "wb") as f:
+        for section in (header, pos.tobytes(), normals.tobytes(), index.tobytes()):
+            f.write(section)
+            f.write(b"\0" * _pad4(len(section)))
+
+
+class BinMesh(ObjModel):
+    """A loaded .cpmesh: an ObjModel plus normals and the catalog's nVerts."""
+
+    def __init__(self, positions, faces, normals, catalog_nverts):
+        super().__init__(positions, faces)
+        self.normals = normals
+        self.catalog_nverts = catalog_nverts
+
+
+def read_binmesh(path):
+    with open(path, "rb") as f:
+        data = f.read()
+    magic, version, flags, catalog_nverts, nv, ntris, bits, index_bytes, *box = HEADER.unpack_from(data)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError(f"{path}: not a version {VERSION} .cpmesh file")
+    at = HEADER.size
+    width = 2 if bits == 16 else 4
+    pos = np.frombuffer(data, dtype="<u2" if bits == 16 else "<f4", count=nv * 3, offset=at).reshape(nv, 3)
+    at += nv * 3 * width + _pad4(nv * 3 * width)
+    if bits == 16:
+        lo, hi = np.array(box[:3]), np.array(box[3:])
+        pos = (pos * (np.where(hi > lo, hi - lo, 1) / 65535) + lo).astype(np.float32)
+    normals = None
+    if flags & FLAG_NORMALS:
+        normals = np.frombuffer(data, dtype="<i2", count=nv * 3, offset=at).reshape(nv, 3) / 32767
+        at += nv * 6 + _pad4(nv * 6)
+    faces = decode_indices(np.frombuffer(data, dtype=np.uint8, count=index_bytes, offset=at), ntris)
+    return BinMesh(np.ascontiguousarray(pos, dtype=np.float32), faces, normals, catalog_nverts)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Convert an OBJ shape model to the compact .cpmesh format.")
+    ap.add_argument("model")
+    ap.add_argument("out")
+    ap.add_argument("--bits", type=int, choices=(16, 32), default=16,
+                    help="16: positions quantized over the bounding box; 32: exact float32")
+    ap.add_argument("--nverts", type=int, help="the catalog's nVerts, if it differs from the vertex count")
+    args = ap.parse_args()
+
+    t0 = time.perf_counter()
+    model = load_obj(args.model)
+    t_obj = time.perf_counter() - t0
+    write_binmesh(model, args.out, args.bits, args.nverts)
+    t0 = time.perf_counter()
+    mesh = read_binmesh(args.out)
+    t_bin = time.perf_counter() - t0
+
+    if not np.array_equal(mesh.faces, model.faces):
+        raise SystemExit("Round trip failed: faces differ")
+    err = float(np.abs(mesh.positions.astype(np.float64) - model.positions).max()) if model.nverts else 0.0
+    obj_size, bin_size = os.path.getsize(args.model), os.path.getsize(args.out)
+    print(f"{model.nverts} vertices, {len(model.faces)} triangles, order unchanged "
+          f"(max position error {err:.3g})")
+    print(f"Size:  OBJ {obj_size / 2**20:.1f} MB -> {bin_size / 2**20:.1f} MB ({bin_size / obj_size:.1%})")
+    print(f"Parse: OBJ {t_obj:.2f}s -> {t_bin:.3f}s (Python; normals included in the binary)")
+
+
+if __name__ == "__main__":
+    main()
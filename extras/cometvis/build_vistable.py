@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+
+# build_vistable.py - build a visTable and amended metadata file without a browser.
+#
+# Does what "npm run preprocess" does (client Preprocessor + server
+# preprocessingHandlers.js), on all cores: for the first mission and first
+# instrument of the catalog, compute each image's visible vertices, b1/b2 and
+# d1/d2 (see visibility.py), drop images with nothing visible or whose m2 at
+# d1 exceeds pixScaleCutoff, and write <visTable>.new and <metaData>.new.
+# Each kept entry also gets vc, the number of vertices set in its row, and va,
+# their area in km^2 (each vertex counting a third of its faces' area), so
+# overlap can be normalized or ranked without reading the table; "python -m
+# cometvis.vistable stats" adds them to an existing pair.
+#
+# Usage (from the extras folder):
+#   python -m cometvis.build_vistable --catalog preprocess.json [--workers N]
+#
+# The catalog is found like the server's --catalog (relative to data/, or a path).
+#
+# To add images to an existing table, pass the current pair with --base-meta and
+# --base-vis: only the entries whose 'nm' isn't in the base are computed, and the
+# .new files hold the merged, 'ti'-sorted pair plus a manifest (see merge.py).
+
+import os
+import sys
+import json
+import time
+import argparse
+import concurrent.futures
+
+import numpy as np
+
+from cometvis import merge
+
+from cometvis.bvh import bvh_path
+from cometvis.datasets import DATA_DIR, fetch_datasets, preprocess_instrument
+from cometvis.objmodel import ObjModel, load_obj
+from cometvis.pyramid import Pyramid, pyramid_path
+from cometvis.vistable import area_table, open_rows, pack_row, row_bytes, visible_stats
+from cometvis.visibility import ENGINES, View, m2_from_distance, m2_multiplier, make_engine, view_visibility
+
+_W = {}     # per-worker state, set by _init_worker
+
+
+def _init_worker(positions, faces, settings):
+    model = ObjModel(positions, faces)
+    model.adjacency()       # once per worker, for the dilation of every image
+    _W.update(settings)
+    _W["model"] = model
+    _W["areas"] = area_table(model.vertex_areas(), settings["nverts"])
+    _W["engine"] = make_engine(settings["engine"], model, **settings.get("engine_args", {}))
+
+
+def compute_entry(args):
+    """Worker: (index, entry) -> (index, b1, b2, d1, d2, count, row bytes or None if dropped, vc, va)."""
+    index, entry = args
+    view = View(entry, _W["xfov"], _W["yfov"])
+    vis = view_visibility(_W["model"], view, _W["engine"], rings=_W["rings"])
+    d1, d2 = vis.d1, vis.d2
+    if m2_from_distance(entry, d1, _W["m2mult"], _W["default_res"]) > _W["pix_scale_cutoff"]:
+        d2 = d1 - 1     # too coarse: drop it, like the client does
+    if d1 > d2:
+        return index, vis.b1, vis.b2, d1, d2, vis.count, None, 0, 0.0
+    row = pack_row(vis.mask, _W["nverts"])
+    vc, va = visible_stats(np.frombuffer(row, dtype=np.uint8)[None], _W["areas"])
+    return index, vis.b1, vis.b2, d1, d2, vis.count, row, int(vc[0]), float(va[0])
+
+
+def default_workers():
+    return max(1, (os.cpu_count() or 2) - 1)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Build a visTable (.new) and amended metadata without a browser.")
+    src = ap.add_mutually_exclusive_group()
+    src.add_argument("--catalog", help="catalog JSON (relative to the data folder, or a path)")
+    src.add_argument("--mission", help="use data/<mission>/dataset.json")
+    ap.add_argument("--data", default=DATA_DIR, help="data folder (default: %(default)s)")
+    ap.add_argument("--workers", type=int, default=default_workers())
+    ap.add_argument("--engine", choices=sorted(ENGINES), default="raycast",
+                    help="raycast: the client's per-vertex ray test; zbuffer: depth-buffer rasterization, with the ray test "
+                         "for vertices on silhouettes and occlusion edges; "
+                         "dsk: SPICE ray/DSK intercepts; bvh: the raycast test through the model's BVH")
+    ap.add_argument("--zbuf-scale", type=float, default=0.5, help="zbuffer raster size relative to the image resolution")
+    ap.add_argument("--zbuf-tol", type=float, default=4.0, help="zbuffer depth tolerance, in pixel footprints")
+    ap.add_argument("--zbuf-approx", action="store_true",
+                    help="zbuffer: decide every vertex by the depth test alone (experimental: faster, but differs "
+                         "from raycast at 2-3%% of visible vertices)")
+    ap.add_argument("--dsk", help="dsk engine: DSK file (default: the Rosetta SHAP shape)")
+    ap.add_argument("--kernels", nargs="+", help="dsk engine: kernels defining the target and frame (default: Rosetta meta-kernel)")
+    ap.add_argument("--dsk-target", help="dsk engine: target body (default: 67P/C-G)")
+    ap.add_argument("--dsk-frame", help="dsk engine: body-fixed frame of the model (default: 67P/C-G_CK)")
+    ap.add_argument("--dsk-tol", type=float, help="dsk engine: km the DSK may lie in front of a visible vertex (default: 0.01)")
+    ap.add_argument("--bvh", help="bvh engine: tree file (default: <model>.bvh if present, else built at startup)")
+    ap.add_argument("--rings", type=int, default=1, help="neighbor rings added to each visible set (client: 1)")
+    ap.add_argument("--limit", type=int, help="only process the first N metadata entries (for trials)")
+    ap.add_argument("--base-meta", help="existing metadata file to add the new images to (with --base-vis)")
+    ap.add_argument("--base-vis", help="existing visTable matching --base-meta")
+    ap.add_argument("--base-manifest", help="manifest of the base (default: <base-vis>.manifest.json, if present)")
+    ap.add_argument("--pyramid", type=int, metavar="PATCH_SIZE",
+                    help="also write the coarse patch level (<visTable>.pyr.npz), this many vertices per patch")
+    ap.add_argument("--suffix", default=".new", help="suffix for the output files (default: %(default)s)")
+    args = ap.parse_args()
+    if bool(args.base_meta) != bool(args.base_vis):
+        ap.error("--base-meta and --base-vis go together")
+
+    instr = preprocess_instrument(fetch_datasets(args.data, args.catalog, args.mission), args.data)
+    entries = instr.load_metadata()
+    if args.limit:
+        entries = entries[:args.limit]
+    print(f"Metadata: {instr.meta_path} ({len(entries)} entries)", flush=True)
+    base = None
+    if args.base_meta:
+        base = merge.Base(args.base_meta, args.base_vis, instr.nverts, args.base_manifest)
+        entries = [e for e in entries if not base.known(e["nm"])]
+        print(f"Base: {args.base_meta} ({len(base.meta)} rows, {len(base.dropped)} dropped before); "
+              f"{len(entries)} new entries to compute", flush=True)
+
+    t0 = time.perf_counter()
+    model = load_obj(instr.model_path)
+    print(f"Model: {instr.model_path} ({model.nverts} vertices, {len(model.faces)} triangles, "
+          f"nVerts={instr.nverts}) loaded in {time.perf_counter() - t0:.1f}s", flush=True)
+    if model.nverts > row_bytes(instr.nverts) * 8:
+        print(f"Warning: model has more vertices than nVerts={instr.nverts}; extra bits are dropped.",
+              file=sys.stderr)
+
+    engine_args = {"default_res": instr.default_res, "scale": args.zbuf_scale, "tol_px": args.zbuf_tol,
+                   "exact": not args.zbuf_approx}
+    if args.engine == "dsk":
+        dsk_args = {"dsk": args.dsk, "kernels": args.kernels, "target": args.dsk_target,
+                    "fixref": args.dsk_frame, "tol": args.dsk_tol}
+        engine_args.update({k: v for k, v in dsk_args.items() if v is not None})
+    if args.engine == "bvh":
+        bvh_file = args.bvh or bvh_path(instr.model_path)
+        if args.bvh or os.path.isfile(bvh_file):
+            engine_args["bvh_file"] = bvh_file
+    settings = {
+        "engine": args.engine,
+        "engine_args": engine_args,
+        "rings": args.rings,
+        "nverts": instr.nverts,
+        "xfov": instr.xfov,
+        "yfov": instr.yfov,
+        "default_res": instr.default_res,
+        "m2mult": m2_multiplier(instr.xfov, instr.default_res),
+        "pix_scale_cutoff": instr.pix_scale_cutoff,
+    }
+    make_engine(args.engine, model, **engine_args)    # fail here, not in every worker, if it can't start
+    vis_file = instr.vis_path + args.suffix
+    meta_file = instr.meta_path + args.suffix
+    if base:
+        merge.check_outputs(base, vis_file, meta_file)
+
+    kept, dropped = [], []
+    out_file = vis_file + ".part" if base else vis_file
+    t0 = time.perf_counter()
+    tasks = [(i, {k: e.get(k) for k in ("sc", "cv", "up", "d1", "rz") if k in e}) for i, e in enumerate(entries)]
+    with open(out_file, "wb") as vf, concurrent.futures.ProcessPoolExecutor(
+            max_workers=args.workers, initializer=_init_worker,
+            initargs=(model.positions, model.faces, settings)) as ex:
+        for index, b1, b2, d1, d2, count, row, vc, va in ex.map(compute_entry, tasks, chunksize=2):
+            entry = entries[index]
+            if row is not None:
+                entry["b1"], entry["b2"], entry["d1"], entry["d2"] = b1, b2, d1, d2
+                entry["vc"], entry["va"] = vc, va
+                vf.write(row)
+                kept.append(entry)
+            else:
+                dropped.append(entry["nm"])
+            done = index + 1
+            if done % 100 == 0 or done == len(tasks):
+                rate = done / (time.perf_counter() - t0)
+                print(f"[{done}/{len(tasks)}] {entry['nm']}: {count} visible | kept {len(kept)} | "
+                      f"{rate:.1f} images/s", flush=True)
+
+    if base:
+        manifest = merge.write_merged(base, kept, out_file, instr.nverts, vis_file, meta_file, dropped)
+        os.remove(out_file)
+        problems = merge.verify_manifest(manifest)
+        if problems:
+            raise SystemExit("Merged table failed its manifest check:\n" + "\n".join(problems[:20]))
+        print(f"Merged {manifest['carried']} base rows and {len(kept)} new rows "
+              f"(manifest {merge.manifest_path(vis_file)} verified)", flush=True)
+        kept = manifest["rows"]
+    else:
+        with open(meta_file, "w", encoding="utf-8") as f:
+            json.dump(kept, f, separators=(",", ":"))
+        merge.write_manifest(kept, instr.nverts, vis_file, meta_file, dropped)
+    print(f"Wrote {vis_file} ({len(kept)} rows of {row_bytes(instr.nverts)} bytes) and {meta_file} "
+          f"in {time.perf_counter() - t0:.1f}s", flush=True)
+
+    if args.pyramid:
+        pyr = Pyramid.build(open_rows(vis_file, instr.nverts), model.positions, args.pyramid)
+        pyr.save(pyramid_path(vis_file))
+        print(f"Wrote {pyramid_path(vis_file)} ({pyr.npatch} patches)", flush=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,308 @@
+# bvh.py - build the shape model's bounding volume hierarchy offline, in the
+#   layout three-mesh-bvh 0.6 uses, so the client can deserialize it instead
+#   of calling computeBoundsTree() on every load, and use it here as a
+#   visibility engine.
+#
+# three-mesh-bvh keeps each tree ("root", one per geometry group; OBJLoader2
+# gives one) as an ArrayBuffer of 32-byte nodes in depth-first order, the left
+# child right after its parent:
+#
+#   float32[0..5]   bounds: min x, y, z, max x, y, z
+#   internal node:  uint32[6] = right child, as an offset in 32-bit words
+#                   uint32[7] = split axis
+#   leaf:           uint32[6] = first triangle, uint16[14] = triangle count,
+#                   uint16[15] = 0xFFFF
+#
+# and reorders the geometry's index buffer so each leaf's triangles are
+# contiguous; MeshBVH.deserialize({roots, index}, geometry) takes both back.
+# The tree is split the way computeBoundsTree() does by default (CENTER: the
+# longest axis of the triangle centers, at its midpoint; up to 10 triangles
+# per leaf, depth 40). Node bounds are the min/max of float32 positions, so
+# they are exact.
+#
+# A .bvh file is:
+#
+#   header   32 bytes, little-endian: magic "CPBVH1\0\0", version (u32),
+#            triangle count (u32), node count (u32), vertex count (u32),
+#            triangle checksum (u32), 4 reserved bytes
+#   index    u32 x 3 per triangle: the reordered index buffer
+#   nodes    node count x 32 bytes: the root buffer
+#
+# The checksum (triangle_checksum) is a sum of per-triangle hashes, so it is
+# the same for the model's index buffer and the reordered one. The client
+# (client/src/core/datasetLoader.js, when the catalog has a "bvh" entry,
+# relative to missionFolder) compares the vertex count and checksum with the
+# geometry it loaded before deserializing, and builds the tree itself if they
+# differ, e.g. after the model was compacted or renumbered. --engine bvh in
+# build_vistable.py uses the file too.
+#
+#   python -m cometvis.bvh <model.obj> [<out.bvh>]        # default <model>.bvh
+
+import os
+import time
+import struct
+import argparse
+
+import numpy as np
+
+from cometvis.objmodel import load_obj
+from cometvis.visibility import METER, PAIR_CHUNK, ray_triangle
+
+MAGIC = b"CPBVH1\0\0"
+VERSION = 2
+HEADER = struct.Struct("<8sIIIII4x")
+BYTES_PER_NODE = 32
+LEAF_FLAG = 0xFFFF
+MAX_LEAF_TRIS = 10
+MAX_DEPTH = 40
+
+
+class Bvh:
+    """
+    A built or loaded tree. index: (m, 3) reordered triangles of a model of
+    nverts vertices. Per node, in buffer order: bounds (n, 6) float32, count
+    (0 for internal nodes), offset (first triangle of a leaf), left/right
+    child, axis.
+    """
+
+    def __init__(self, nverts, index, bounds, count, offset, left, right, axis):
+        self.nverts = nverts
+        self.index = index
+        self.bounds = bounds
+        self.count = count
+        self.offset = offset
+        self.left = left
+        self.right = right
+        self.axis = axis
+
+    @property
+    def nnodes(self):
+        return len(self.bounds)
+
+    def root_buffer(self):
+        """The nodes as three-mesh-bvh's root ArrayBuffer."""
+        buf = np.zeros((self.nnodes, BYTES_PER_NODE // 4), dtype="<u4")
+        buf[:, :6] = self.bounds.astype("<f4").view("<u4")
+        leaf = self.count > 0
+        buf[leaf, 6] = self.offset[leaf]
+        buf[~leaf, 6] = self.right[~leaf] * (BYTES_PER_NODE // 4)
+        buf[~leaf, 7] = self.axis[~leaf]
+        u16 = buf.view("<u2")
+        u16[leaf, 14] = self.count[leaf]
+        u16[leaf, 15] = LEAF_FLAG
+        return buf.tobytes()
+
+    def save(self, path):
+        with open(path, "wb") as f:
+            f.write(HEADER.pack(MAGIC, VERSION, len(self.index), self.nnodes, self.nverts,
+                                triangle_checksum(self.index)))
+            f.write(self.index.astype("<u4").tobytes())
+            f.write(self.root_buffer())
+
+
+def triangle_checksum(index):
+    """
+    Sum (mod 2**32) of a 32-bit hash of each triangle's (a, b, c), which
+    doesn't depend on the order of the triangles. datasetLoader.js computes
+    the same with Math.imul.
+    """
+    t = np.asarray(index, dtype=np.uint32).reshape(-1, 3)
+    with np.errstate(over="ignore"):
+        h = (t[:, 0] * np.uint32(0x9E3779B1)) ^ t[:, 1]
+        h = (h * np.uint32(0x85EBCA77)) ^ t[:, 2]
+        h = h * np.uint32(0xC2B2AE35)
+        h ^= h >> np.uint32(16)
+    return int(h.sum(dtype=np.uint64) & 0xFFFFFFFF)
+
+
+def build_bvh(model, max_leaf_tris=MAX_LEAF_TRIS, max_depth=MAX_DEPTH):
+    """Build the tree a level at a time; all nodes of a level are split together."""
+    tri = model.positions[model.faces]
+    tmin, tmax = tri.min(axis=1), tri.max(axis=1)
+    center = (tmin.astype(np.float64) + tmax) / 2
+    order = np.arange(len(tri))
+
+    # Nodes in creation (breadth-first) order
+    bounds, count, offset, left, right, axis = [], [], [], [], [], []
+    lo, hi = np.array([0]), np.array([len(tri)])
+    depth, first = 0, 0
+    while len(lo):
+        n = hi - lo
+        starts = np.cumsum(n) - n
+        pos = np.repeat(lo - starts, n) + np.arange(int(n.sum()))
+        ids = order[pos]
+        bounds.append(np.concatenate([np.minimum.reduceat(tmin[ids], starts),
+                                      np.maximum.reduceat(tmax[ids], starts)], axis=1))
+        cmin, cmax = np.minimum.reduceat(center[ids], starts), np.maximum.reduceat(center[ids], starts)
+        ax = np.argmax(cmax - cmin, axis=1)
+        mid = (cmin[np.arange(len(n)), ax] + cmax[np.arange(len(n)), ax]) / 2
+        seg = np.repeat(np.arange(len(n)), n)
+        goes_left = center[ids, ax[seg]] < mid[seg]
+        nleft = np.add.reduceat(goes_left.astype(np.int64), starts)
+        split = (n > max_leaf_tris) & (depth < max_depth) & (nleft > 0) & (nleft < n)
+
+        # Stable partition of each split node's triangles, left side first
+        key = seg * 2 + (~goes_left & split[seg])
+        order[pos] = ids[np.argsort(key, kind="stable")]
+
+        child = first + len(n) + 2 * (np.cumsum(split) - 1)
+        count.append(np.where(split, 0, n))
+        offset.append(np.where(split, 0, lo))
+        left.append(np.where(split, child, -1))
+        right.append(np.where(split, child + 1, -1))
+        axis.append(np.where(split, ax, 0))
+        first += len(n)
+        mid_at = lo[split] + nleft[split]
+        lo = np.stack([lo[split], mid_at], axis=1).ravel()
+        hi = np.stack([mid_at, hi[split]], axis=1).ravel()
+        depth += 1
+
+    bounds, count, offset = np.concatenate(bounds), np.concatenate(count), np.concatenate(offset)
+    left, right, axis = np.concatenate(left), np.concatenate(right), np.concatenate(axis)
+
+    # Depth-first slots: the left subtree right after its parent, then the right one
+    slot = np.empty(len(count), dtype=np.int64)
+    stack, at = [0], 0
+    while stack:
+        node = stack.pop()
+        slot[node] = at
+        at += 1
+        if count[node] == 0:
+            stack.append(right[node])
+            stack.append(left[node])
+    inv = np.empty_like(slot)
+    inv[slot] = np.arange(len(slot))
+    inner = count == 0
+    left_slot, right_slot = np.full(len(count), -1), np.full(len(count), -1)
+    left_slot[inner], right_slot[inner] = slot[left[inner]], slot[right[inner]]
+    return Bvh(model.nverts, model.faces[order], bounds[inv], count[inv], offset[inv],
+               left_slot[inv], right_slot[inv], axis[inv])
+
+
+def read_bvh(path):
+    with open(path, "rb") as f:
+        data = f.read()
+    magic, version, ntris, nnodes, nverts, checksum = HEADER.unpack_from(data)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError(f"{path}: not a version {VERSION} .bvh file")
+    at = HEADER.size
+    index = np.frombuffer(data, dtype="<u4", count=ntris * 3, offset=at).reshape(ntris, 3).astype(np.int32)
+    if triangle_checksum(index) != checksum:
+        raise ValueError(f"{path}: triangle checksum doesn't match the index")
+    buf = np.frombuffer(data, dtype="<u4", count=nnodes * BYTES_PER_NODE // 4,
+                        offset=at + ntris * 12).reshape(nnodes, -1)
+    u16 = buf.view("<u2")
+    leaf = u16[:, 15] == LEAF_FLAG
+    count = np.where(leaf, u16[:, 14], 0).astype(np.int64)
+    right = np.where(leaf, -1, buf[:, 6].astype(np.int64) // (BYTES_PER_NODE // 4))
+    left = np.where(leaf, -1, np.arange(nnodes) + 1)
+    return Bvh(nverts, index, buf[:, :6].view("<f4").copy(), count, np.where(leaf, buf[:, 6], 0).astype(np.int64),
+               left, right, np.where(leaf, 0, buf[:, 7]).astype(np.int64))
+
+
+def bvh_path(model_path):
+    return model_path + ".bvh"
+
+
+def matches_model(bvh, model):
+    """True if the tree was built for the model: same vertex count, and exactly its triangles (in any order)."""
+    if bvh.nverts != model.nverts or bvh.index.shape != model.faces.shape:
+        return False
+    n = np.int64(model.nverts)
+    key = lambda t: np.sort((t[:, 0] * n + t[:, 1]) * n + t[:, 2])
+    return bool(np.array_equal(key(bvh.index.astype(np.int64)), key(model.faces.astype(np.int64))))
+
+
+class BvhEngine:
+    """
+    Nearest front-facing hit per ray by walking the tree: all rays descend
+    together, a level at a time, dropping nodes they miss or that start
+    beyond their nearest hit so far. Same triangle test as RaycastEngine.
+    """
+
+    name = "bvh"
+
+    def __init__(self, model, bvh_file=None, **options):
+        self.bvh = read_bvh(bvh_file) if bvh_file else build_bvh(model)
+        if bvh_file and not matches_model(self.bvh, model):
+            raise SystemExit(f"{bvh_file} was not built from this model")
+        p = model.positions.astype(np.float64)
+        idx = self.bvh.index
+        self.a, self.b, self.c = p[idx[:, 0]], p[idx[:, 1]], p[idx[:, 2]]
+        pad = 1e-9 * max(1.0, float(np.abs(p).max())) if len(p) else 0.0
+        self.lo = self.bvh.bounds[:, :3].astype(np.float64) - pad
+        self.hi = self.bvh.bounds[:, 3:].astype(np.float64) + pad
+
+    def visible(self, view, points, dirs, dist):
+        """
+        The client's test: the first hit along the ray is within METER of the
+        vertex. Hits past dist + METER can't change the answer, so the walk
+        stops a little beyond that (2 * METER, clear of rounding).
+        """
+        return np.abs(self.nearest(view, dirs, dist + 2 * METER) - dist) < METER
+
+    def nearest(self, view, dirs, limit=None):
+        """Distance to the first front-facing hit along each ray (inf, or limit, if none is nearer)."""
+        origin = view.sc
+        best = np.full(len(dirs), np.inf) if limit is None else np.array(limit, dtype=np.float64)
+        if len(dirs) == 0 or self.bvh.nnodes == 0:
+            return best
+        scale = np.sqrt((dirs * dirs).sum(axis=1))     # slab t is in units of |dir|
+        with np.errstate(divide="ignore"):
+            inv = 1.0 / dirs
+        tree = self.bvh
+        rays, nodes = np.arange(len(dirs)), np.zeros(len(dirs), dtype=np.int64)
+        while len(rays):
+            with np.errstate(invalid="ignore"):
+                t1 = (self.lo[nodes] - origin) * inv[rays]
+                t2 = (self.hi[nodes] - origin) * inv[rays]
+            tnear = np.fmax.reduce(np.fmin(t1, t2), axis=1)
+            tfar = np.fmin.reduce(np.fmax(t1, t2), axis=1)
+            hit = (tfar >= np.maximum(tnear, 0)) & (np.maximum(tnear, 0) * scale[rays] <= best[rays])
+            rays, nodes = rays[hit], nodes[hit]
+            leaf = tree.count[nodes] > 0
+            self._leaves(origin, dirs, rays[leaf], nodes[leaf], best)
+            rays, nodes = rays[~leaf], nodes[~leaf]
+            rays = np.concatenate([rays, rays])
+            nodes = np.concatenate([tree.left[nodes], tree.right[nodes]])
+        return best
+
+    def _leaves(self, origin, dirs, rays, nodes, best):
+        n = self.bvh.count[nodes]
+        ends = np.cumsum(n)
+        lo = 0
+        while lo < len(rays):
+            hi = max(lo + 1, int(np.searchsorted(ends, ends[lo] - n[lo] + PAIR_CHUNK, side="right")))
+            r, k = rays[lo:hi], n[lo:hi]
+            offsets = np.cumsum(k) - k
+            pair_ray = np.repeat(r, k)
+            pair_tri = np.repeat(self.bvh.offset[nodes[lo:hi]] - offsets, k) + np.arange(int(k.sum()))
+            dist = ray_triangle(origin, dirs[pair_ray], self.a[pair_tri], self.b[pair_tri], self.c[pair_tri])
+            np.minimum.at(best, pair_ray, dist)
+            lo = hi
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Build a three-mesh-bvh compatible BVH for a shape model.")
+    ap.add_argument("model")
+    ap.add_argument("out", nargs="?", help="output file (default: <model>.bvh)")
+    args = ap.parse_args()
+
+    model = load_obj(args.model)
+    t0 = time.perf_counter()
+    bvh = build_bvh(model)
+    t_build = time.perf_counter() - t0
+    out = args.out or bvh_path(args.model)
+    bvh.save(out)
+
+    back = read_bvh(out)
+    if not matches_model(back, model) or back.nnodes != bvh.nnodes:
+        raise SystemExit("Round trip failed")
+    leaves = bvh.count > 0
+    print(f"{len(model.faces)} triangles -> {bvh.nnodes} nodes ({int(leaves.sum())} leaves, "
+          f"mean {bvh.count[leaves].mean():.1f} triangles per leaf), built in {t_build:.1f}s")
+    print(f"Wrote {out} ({os.path.getsize(out) / 2**20:.1f} MB)")
+
+
+if __name__ == "__main__":
+    main()
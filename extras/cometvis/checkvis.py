@@ -0,0 +1,77 @@
+# checkvis.py - NumPy version of the server's spatial search (check_vis2 in
+#   server/c_build/checkvis2.c), and a ctypes wrapper for the C library
+#   itself, so the two can be checked against each other and timed.
+#
+# check_vis2(rows, mustMatch, filterArray, visAr): filterArray has one bit per
+# row (LSB-first within each byte, like imgSel); for every row whose bit is
+# set, count the bits the row shares with visAr (the painted vertices, a
+# visTable-format row) and clear the row's bit if the count is below
+# mustMatch. filterArray is changed in place, and bits past the last row are
+# left alone, as in C.
+
+import os
+import ctypes
+import platform
+
+import numpy as np
+
+from cometvis.vistable import _row_popcounts, chunks
+
+C_BUILD = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "server", "c_build"))
+
+
+def check_vis2(rows, must_match, filter_array, query):
+    """NumPy check_vis2 on a (mapped) table; filter_array (uint8) is updated in place."""
+    q = np.frombuffer(query, dtype=np.uint8)
+    selected = np.unpackbits(filter_array, bitorder="little")[:len(rows)].astype(bool)
+    failed = np.zeros(len(filter_array) * 8, dtype=bool)
+    for sl in chunks(rows):
+        sel = np.nonzero(selected[sl])[0]
+        if sel.size == 0:
+            continue
+        block = np.asarray(rows[sl])
+        if sel.size < len(block):
+            block = block[sel]
+        counts = _row_popcounts(np.bitwise_and(block, q))
+        failed[sl.start + sel[counts < must_match]] = True
+    filter_array &= ~np.packbits(failed, bitorder="little")
+    return filter_array
+
+
+def library_path():
+    """The prebuilt library the server would load on this platform (see server/load_c.js)."""
+    system, machine = platform.system(), platform.machine().lower()
+    if system == "Darwin":
+        return os.path.join(C_BUILD, "checkvis2.darwin.dylib")
+    if system == "Windows" and machine in ("amd64", "x86_64"):
+        return os.path.join(C_BUILD, "checkvis2.win_x64.dll")
+    if system == "Linux" and machine in ("amd64", "x86_64"):
+        return os.path.join(C_BUILD, "checkvis2.linux_x64.so")
+    raise OSError(f"No prebuilt checkvis2 library for {system}/{machine}")
+
+
+class CheckVis2Library:
+    """The C library through ctypes, with the same calls the server makes through koffi."""
+
+    def __init__(self, path=None):
+        self.lib = ctypes.CDLL(path or library_path())
+        self.lib.load_vbuff2.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_int, ctypes.c_int]
+        self.lib.load_vbuff2.restype = ctypes.c_int
+        self.lib.check_nRows2.argtypes = [ctypes.c_int]
+        self.lib.check_nRows2.restype = ctypes.c_int
+        self.lib.check_vis2.argtypes = [ctypes.c_int, ctypes.c_int,
+                                        np.ctypeslib.ndpointer(np.uint8, flags="C_CONTIGUOUS,WRITEABLE"),
+                                        np.ctypeslib.ndpointer(np.uint64, flags="C_CONTIGUOUS")]
+        self.lib.check_vis2.restype = None
+
+    def load(self, table_id, vis_file, rows, bytes_per_row):
+        err = self.lib.load_vbuff2(table_id, os.fsencode(vis_file), rows, bytes_per_row)
+        if err:
+            raise OSError(f"load_vbuff2({table_id}, {vis_file}) failed with code {err}")
+
+    def rows(self, table_id):
+        return self.lib.check_nRows2(table_id)
+
+    def check_vis2(self, table_id, must_match, filter_array, query):
+        self.lib.check_vis2(table_id, must_match, filter_array, np.frombuffer(query, dtype=np.uint64))
+        return filter_array
@@ -0,0 +1,140 @@
+# compact.py - drop unused vertices from a mission's model and shorten its
+#   visTables to match.
+#
+# A catalog's nVerts can exceed the number of vertices the client actually
+# has (see datasetLoader.js): OBJLoader2 drops 'v' lines that no face uses,
+# and the same point can appear as several vertices (duplicate 'v' lines, or
+# one 'v' line referenced as "12" and "12/3"). Every one of those still costs
+# a bit in each visTable row and in each painted mask sent to the server.
+#
+# This rewrites the model with only the vertices the client keeps (and, with
+# --weld, merges vertices at identical positions, dropping the faces that
+# collapse), reloads it to get the client's new numbering, and rewrites the
+# visTable of every instrument that uses the model: new bit j is the OR of
+# the old bits that map to it. Metadata doesn't change.
+#
+#   python -m cometvis.compact --mission cg67p [--weld] [--suffix .compact]
+#   python -m cometvis.compact --catalog dataset.json
+#
+# writes <model><suffix>, <visTable><suffix> for each instrument, and
+# <catalog><suffix>, which names those files and has the new nVerts, so it
+# can replace the old catalog as is. Derived files (.inv, .pyr.npz, sparse
+# tables, shards, and the model's .bvh) must be rebuilt from the new model and
+# tables; the new catalog drops its "bvh" and "shards" entries until they are.
+
+import os
+import time
+import argparse
+
+import numpy as np
+
+from cometvis.datasets import DATA_DIR, Instrument, catalog_path, fetch_datasets, write_catalog
+from cometvis.objmodel import load_obj
+from cometvis.renumber import read_v_lines
+from cometvis.vistable import open_rows, row_bytes
+
+REMAP_BITS = 1 << 26        # table bits remapped at a time
+
+
+def compact_model(src_path, model, out_path, weld=False):
+    """
+    Write the compacted model and return (new model, target), where old
+    vertex i is new vertex target[i] (-1 if it is gone).
+    """
+    n = model.nverts
+    canon = np.arange(n)
+    faces = model.faces
+    if weld:
+        _, group = np.unique(model.positions, axis=0, return_inverse=True)
+        first = np.full(group.max() + 1, n)
+        np.minimum.at(first, group.ravel(), canon)
+        canon = first[group.ravel()]               # each vertex -> first vertex at its position
+        faces = canon[faces]
+        faces = faces[(faces[:, 0] != faces[:, 1]) & (faces[:, 1] != faces[:, 2]) & (faces[:, 0] != faces[:, 2])]
+    used = np.unique(faces)
+    line_of = np.full(n, -1)
+    line_of[used] = np.arange(len(used))
+    v_lines = read_v_lines(src_path)
+    with open(out_path, "w", encoding="utf-8") as f:
+        f.writelines(v_lines[model.obj_index[i]] + "\n" for i in used)
+        f.writelines(f"f {a + 1} {b + 1} {c + 1}\n" for a, b, c in line_of[faces])
+    new = load_obj(out_path)
+    new_of_canon = np.full(n, -1)
+    new_of_canon[used[new.obj_index]] = np.arange(new.nverts)
+    return new, new_of_canon[canon]
+
+
+def remap_table(rows, target, new_nverts, out_path):
+    """Write rows with new bit target[i] set wherever old bit i is. Returns rows with lost bits."""
+    keep = np.nonzero(target >= 0)[0]
+    order = keep[np.argsort(target[keep], kind="stable")]
+    starts = np.searchsorted(target[order], np.arange(new_nverts))
+    nbits = row_bytes(new_nverts) * 8
+    lost = 0
+    step = max(1, REMAP_BITS // (rows.shape[1] * 8))
+    with open(out_path, "wb") as f:
+        for lo in range(0, len(rows), step):
+            bits = np.unpackbits(np.asarray(rows[lo:lo + step]), axis=1, bitorder="little")
+            dropped = np.ones(bits.shape[1], dtype=bool)
+            dropped[keep] = False
+            lost += int(bits[:, dropped].any(axis=1).sum())
+            out = np.zeros((len(bits), nbits), dtype=np.uint8)
+            out[:, :new_nverts] = np.logical_or.reduceat(bits[:, order], starts, axis=1)
+            f.write(np.packbits(out, axis=1, bitorder="little").tobytes())
+    return lost
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Drop unused vertices from a model and compact its visTables.")
+    src = ap.add_mutually_exclusive_group(required=True)
+    src.add_argument("--catalog", help="catalog JSON (relative to the data folder, or a path)")
+    src.add_argument("--mission", help="use data/<mission>/dataset.json")
+    ap.add_argument("--data", default=DATA_DIR, help="data folder (default: %(default)s)")
+    ap.add_argument("--weld", action="store_true", help="also merge vertices at identical positions")
+    ap.add_argument("--suffix", default=".compact", help="suffix for the output files (default: %(default)s)")
+    args = ap.parse_args()
+
+    catalog_file = catalog_path(args.data, args.catalog, args.mission)
+    datasets = fetch_datasets(args.data, args.catalog, args.mission)
+    done = {}
+    for mission in datasets:
+        instruments = [Instrument(mission, inst, args.data) for inst in mission["instruments"]]
+        model_path = instruments[0].model_path
+        old_nverts = instruments[0].nverts
+        if model_path not in done:
+            t0 = time.perf_counter()
+            model = load_obj(model_path)
+            new, target = compact_model(model_path, model, model_path + args.suffix, args.weld)
+            done[model_path] = (new, target)
+            print(f"{model_path}: {len(read_v_lines(model_path))} 'v' lines, {model.nverts} client vertices -> "
+                  f"{new.nverts} (wrote {model_path + args.suffix} in {time.perf_counter() - t0:.1f}s)")
+        new, target = done[model_path]
+        if old_nverts < len(target):
+            raise SystemExit(f"{mission['missionFolder']}: nVerts {old_nverts} is less than the model's "
+                             f"{len(target)} vertices")
+        # bits past the model's last vertex (nVerts > vertex count) have nowhere to go
+        target = np.concatenate([target, np.full(row_bytes(old_nverts) * 8 - len(target), -1)])
+        for instr in instruments:
+            if not os.path.isfile(instr.vis_path):
+                print(f"  {instr.vis_path}: not found, skipped")
+                continue
+            t0 = time.perf_counter()
+            rows = open_rows(instr.vis_path, old_nverts)
+            lost = remap_table(rows, target, new.nverts, instr.vis_path + args.suffix)
+            print(f"  {instr.vis_path}: {len(rows)} rows, {row_bytes(old_nverts)} -> {row_bytes(new.nverts)} bytes "
+                  f"({time.perf_counter() - t0:.1f}s)")
+            if lost:
+                print(f"  Warning: {lost} rows had bits set for vertices the compacted model doesn't have; those are dropped")
+            instr.inst["visTable"] += args.suffix
+            instr.inst.pop("shards", None)
+        print(f"  nVerts: {old_nverts} -> {new.nverts}")
+        mission["nVerts"] = new.nverts
+        mission["model"] += args.suffix
+        mission.pop("bvh", None)
+
+    write_catalog(catalog_file + args.suffix, datasets, like=catalog_file)
+    print(f"Wrote {catalog_file + args.suffix} with the new model, visTables and nVerts")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+# datasets.py - find dataset catalogs and the files they name, the way the
+#   server does (server/fetchDatasets.js and preprocessingHandlers.js).
+#
+#   1. With a catalog, load it (relative to the data folder, or as given).
+#   2. With a mission, load data/<mission>/dataset.json.
+#   3. Otherwise load every data/*/dataset.json, sorted by priority.
+#
+# Catalog JSON may be a single dict or an array of dicts; this always returns a list.
+
+import os
+import json
+
+DATA_DIR = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "data"))
+
+DEFAULT_PIX_SCALE_CUTOFF = 10.0     # same default as the client's Preprocessor
+
+
+def _to_list(x):
+    if x is None:
+        return []
+    return x if isinstance(x, list) else [x]
+
+
+def fetch_datasets(data_dir=DATA_DIR, catalog=None, mission=None):
+    if catalog:
+        path = catalog if os.path.isfile(catalog) else os.path.join(data_dir, catalog)
+        with open(path, "r", encoding="utf-8") as f:
+            return _to_list(json.load(f))
+
+    if mission:
+        with open(os.path.join(data_dir, mission, "dataset.json"), "r", encoding="utf-8") as f:
+            return _to_list(json.load(f))
+
+    datasets = []
+    for entry in sorted(os.listdir(data_dir)):
+        ds_file = os.path.join(data_dir, entry, "dataset.json")
+        if os.path.isfile(ds_file):
+            with open(ds_file, "r", encoding="utf-8") as f:
+                datasets.extend(_to_list(json.load(f)))
+    datasets.sort(key=lambda d: d.get("priority", float("inf")))
+    return datasets
+
+
+def catalog_path(data_dir=DATA_DIR, catalog=None, mission=None):
+    """The file fetch_datasets reads for a catalog or mission."""
+    if catalog:
+        return catalog if os.path.isfile(catalog) else os.path.join(data_dir, catalog)
+    return os.path.join(data_dir, mission, "dataset.json")
+
+
+def write_catalog(path, datasets, like=None):
+    """Write datasets as a catalog, as a single dict or an array like the file 'like' (default: path)."""
+    like = like or path
+    single = len(datasets) == 1
+    if os.path.isfile(like):
+        with open(like, "r", encoding="utf-8") as f:
+            single = not isinstance(json.load(f), list)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(datasets[0] if single else datasets, f, indent=2)
+
+
+class Instrument:
+    """One mission/instrument pair from a catalog, with its file paths resolved."""
+
+    def __init__(self, mission, inst, data_dir=DATA_DIR):
+        self.mission = mission
+        self.inst = inst
+        self.data_dir = data_dir
+        self.folder = os.path.join(data_dir, mission["missionFolder"], inst["instrumentFolder"])
+
+    @property
+    def model_path(self):
+        return os.path.join(self.data_dir, self.mission["missionFolder"], self.mission["model"])
+
+    @property
+    def meta_path(self):
+        return os.path.join(self.folder, self.inst["metaData"])
+
+    @property
+    def vis_path(self):
+        return os.path.join(self.folder, self.inst["visTable"])
+
+    @property
+    def nverts(self):
+        return int(self.mission["nVerts"])
+
+    @property
+    def xfov(self):
+        return float(self.inst["xFOV"])
+
+    @property
+    def yfov(self):
+        return float(self.inst["yFOV"])
+
+    @property
+    def default_res(self):
+        return float(self.inst["defaultRes"])
+
+    @property
+    def pix_scale_cutoff(self):
+        """Instrument value first, then mission, then the default (Preprocessor.getPixScaleCutoff)."""
+        return (self.inst.get("pixScaleCutoff") or self.mission.get("pixScaleCutoff")
+                or DEFAULT_PIX_SCALE_CUTOFF)
+
+    def load_metadata(self, path=None):
+        with open(path or self.meta_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+
+def preprocess_instrument(datasets, data_dir=DATA_DIR):
+    """The instrument the server preprocesses: first mission, first instrument."""
+    if not datasets:
+        raise SystemExit("No datasets found.")
+    mission = datasets[0]
+    return Instrument(mission, mission["instruments"][0], data_dir)
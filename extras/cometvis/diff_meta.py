@@ -0,0 +1,291 @@
+# diff_meta.py - compare two imageMetadata files entry by entry, matched by
+#   name, to check that a builder change left the metadata alone (or changed
+#   only what it meant to).
+#
+# Each file is streamed in byte ranges on several processes (metastream.py)
+# and reduced to columns: 64-bit hashes of nm, ti and any other keys, the
+# vectors sc, cv, up, su, b1, b2 and the numbers d1, d2, rz, vc, va (NaN where
+# missing). No entry is kept, so memory grows by about 200 bytes per entry
+# rather than with the JSON. Entries are matched on (nm, occurrence), so a
+# name repeated in both files pairs up in order. The report lists
+#
+#   added, removed   entries whose name is only in the new (b) or old (a) file
+#   reordered        matched entries outside the longest run kept in the same
+#                    relative order, i.e. the fewest that moved
+#   fields           per field, the matched entries where it is in only one
+#                    file or differs by more than its tolerance (largest
+#                    component difference; --tol NAME=VALUE), and the largest
+#                    difference seen; ti and 'other' (any other keys) must match
+#
+# with the first few examples of each, looked up again by index. The report
+# (--report, or stdout with --json) is
+#   {"a", "b", "entries": [na, nb], "duplicates": [da, db], "seconds", "identical",
+#    "added": {"count", "examples": [{"index", "nm"}]}, "removed": {...},
+#    "reordered": {"count", "examples": [{"index": [ia, ib], "nm"}]},
+#    "fields": {name: {"tolerance", "changed", "maxDelta", "examples": [{"index", "nm", "a", "b"}]}}}
+# and the exit status is 1 unless the files are identical within tolerance.
+#
+#   python -m cometvis.diff_meta old/imageMetadata_phase2.json new/imageMetadata_phase2.json
+#   python -m cometvis.diff_meta a.json b.json --tol cv=1e-6 --tol up=1e-6 --report diff.json
+
+import os
+import json
+import time
+import bisect
+import argparse
+import concurrent.futures
+
+import numpy as np
+
+from cometvis.metastream import byte_ranges, iter_chunks, iter_entries, string_hashes
+
+VECTORS = ("sc", "cv", "up", "su", "b1", "b2")
+NUMBERS = ("d1", "d2", "rz", "vc", "va")
+STRINGS = ("ti", "other")
+FIELDS = VECTORS + NUMBERS
+KNOWN = set(FIELDS + ("nm", "ti"))
+TOLERANCES = {"sc": 1e-6, "cv": 1e-9, "up": 1e-9, "su": 1e-6, "b1": 1e-6, "b2": 1e-6,
+              "d1": 1e-6, "d2": 1e-6, "rz": 0.0, "vc": 0.0, "va": 1e-6}    # km (km^2 for va), or unitless
+EXAMPLES = 10
+
+
+def _vector(chunk, name):
+    out = np.full((len(chunk), 3), np.nan)
+    has = np.array([name in e for e in chunk], dtype=bool)
+    try:
+        out[has] = np.array([e[name] for e in chunk if name in e], dtype=np.float64).reshape(-1, 3)
+    except (TypeError, ValueError):
+        for k in np.nonzero(has)[0]:
+            try:
+                out[k] = np.array(chunk[k][name], dtype=np.float64).reshape(3)
+            except (TypeError, ValueError):
+                pass
+    return out, has
+
+
+def _number(chunk, name):
+    vals = [e.get(name) for e in chunk]
+    has = np.array([name in e for e in chunk], dtype=bool)
+    out = np.array([float(v) if isinstance(v, (int, float)) else np.nan for v in vals])
+    return out, has
+
+
+def chunk_columns(chunk):
+    """{column: array} for one chunk of entries; "has_<field>" says which entries have the field."""
+    chunk = [e if isinstance(e, dict) else {} for e in chunk]
+    cols = {"nm": string_hashes([str(e.get("nm", "")) for e in chunk]),
+            "ti": string_hashes([str(e.get("ti", "")) for e in chunk])}
+    other = [{k: v for k, v in e.items() if k not in KNOWN} if not e.keys() <= KNOWN else None for e in chunk]
+    cols["other"] = string_hashes([json.dumps(x, sort_keys=True, separators=(",", ":")) if x else "" for x in other])
+    for name in FIELDS:
+        cols[name], cols["has_" + name] = (_vector if name in VECTORS else _number)(chunk, name)
+    return cols
+
+
+def read_range(path, start, end):
+    """Columns for the entries starting in one byte range."""
+    parts = [chunk_columns(chunk) for chunk in iter_chunks(path, start, end)]
+    if not parts:
+        parts = [chunk_columns([])]
+    return {name: np.concatenate([p[name] for p in parts]) for name in parts[0]}
+
+
+def read_files(paths, workers=1):
+    """For each path, (columns, ranges) where ranges is [(start, end, first entry), ...]."""
+    jobs = [(i, a, b) for i, path in enumerate(paths)
+            for a, b in (byte_ranges(path, workers * 4) if workers > 1 else [(0, None)])]
+    if workers > 1:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as ex:
+            parts = list(ex.map(read_range, [paths[i] for i, _, _ in jobs], [a for _, a, _ in jobs],
+                                [b for _, _, b in jobs]))
+    else:
+        parts = [read_range(paths[i], a, b) for i, a, b in jobs]
+    out = []
+    for i in range(len(paths)):
+        mine = [(job, part) for job, part in zip(jobs, parts) if job[0] == i]
+        ranges, first = [], 0
+        for (_, a, b), part in mine:
+            ranges.append((a, b, first))
+            first += len(part["nm"])
+        cols = {name: np.concatenate([part[name] for _, part in mine]) for name in mine[0][1]}
+        out.append((cols, ranges))
+    return out
+
+
+def occurrences(h):
+    """For each value, how many times it appeared earlier in the array."""
+    order = np.argsort(h, kind="stable")
+    sh = h[order]
+    first = np.ones(len(sh), dtype=bool)
+    first[1:] = sh[1:] != sh[:-1]
+    starts = np.maximum.accumulate(np.where(first, np.arange(len(sh)), 0))
+    occ = np.empty(len(h), dtype=np.int64)
+    occ[order] = np.arange(len(sh)) - starts
+    return occ
+
+
+def match(ha, hb):
+    """(ia, ib) of the entries matched by (name hash, occurrence), in a's order."""
+    keys = []
+    for h in (ha, hb):
+        k = np.empty(len(h), dtype=[("h", "<i8"), ("o", "<i8")])
+        k["h"], k["o"] = h, occurrences(h)
+        keys.append(k)
+    _, ia, ib = np.intersect1d(keys[0], keys[1], assume_unique=True, return_indices=True)
+    order = np.argsort(ia)
+    return ia[order], ib[order]
+
+
+def moved(seq):
+    """Indices into seq outside one longest increasing subsequence."""
+    if len(seq) < 2 or np.all(np.diff(seq) > 0):
+        return np.zeros(0, dtype=np.int64)
+    tails, tail_at = [], []
+    prev = np.full(len(seq), -1, dtype=np.int64)
+    for k, v in enumerate(seq.tolist()):
+        j = bisect.bisect_left(tails, v)
+        if j:
+            prev[k] = tail_at[j - 1]
+        if j == len(tails):
+            tails.append(v)
+            tail_at.append(k)
+        else:
+            tails[j], tail_at[j] = v, k
+    keep = np.zeros(len(seq), dtype=bool)
+    k = tail_at[-1]
+    while k >= 0:
+        keep[k] = True
+        k = prev[k]
+    return np.nonzero(~keep)[0]
+
+
+def field_changes(a, b, ia, ib, name, tol):
+    """(changed mask over the matched pairs, largest difference among them)."""
+    if name in STRINGS:
+        return a[name][ia] != b[name][ib], None
+    va, vb = a[name][ia], b[name][ib]
+    has_a, has_b = a["has_" + name][ia], b["has_" + name][ib]
+    nan_a, nan_b = np.isnan(va), np.isnan(vb)
+    with np.errstate(invalid="ignore"):
+        delta = np.where(nan_a | nan_b, 0.0, np.abs(va - vb))
+    if delta.ndim > 1:
+        delta = delta.max(axis=1)
+        nan_a, nan_b = nan_a.any(axis=1), nan_b.any(axis=1)
+    both = has_a & has_b
+    changed = (has_a != has_b) | (both & ((delta > tol) | (nan_a != nan_b)))
+    return changed, float(delta[both].max()) if both.any() else 0.0
+
+
+def entries_at(path, ranges, indices):
+    """{index: entry} for the given entry indices, reading only the ranges that hold them."""
+    want = sorted(set(int(k) for k in indices))
+    found = {}
+    for start, end, first in ranges:
+        mine = [k for k in want if k >= first and k not in found]
+        if not mine:
+            continue
+        for k, (_, entry) in enumerate(iter_entries(path, start, end), first):
+            if k in mine:
+                found[k] = entry
+            if k >= mine[-1]:
+                break
+    return found
+
+
+def diff(path_a, path_b, tolerances=None, workers=1):
+    """Compare two metadata files; returns the report dict."""
+    tol = dict(TOLERANCES, **(tolerances or {}))
+    t_start = time.perf_counter()
+    (a, ranges_a), (b, ranges_b) = read_files([path_a, path_b], workers)
+    na, nb = len(a["nm"]), len(b["nm"])
+    ia, ib = match(a["nm"], b["nm"])
+    removed = np.setdiff1d(np.arange(na), ia)
+    added = np.setdiff1d(np.arange(nb), ib)
+    reordered = moved(ib)
+
+    fields = {}
+    for name in FIELDS + STRINGS:
+        changed, max_delta = field_changes(a, b, ia, ib, name, tol.get(name, 0.0))
+        fields[name] = {"tolerance": tol.get(name, 0.0) if name in FIELDS else None,
+                        "changed": int(changed.sum()), "maxDelta": max_delta,
+                        "pairs": np.nonzero(changed)[0][:EXAMPLES]}
+
+    need_a = set(removed[:EXAMPLES].tolist()) | set(ia[reordered[:EXAMPLES]].tolist())
+    need_b = set(added[:EXAMPLES].tolist()) | set(ib[reordered[:EXAMPLES]].tolist())
+    for res in fields.values():
+        need_a |= set(ia[res["pairs"]].tolist())
+        need_b |= set(ib[res["pairs"]].tolist())
+    ea, eb = entries_at(path_a, ranges_a, need_a), entries_at(path_b, ranges_b, need_b)
+    nm = lambda e: e.get("nm", "") if isinstance(e, dict) else ""
+    value = lambda e, name: (e.get(name) if name != "other" else {k: v for k, v in e.items() if k not in KNOWN}) \
+        if isinstance(e, dict) else None
+
+    for name, res in fields.items():
+        res["examples"] = [{"index": [int(ia[p]), int(ib[p])], "nm": nm(ea[ia[p]]),
+                            "a": value(ea[ia[p]], name), "b": value(eb[ib[p]], name)} for p in res.pop("pairs")]
+    report = {
+        "a": path_a, "b": path_b, "entries": [na, nb],
+        "duplicates": [int((occurrences(a["nm"]) > 0).sum()), int((occurrences(b["nm"]) > 0).sum())],
+        "seconds": round(time.perf_counter() - t_start, 3),
+        "added": {"count": len(added), "examples": [{"index": int(k), "nm": nm(eb[k])} for k in added[:EXAMPLES]]},
+        "removed": {"count": len(removed), "examples": [{"index": int(k), "nm": nm(ea[k])} for k in removed[:EXAMPLES]]},
+        "reordered": {"count": len(reordered), "examples": [{"index": [int(ia[p]), int(ib[p])], "nm": nm(ea[ia[p]])}
+                                                            for p in reordered[:EXAMPLES]]},
+        "fields": fields}
+    report["identical"] = not (len(added) or len(removed) or len(reordered)
+                               or any(res["changed"] for res in fields.values()))
+    return report
+
+
+def print_report(report):
+    na, nb = report["entries"]
+    print(f"{report['a']} ({na} entries) vs {report['b']} ({nb} entries), {report['seconds']:.2f}s")
+    if any(report["duplicates"]):
+        print(f"  duplicate names: {report['duplicates'][0]} in a, {report['duplicates'][1]} in b")
+    for what in ("added", "removed", "reordered"):
+        res = report[what]
+        if res["count"]:
+            print(f"  {what}: {res['count']}")
+            for x in res["examples"][:3]:
+                where = "#{}->#{}".format(*x["index"]) if isinstance(x["index"], list) else f"#{x['index']}"
+                print(f"    {where} {x['nm']}")
+    for name, res in report["fields"].items():
+        if res["changed"]:
+            limit = f", max difference {res['maxDelta']:.3g} (tolerance {res['tolerance']:g})" \
+                if res["maxDelta"] is not None else ""
+            print(f"  {name}: {res['changed']} changed{limit}")
+            for x in res["examples"][:3]:
+                print("    #{}->#{} {}: {} -> {}".format(*x["index"], x["nm"], json.dumps(x["a"]), json.dumps(x["b"])))
+    print("  IDENTICAL" if report["identical"] else "  DIFFERENT")
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Compare two imageMetadata files, matching entries by name.")
+    ap.add_argument("a", help="old metadata JSON")
+    ap.add_argument("b", help="new metadata JSON")
+    ap.add_argument("--tol", action="append", default=[], metavar="FIELD=VALUE",
+                    help=f"tolerance for a field ({', '.join(FIELDS)}); repeatable")
+    ap.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 2) - 1))
+    ap.add_argument("--report", help="write the JSON report here")
+    ap.add_argument("--json", action="store_true", help="print the JSON report instead of a summary")
+    args = ap.parse_args()
+
+    tolerances = {}
+    for item in args.tol:
+        name, _, value = item.partition("=")
+        if name not in FIELDS or not value:
+            ap.error(f"--tol {item}: expected FIELD=VALUE with FIELD one of {', '.join(FIELDS)}")
+        tolerances[name] = float(value)
+    report = diff(args.a, args.b, tolerances, args.workers)
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=1)
+    if args.json:
+        print(json.dumps(report, indent=1))
+    else:
+        print_report(report)
+    return 0 if report["identical"] else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,58 @@
+# dsk.py - visibility engine that uses the SPICE DSK shape instead of the OBJ model.
+#
+# All vertex rays of an image go to SPICE in one vectorized ray/surface call
+# (dskxv). A vertex is visible unless the DSK surface is hit more than 'tol'
+# before reaching it; a ray that misses the DSK altogether counts as visible
+# (the OBJ vertex lies outside the DSK shape there). Since the DSK and the OBJ
+# model are different shape models, tol is much looser than the raycast
+# engine's METER. The result is an independent check on the mesh-based
+# engines, and needs no triangle search of our own.
+#
+# Needs spiceypy (imported when the engine is created), the DSK, and kernels
+# that define the target body and its body-fixed frame (e.g. the mission
+# meta-kernel). Model and metadata coordinates are assumed to be in that frame.
+
+import os
+
+import numpy as np
+
+# Rosetta defaults (same files as json_from_pds3_rosetta.py and pds_to_jpgs_parallel.py)
+DSK_SHAPE = "/home/djk/anaconda3/envs/asp/data/rosetta_updated/kernels/dsk/ROS_CG_M004_OSPGDLR_N_V1.BDS"
+MK_TM     = "/home/djk/anaconda3/envs/asp/data/rosetta_updated/kernels/mk/ROS_OPS_V350_20220906_001_abhinav.TM"
+TARGET    = "67P/C-G"
+FIXREF    = "67P/C-G_CK"
+DSK_TOL   = 0.01        # km
+
+
+class DskEngine:
+    name = "dsk"
+
+    def __init__(self, model, dsk=DSK_SHAPE, kernels=(MK_TM,), target=TARGET, fixref=FIXREF,
+                 tol=DSK_TOL, et=0.0, **options):
+        try:
+            import spiceypy as spice
+        except ImportError:
+            raise SystemExit("The dsk engine needs spiceypy (pip install spiceypy).")
+        self.spice = spice
+        for path in list(kernels) + [dsk]:
+            if not os.path.exists(path):
+                raise SystemExit(f"Missing kernel file: {path}")
+            spice.furnsh(path)
+        self.target, self.fixref = target, fixref
+        self.tol = tol
+        self.et = et        # DSK shapes here are not time-dependent; any epoch covered by the kernels works
+
+    def intercepts(self, view, dirs):
+        """Distance from view.sc to the DSK surface along each ray (inf where the ray misses)."""
+        n = len(dirs)
+        if n == 0:
+            return np.zeros(0)
+        vtx = np.repeat(view.sc[None, :], n, axis=0)
+        xpt, found = self.spice.dskxv(False, self.target, [], self.et, self.fixref, vtx, np.asarray(dirs))
+        found = np.asarray(found, dtype=bool)
+        dist = np.full(n, np.inf)
+        dist[found] = np.linalg.norm(np.asarray(xpt)[found] - view.sc, axis=1)
+        return dist
+
+    def visible(self, view, points, dirs, dist):
+        return self.intercepts(view, dirs) > dist - self.tol
@@ -0,0 +1,114 @@
+# invindex.py - vertex -> image inverted index of a visTable.
+#
+# checkvis2 answers "which images see at least mustMatch of the painted
+# vertices" by ANDing the painted mask with every row of the table, so each
+# query costs the whole table no matter how small the painted region is.
+# Transposing the table gives, for each vertex, the sorted list of images that
+# see it (a posting list). A query then only touches the painted vertices'
+# postings: count how often each image occurs in them and compare with
+# mustMatch, in time proportional to the ROI rather than to the table.
+#
+# The index is stored as two .npy files in <visTable>.inv/ so it can be
+# memory-mapped: offsets (nVerts+1, int64) and images (uint16 when the table
+# has fewer than 65536 rows, else uint32), vertex v's postings being
+# images[offsets[v]:offsets[v+1]].
+#
+#   python -m cometvis.invindex <visTable> --nverts N [--out DIR]
+
+import os
+import time
+import argparse
+
+import numpy as np
+
+from cometvis.vistable import open_rows
+
+UNPACK_BITS = 1 << 26       # table bits unpacked at a time while building
+
+
+def _bit_blocks(rows, nverts):
+    """(first row, (rows, nverts) uint8 0/1 array) over the table, UNPACK_BITS at a time."""
+    step = max(1, UNPACK_BITS // (rows.shape[1] * 8))
+    for lo in range(0, len(rows), step):
+        block = np.asarray(rows[lo:lo + step])
+        yield lo, np.unpackbits(block, axis=1, bitorder="little")[:, :nverts]
+
+
+def build_index(rows, nverts, out_dir):
+    """Transpose a mapped table into out_dir/{offsets,images}.npy. Returns an InvertedIndex."""
+    os.makedirs(out_dir, exist_ok=True)
+    counts = np.zeros(nverts, dtype=np.int64)
+    for _, bits in _bit_blocks(rows, nverts):
+        counts += bits.sum(axis=0, dtype=np.int64)
+    offsets = np.zeros(nverts + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    np.save(os.path.join(out_dir, "offsets.npy"), offsets)
+
+    dtype = np.uint16 if len(rows) <= 0xFFFF else np.uint32
+    images = np.lib.format.open_memmap(os.path.join(out_dir, "images.npy"), mode="w+",
+                                       dtype=dtype, shape=(int(offsets[-1]),))
+    cursor = offsets[:-1].copy()
+    for lo, bits in _bit_blocks(rows, nverts):
+        vv, rr = np.nonzero(bits.T)                 # by vertex, then by row: postings stay sorted
+        per_vertex = np.bincount(vv, minlength=nverts)
+        first = np.cumsum(per_vertex) - per_vertex  # where each vertex's run starts in vv
+        images[cursor[vv] + np.arange(len(vv)) - first[vv]] = rr + lo
+        cursor += per_vertex
+    images.flush()
+    return InvertedIndex(out_dir)
+
+
+class InvertedIndex:
+    """A built index, memory-mapped."""
+
+    def __init__(self, path):
+        self.offsets = np.load(os.path.join(path, "offsets.npy"))
+        self.images = np.load(os.path.join(path, "images.npy"), mmap_mode="r")
+        self.nverts = len(self.offsets) - 1
+
+    def postings(self, v):
+        """Sorted row numbers of the images that see vertex v."""
+        return self.images[self.offsets[v]:self.offsets[v + 1]]
+
+    def match_counts(self, vertices, nrows):
+        """For each of the nrows images, how many of the given vertices it sees."""
+        vertices = np.asarray(vertices, dtype=np.int64)
+        starts, ends = self.offsets[vertices], self.offsets[vertices + 1]
+        lens = ends - starts
+        total = int(lens.sum())
+        if total == 0:
+            return np.zeros(nrows, dtype=np.int64)
+        # Gather all postings of the ROI at once: position k of run j is starts[j] + k
+        run_start = np.cumsum(lens) - lens
+        idx = np.arange(total) + np.repeat(starts - run_start, lens)
+        return np.bincount(self.images[idx], minlength=nrows)
+
+    def match(self, vertices, must_match, nrows, candidates=None):
+        """
+        Bool per image: sees at least must_match of the vertices (checkvis2's
+        test). candidates, like checkvis2's filterArray, limits the images
+        considered.
+        """
+        hits = self.match_counts(vertices, nrows) >= must_match
+        return hits if candidates is None else hits & candidates
+
+
+def index_path(vis_file):
+    return vis_file + ".inv"
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Build the vertex -> image inverted index of a visTable.")
+    ap.add_argument("vis")
+    ap.add_argument("--nverts", type=int, required=True, help="model vertex count (mission nVerts)")
+    ap.add_argument("--out", help="index folder (default: <visTable>.inv)")
+    args = ap.parse_args()
+    rows = open_rows(args.vis, args.nverts)
+    t0 = time.perf_counter()
+    index = build_index(rows, args.nverts, args.out or index_path(args.vis))
+    print(f"Indexed {len(rows)} rows: {len(index.images)} postings "
+          f"({index.images.nbytes / 2**20:.1f} MB, {index.images.dtype}) in {time.perf_counter() - t0:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
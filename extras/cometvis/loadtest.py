@@ -0,0 +1,338 @@
+# loadtest.py - load generator and latency benchmark for the server's spatial
+#   search (clientRequestsVis in server/runtimeHandlers.js).
+#
+# Each clientRequestsVis runs c_check_vis2 synchronously on the Node event
+# loop, so concurrent users queue behind each other. This tool speaks
+# Socket.IO to a running server (or starts one with --start), sends the
+# requests the client would send and measures what users would see:
+#
+#   payloads    regions of the installed mission (the k vertices nearest a
+#               random vertex, sizes from --roi), sent as FilterEngine sends
+#               them: {imgSels: [[tableIndex, imgSel]], visAr, mustMatch},
+#               imgSel holding each table's bbox candidates and mustMatch
+#               ceil(k * percent / 100). Each reply is checked against the
+#               answer search.py computes offline.
+#   ramp        for each --clients level, that many virtual clients, each on
+#               its own connection, send requests back to back (with
+#               --think ms between) for --duration seconds
+#   probe       meanwhile one more client sends a request with no candidate
+#               images every --probe-interval ms; it costs the server next to
+#               nothing, so its latency above the idle baseline estimates how
+#               long the event loop was blocked (the stall)
+#
+# With --start the server is run here on an HTTP port and its "Spatial search"
+# log lines give the server-side time of every request, from which each level
+# also reports the busy fraction of the event loop. The server always serves
+# the repository's data folder; --catalog/--mission must match how it was
+# started, so the table indices agree.
+#
+# Results go to --out as JSON: {"label", "started", "url", "host", "dataset",
+# "payloads", "baseline", "levels": [{"clients", "requests", "errors",
+# "mismatches", "throughput", "latencyMs": {p50, p90, p95, p99, max, mean},
+# "probeMs", "stallMs", "serverMs", "busy"}]}. --compare prints a level-by-
+# level comparison with an earlier results file.
+#
+# Needs python-socketio with its asyncio client (pip install "python-socketio[asyncio_client]").
+#
+#   python -m cometvis.loadtest --mission cg67p --start --clients 1,2,4,8,16 --out results.json
+#   python -m cometvis.loadtest --url http://localhost:8082 --mission cg67p --label v3.1 --compare results.json
+
+import os
+import re
+import sys
+import json
+import time
+import socket
+import asyncio
+import argparse
+import platform
+import threading
+import subprocess
+
+import numpy as np
+
+from cometvis.datasets import DATA_DIR, fetch_datasets
+from cometvis.search import Mission
+from cometvis.synthetic import roi
+from cometvis.vistable import pack_row
+
+SERVER = os.path.join(os.path.dirname(DATA_DIR), "server", "cometserver.js")
+PERCENTILES = (50, 90, 95, 99)
+_LOG_LINE = re.compile(r"Spatial search \[(loadtest-[^\]]*)\]: ([0-9.eE+-]+) ms")
+
+
+def _socketio():
+    try:
+        import socketio
+    except ImportError:
+        raise SystemExit('The load test needs python-socketio (pip install "python-socketio[asyncio_client]").')
+    return socketio
+
+
+def latency_stats(ms):
+    """{p50, p90, p95, p99, max, mean} of a list of milliseconds (None when empty)."""
+    if not len(ms):
+        return None
+    ms = np.asarray(ms, dtype=np.float64)
+    out = {f"p{p}": round(float(np.percentile(ms, p)), 3) for p in PERCENTILES}
+    out.update(max=round(float(ms.max()), 3), mean=round(float(ms.mean()), 3))
+    return out
+
+
+def table_offset(datasets, mission_index):
+    """tableIndex of the mission's first instrument: the server numbers instruments in catalog order."""
+    return sum(len(m["instruments"]) for m in datasets[:mission_index])
+
+
+def make_payloads(mission, offset, count, sizes, percent, seed=0):
+    """[(message, expected imgSels)] for count regions, sizes taken in turn."""
+    rng = np.random.default_rng(seed)
+    positions = mission.positions.astype(np.float64)
+    payloads = []
+    for k in range(count):
+        region = mission.region(vertices=roi(positions, rng.integers(len(positions)), sizes[k % len(sizes)]))
+        imgsels, expected = [], []
+        for t, images in enumerate(mission.images):
+            cand = images.candidates(region)
+            hits = images.overlap([region], percent)[0]
+            imgsels.append([offset + t, np.packbits(cand, bitorder="little").tobytes()])
+            expected.append(np.packbits(cand & hits, bitorder="little").tobytes())
+        mask = np.zeros(len(positions), dtype=bool)
+        mask[region.vertices] = True
+        message = {"imgSels": imgsels, "visAr": pack_row(mask, mission.images[0].instr.nverts),
+                   "mustMatch": region.must_match(percent)}
+        payloads.append((message, expected))
+    return payloads
+
+
+def probe_payload(mission, offset):
+    """A request with no candidate images: it measures the queue, not the search."""
+    imgsels = [[offset + t, bytes(-(-images.count // 8))] for t, images in enumerate(mission.images)]
+    return {"imgSels": imgsels, "visAr": bytes(len(pack_row([], mission.images[0].instr.nverts))), "mustMatch": 1}
+
+
+def _same(reply, expected):
+    return (isinstance(reply, list) and len(reply) == len(expected)
+            and all(bytes(sel) == want for (_, sel), want in zip(reply, expected)))
+
+
+class ServerLog:
+    """Runs the server and collects the time of each "Spatial search" its log reports, by client ID."""
+
+    def __init__(self, port, catalog=None, mission=None, node="node"):
+        cmd = [node, SERVER, "--protocol=http", f"--port={port}"]
+        if catalog:
+            cmd.append(f"--catalog={catalog}")
+        elif mission:
+            cmd.append(f"--mission={mission}")
+        self.proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, bufsize=1)
+        self.times = []             # (arrival time, client ID, ms)
+        self.lines = []
+        self.ready = threading.Event()
+        threading.Thread(target=self._read, daemon=True).start()
+
+    def _read(self):
+        for line in self.proc.stdout:
+            m = _LOG_LINE.search(line)
+            if m:
+                self.times.append((time.perf_counter(), m.group(1), float(m.group(2))))
+                continue
+            self.lines.append(line.rstrip())
+            if "Server running on port" in line:
+                self.ready.set()
+        self.ready.set()
+
+    def wait(self, port, timeout=60):
+        """Wait until the server accepts connections (after it has loaded its tables)."""
+        deadline = time.time() + timeout
+        self.ready.wait(timeout)
+        while time.time() < deadline and self.proc.poll() is None:
+            try:
+                socket.create_connection(("127.0.0.1", port), 1).close()
+                return
+            except OSError:
+                time.sleep(0.2)
+        raise SystemExit("The server didn't start:\n" + "\n".join(self.lines[-20:]))
+
+    def window(self, t0, t1, probe_id):
+        """Server times (ms) of the load clients' requests logged in [t0, t1]."""
+        return [ms for t, cid, ms in self.times if t0 <= t <= t1 and cid != probe_id]
+
+    def stop(self):
+        self.proc.terminate()
+        try:
+            self.proc.wait(10)
+        except subprocess.TimeoutExpired:
+            self.proc.kill()
+
+
+async def _connect(sio_module, url, client_id, timeout):
+    sio = sio_module.AsyncClient(reconnection=False)
+    sep = "&" if "?" in url else "?"
+    await sio.connect(f"{url}{sep}clientID={client_id}", transports=["websocket"], wait_timeout=timeout)
+    return sio
+
+
+async def _client(sio, payloads, start, stop, think, timeout, record):
+    k = start
+    while time.perf_counter() < stop:
+        message, expected = payloads[k % len(payloads)]
+        k += 1
+        t0 = time.perf_counter()
+        try:
+            reply = await sio.call("clientRequestsVis", message, timeout=timeout)
+        except Exception:   # timeouts and disconnects count as errors
+            record.append((t0, None, False))
+            continue
+        record.append((t0, (time.perf_counter() - t0) * 1e3, reply is not None and _same(reply, expected)))
+        if think:
+            await asyncio.sleep(think / 1e3)
+
+
+async def _probe(sio, message, interval, stop, timeout, record):
+    while time.perf_counter() < stop:
+        t0 = time.perf_counter()
+        try:
+            await sio.call("clientRequestsVis", message, timeout=timeout)
+            record.append((time.perf_counter() - t0) * 1e3)
+        except Exception:
+            pass
+        await asyncio.sleep(max(0.0, interval / 1e3 - (time.perf_counter() - t0)))
+
+
+async def run_ramp(args, payloads, probe_message, server=None):
+    sio_module = _socketio()
+    probe_id = "loadtest-probe"
+    probe = await _connect(sio_module, args.url, probe_id, args.timeout)
+    baseline = []
+    await _probe(probe, probe_message, args.probe_interval, time.perf_counter() + args.baseline, args.timeout, baseline)
+    base_ms = float(np.median(baseline)) if baseline else 0.0
+    print(f"Idle probe latency: median {base_ms:.2f} ms over {len(baseline)} probes")
+
+    clients, levels = [], []
+    try:
+        for n in args.clients:
+            while len(clients) < n:
+                clients.append(await _connect(sio_module, args.url, f"loadtest-{len(clients)}", args.timeout))
+            record, probes = [], []
+            t0 = time.perf_counter()
+            stop = t0 + args.duration
+            await asyncio.gather(
+                _probe(probe, probe_message, args.probe_interval, stop, args.timeout, probes),
+                *(_client(sio, payloads, k * 7919, stop, args.think, args.timeout, record)
+                  for k, sio in enumerate(clients[:n])))
+            t1 = time.perf_counter()
+            ok = [ms for _, ms, _ in record if ms is not None]
+            level = {"clients": n, "seconds": round(t1 - t0, 3), "requests": len(record),
+                     "errors": sum(ms is None for _, ms, _ in record),
+                     "mismatches": sum(ms is not None and not good for _, ms, good in record),
+                     "throughput": round(len(ok) / (t1 - t0), 2), "latencyMs": latency_stats(ok),
+                     "probeMs": latency_stats(probes),
+                     "stallMs": latency_stats([max(0.0, p - base_ms) for p in probes])}
+            if server is not None:
+                await asyncio.sleep(0.2)        # let the last log lines arrive
+                served = server.window(t0, t1 + 0.2, probe_id)
+                level["serverMs"] = latency_stats(served)
+                level["busy"] = round(sum(served) / 1e3 / (t1 - t0), 3)
+            levels.append(level)
+            _print_level(level)
+    finally:
+        for sio in clients + [probe]:
+            await sio.disconnect()
+    return {"probes": len(baseline), "probeMs": latency_stats(baseline)}, levels
+
+
+def _print_level(level):
+    lat, stall = level["latencyMs"] or {}, level["stallMs"] or {}
+    busy = f" busy {level['busy']:.0%}" if "busy" in level else ""
+    print(f"{level['clients']:>4} clients: {level['throughput']:>8.1f} req/s | latency p50 {lat.get('p50', 0):>8.2f} "
+          f"p99 {lat.get('p99', 0):>8.2f} max {lat.get('max', 0):>8.2f} ms | stall p99 {stall.get('p99', 0):>7.2f} ms"
+          f"{busy} | {level['errors']} errors, {level['mismatches']} wrong")
+
+
+def compare(old, new):
+    print(f"{'clients':>7} {'req/s':>17} {'p50 ms':>19} {'p99 ms':>19}   ({old.get('label') or 'old'} -> "
+          f"{new.get('label') or 'new'})")
+    before = {lv["clients"]: lv for lv in old["levels"]}
+    for lv in new["levels"]:
+        was = before.get(lv["clients"])
+        if not was:
+            continue
+        a, b = was["latencyMs"] or {}, lv["latencyMs"] or {}
+        print(f"{lv['clients']:>7} {was['throughput']:>8.1f}->{lv['throughput']:<8.1f} "
+              f"{a.get('p50', 0):>9.2f}->{b.get('p50', 0):<9.2f} {a.get('p99', 0):>9.2f}->{b.get('p99', 0):<9.2f}")
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Load-test the server's spatial search (clientRequestsVis).")
+    src = ap.add_mutually_exclusive_group()
+    src.add_argument("--catalog", help="the catalog the server was started with")
+    src.add_argument("--mission", help="the mission the server was started with")
+    ap.add_argument("--data", default=DATA_DIR, help="data folder (default: %(default)s)")
+    ap.add_argument("--mission-index", type=int, default=0, help="which of the catalog's missions to query")
+    ap.add_argument("--url", help="server URL (default: http://localhost:PORT)")
+    ap.add_argument("--port", type=int, default=8082)
+    ap.add_argument("--start", action="store_true", help="start the server here (node server/cometserver.js)")
+    ap.add_argument("--node", default="node", help="node executable for --start")
+    ap.add_argument("--clients", default="1,2,4,8,16,32", help="concurrent clients per level")
+    ap.add_argument("--duration", type=float, default=10, help="seconds per level")
+    ap.add_argument("--think", type=float, default=0, help="ms each client waits between requests")
+    ap.add_argument("--roi", default="50,300,2000", help="region sizes in vertices, used in turn")
+    ap.add_argument("--percent", type=float, default=75, help="percent overlap (client default: 75)")
+    ap.add_argument("--payloads", type=int, default=200, help="distinct requests to cycle through")
+    ap.add_argument("--probe-interval", type=float, default=50, help="ms between probe requests")
+    ap.add_argument("--baseline", type=float, default=3, help="seconds of idle probing before the ramp")
+    ap.add_argument("--timeout", type=float, default=60, help="seconds before a request counts as an error")
+    ap.add_argument("--label", help="name for this run (e.g. a version), saved in the results")
+    ap.add_argument("--out", help="write the results here (JSON)")
+    ap.add_argument("--compare", help="earlier results file to compare with")
+    args = ap.parse_args()
+    args.clients = [int(n) for n in args.clients.split(",")]
+    args.url = args.url or f"http://localhost:{args.port}"
+    _socketio()     # fail before the slow setup
+
+    datasets = fetch_datasets(args.data, args.catalog, args.mission)
+    if not 0 <= args.mission_index < len(datasets):
+        raise SystemExit(f"The catalog has {len(datasets)} mission(s).")
+    t0 = time.perf_counter()
+    mission = Mission(datasets[args.mission_index], args.data)
+    offset = table_offset(datasets, args.mission_index)
+    payloads = make_payloads(mission, offset, args.payloads, [int(k) for k in args.roi.split(",")], args.percent)
+    tables = [{"tableIndex": offset + t, "name": s.name, "rows": s.count, "rowBytes": s.rows.shape[1]}
+              for t, s in enumerate(mission.images)]
+    print(f"{datasets[args.mission_index].get('mission', '')}: {len(payloads)} payloads over "
+          + ", ".join(f"{t['name']} ({t['rows']} rows)" for t in tables) + f" in {time.perf_counter() - t0:.1f}s")
+
+    server = None
+    if args.start:
+        server = ServerLog(args.port, args.catalog, args.mission, args.node)
+        server.wait(args.port)
+    try:
+        baseline, levels = asyncio.run(run_ramp(args, payloads, probe_payload(mission, offset), server))
+    finally:
+        if server is not None:
+            server.stop()
+
+    results = {
+        "label": args.label, "started": time.strftime("%Y-%m-%dT%H:%M:%S"), "url": args.url,
+        "host": {"platform": platform.platform(), "cpus": os.cpu_count(), "python": sys.version.split()[0]},
+        "dataset": {"mission": datasets[args.mission_index].get("mission"), "tables": tables},
+        "payloads": {"count": len(payloads), "roi": args.roi, "percent": args.percent,
+                     "meanCandidates": round(float(np.mean([sum(bin(b).count("1") for b in sel)
+                                                            for m, _ in payloads for _, sel in m["imgSels"]])), 1)},
+        "settings": {"duration": args.duration, "think": args.think, "probeInterval": args.probe_interval,
+                     "serverLog": server is not None},
+        "baseline": baseline, "levels": levels}
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=1)
+        print(f"Wrote {args.out}")
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            compare(json.load(f), results)
+    if any(lv["mismatches"] for lv in levels):
+        raise SystemExit("Some replies differ from the offline search results.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,195 @@
+# merge.py - add newly computed rows to an existing visTable/metadata pair.
+#
+# build_vistable.py --base-meta/--base-vis uses this to compute only the
+# images whose 'nm' is not already in the base metadata (or was dropped by an
+# earlier run, per the base manifest), and then writes one merged pair, sorted
+# by 'ti' like json_from_pds3_rosetta.py sorts its output, with the rows
+# permuted to follow the merged metadata.
+#
+# Alongside the merged visTable goes a manifest (<visTable>.manifest.json)
+# listing, for every output row, its name, where it came from (base row index,
+# or newly computed) and a hash of its bytes, plus the names dropped so far.
+# Full builds write one too (write_manifest: every row computed), so the images
+# they dropped aren't recomputed by the first incremental run on top of them.
+# verify_manifest() re-reads the base and merged tables and checks that every
+# carried row is byte-for-byte the base row it claims to be:
+#
+#   python -m cometvis.merge <manifest.json>
+
+import os
+import sys
+import json
+import hashlib
+import argparse
+
+import numpy as np
+
+from cometvis.vistable import open_rows, row_bytes
+
+MANIFEST_VERSION = 1
+COPY_ROWS = 1024            # rows gathered per write
+
+
+def row_hash(row):
+    return hashlib.blake2b(row, digest_size=16).hexdigest()
+
+
+def manifest_path(vis_file):
+    return vis_file + ".manifest.json"
+
+
+def load_manifest(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+class Base:
+    """An existing visTable and its metadata, mapped read-only."""
+
+    def __init__(self, meta_file, vis_file, nverts, manifest_file=None):
+        with open(meta_file, "r", encoding="utf-8") as f:
+            self.meta = json.load(f)
+        self.meta_file, self.vis_file = meta_file, vis_file
+        self.rows = open_rows(vis_file, nverts, count=len(self.meta))
+        self.names = {e["nm"]: i for i, e in enumerate(self.meta)}
+        if len(self.names) != len(self.meta):
+            raise SystemExit(f"{meta_file}: duplicate 'nm' entries")
+        manifest_file = manifest_file or manifest_path(vis_file)
+        self.dropped = set()
+        if os.path.isfile(manifest_file):
+            self.dropped = set(load_manifest(manifest_file).get("dropped", []))
+
+    def known(self, nm):
+        """True if nm already has a row, or an earlier run dropped it."""
+        return nm in self.names or nm in self.dropped
+
+
+def check_outputs(base, vis_file, meta_file):
+    """Refuse to write the merged pair over the base it is read from (the base stays mapped while writing)."""
+    outputs = (vis_file, meta_file, manifest_path(vis_file))
+    for path in (base.vis_file, base.meta_file):
+        for out in outputs:
+            if os.path.realpath(path) == os.path.realpath(out) or (
+                    os.path.exists(out) and os.path.samefile(path, out)):
+                raise SystemExit(f"The base {path} is also an output ({out}); use another --suffix "
+                                 f"or move the base aside")
+
+
+def merge_order(base_meta, new_meta):
+    """(source, index) pairs for the merged table, sorted by 'ti' (stable: base rows first on ties)."""
+    order = [("base", i) for i in range(len(base_meta))] + [("new", i) for i in range(len(new_meta))]
+    metas = {"base": base_meta, "new": new_meta}
+    order.sort(key=lambda s: metas[s[0]][s[1]].get("ti", ""))
+    return order
+
+
+def write_merged(base, new_meta, new_vis, nverts, vis_file, meta_file, dropped=()):
+    """
+    Write the merged visTable and metadata, and the manifest next to vis_file.
+    new_vis holds the rows of new_meta, in order. Returns the manifest dict.
+    """
+    new_rows = open_rows(new_vis, nverts, count=len(new_meta))
+    order = merge_order(base.meta, new_meta)
+    sources = {"base": base.rows, "new": new_rows}
+    records = []
+    with open(vis_file, "wb") as vf:
+        for lo in range(0, len(order), COPY_ROWS):
+            chunk = order[lo:lo + COPY_ROWS]
+            block = np.empty((len(chunk), row_bytes(nverts)), dtype=np.uint8)
+            for k, (src, i) in enumerate(chunk):
+                block[k] = sources[src][i]
+                rec = {"nm": (base.meta if src == "base" else new_meta)[i]["nm"], "hash": row_hash(block[k])}
+                if src == "base":
+                    rec["baseIndex"] = i
+                records.append(rec)
+            vf.write(block.tobytes())
+
+    merged = [(base.meta if src == "base" else new_meta)[i] for src, i in order]
+    with open(meta_file, "w", encoding="utf-8") as f:
+        json.dump(merged, f, separators=(",", ":"))
+
+    manifest = {
+        "version": MANIFEST_VERSION,
+        "nVerts": nverts,
+        "rowBytes": row_bytes(nverts),
+        "base": {"meta": os.path.abspath(base.meta_file), "vis": os.path.abspath(base.vis_file),
+                 "rows": len(base.meta)},
+        "output": {"meta": os.path.abspath(meta_file), "vis": os.path.abspath(vis_file), "rows": len(merged)},
+        "carried": len(base.meta),
+        "computed": len(new_meta),
+        "dropped": sorted(base.dropped | set(dropped)),
+        "rows": records,
+    }
+    with open(manifest_path(vis_file), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=1)
+    return manifest
+
+
+def write_manifest(meta, nverts, vis_file, meta_file, dropped=()):
+    """The manifest of a full build: every row of vis_file computed, plus the names it dropped."""
+    rows = open_rows(vis_file, nverts, count=len(meta))
+    manifest = {
+        "version": MANIFEST_VERSION,
+        "nVerts": nverts,
+        "rowBytes": row_bytes(nverts),
+        "base": None,
+        "output": {"meta": os.path.abspath(meta_file), "vis": os.path.abspath(vis_file), "rows": len(meta)},
+        "carried": 0,
+        "computed": len(meta),
+        "dropped": sorted(dropped),
+        "rows": [{"nm": e["nm"], "hash": row_hash(rows[k])} for k, e in enumerate(meta)],
+    }
+    with open(manifest_path(vis_file), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=1)
+    return manifest
+
+
+def verify_manifest(manifest):
+    """Check a manifest against its files. Returns a list of problems (empty if all is well)."""
+    nverts = manifest["nVerts"]
+    out = manifest["output"]
+    problems = []
+    try:
+        rows = open_rows(out["vis"], nverts, count=len(manifest["rows"]))
+        with open(out["meta"], "r", encoding="utf-8") as f:
+            names = [e["nm"] for e in json.load(f)]
+    except (OSError, ValueError) as e:
+        return [str(e)]
+    base_rows = None
+    if manifest["carried"]:
+        try:
+            base_rows = open_rows(manifest["base"]["vis"], nverts, count=manifest["base"]["rows"])
+        except (OSError, ValueError) as e:
+            problems.append(f"base: {e}")
+
+    if names != [r["nm"] for r in manifest["rows"]]:
+        problems.append("metadata order differs from the manifest")
+    carried = 0
+    for k, rec in enumerate(manifest["rows"]):
+        h = row_hash(rows[k])
+        if h != rec["hash"]:
+            problems.append(f"row {k} ({rec['nm']}): hash differs from the manifest")
+        if "baseIndex" in rec:
+            carried += 1
+            if base_rows is not None and row_hash(base_rows[rec["baseIndex"]]) != h:
+                problems.append(f"row {k} ({rec['nm']}): differs from base row {rec['baseIndex']}")
+    if carried != manifest["carried"]:
+        problems.append(f"{carried} carried rows listed, expected {manifest['carried']}")
+    return problems
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Verify a merged visTable against its manifest.")
+    ap.add_argument("manifest")
+    args = ap.parse_args()
+    manifest = load_manifest(args.manifest)
+    problems = verify_manifest(manifest)
+    for p in problems[:20]:
+        print(p)
+    print(f"{manifest['carried']} carried and {manifest['computed']} computed rows: "
+          f"{'FAIL' if problems else 'PASS'}")
+    sys.exit(1 if problems else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,269 @@
+# metapack.py - a columnar binary form of an imageMetadata JSON file.
+#
+# The client fetches and JSON.parses the whole metadata array, then builds
+# vectors from each entry's lists. A .cpmeta bundle holds the same values as
+# one little-endian array per field, so a reader can map the file and view
+# each column as a typed array (Float64Array, Float32Array, ...) without
+# parsing:
+#
+#   header      32 bytes: magic "CPMETA1\0", version (u32), entry count (u32),
+#               column count (u32), 12 reserved bytes
+#   directory   48 bytes per column: name (16 bytes, NUL-padded), type (4 bytes:
+#               "f8", "f4", "i4" or "str"), width (u32), 4 reserved bytes,
+#               byte offset (u64), byte length (u64)
+#   columns     each starting on an 8-byte boundary
+#
+# Numeric columns are count x width values: sc, cv, up, su (f8 x 3), b1, b2
+# (f4 x 3 when that is lossless, as it is for bounds taken from the float32
+# model, else f8), d1, d2, va (f8), rz (i4, 0 when the entry has none), vc (i4,
+# -1 when the entry has none) and t, the 'ti' time as seconds since 1970 UTC
+# (f8), for time-window queries. A missing vector, depth or area is NaN.
+# String columns (nm, ti, and 'extra', the JSON of any other keys) are
+# count+1 u32 offsets followed by the UTF-8 bytes; string i is
+# bytes[offsets[i]:offsets[i+1]]. Columns no entry has are left out, so
+# phase 1 metadata has no b1/b2/d1/d2.
+#
+# "catalog" packs every instrument of a catalog and records each bundle in
+# the instrument's dictionary as "metaPack": {"file", "entries", "bytes",
+# "sha256"} (file relative to instrumentFolder, like metaData).
+#
+#   python -m cometvis.metapack pack <imageMetadata.json> [<out.cpmeta>]
+#   python -m cometvis.metapack unpack <in.cpmeta> <out.json>
+#   python -m cometvis.metapack catalog --mission cg67p
+#   python -m cometvis.metapack check --mission cg67p     # bundles still match their sha256
+
+import os
+import json
+import time
+import struct
+import hashlib
+import argparse
+
+import numpy as np
+
+from cometvis.datasets import DATA_DIR, Instrument, catalog_path, fetch_datasets, write_catalog
+
+MAGIC = b"CPMETA1\0"
+VERSION = 1
+HEADER = struct.Struct("<8sIII12x")
+COLUMN = struct.Struct("<16s4sI4xQQ")
+ALIGN = 8
+
+VECTORS = ("sc", "cv", "up", "su", "b1", "b2")
+SINGLE_VECTORS = ("b1", "b2")       # stored as f4 when lossless
+SCALARS = ("d1", "d2", "va")
+INTEGERS = {"rz": 0, "vc": -1}      # value stored for entries without one
+STRINGS = ("nm", "ti")
+KNOWN = set(VECTORS + SCALARS + STRINGS) | set(INTEGERS)
+
+
+def pack_strings(strings):
+    data = [s.encode("utf-8") for s in strings]
+    offsets = np.zeros(len(data) + 1, dtype="<u4")
+    np.cumsum([len(b) for b in data], out=offsets[1:])
+    return offsets.tobytes() + b"".join(data)
+
+
+def unpack_strings(buf, count):
+    offsets = np.frombuffer(buf, dtype="<u4", count=count + 1)
+    data = bytes(buf[(count + 1) * 4:])
+    return [data[offsets[i]:offsets[i + 1]].decode("utf-8") for i in range(count)]
+
+
+def ti_seconds(ti):
+    """'ti' strings as float seconds since 1970 UTC (NaN where missing)."""
+    t = np.array([s.rstrip("Z") if s else "NaT" for s in ti], dtype="datetime64[ms]")
+    return np.where(np.isnat(t), np.nan, t.astype(np.int64) / 1000.0)
+
+
+def metadata_columns(entries):
+    """{name: (type, width, bytes)} for the entries, in file order."""
+    n = len(entries)
+    cols = {}
+    for name in STRINGS:
+        cols[name] = ("str", 1, pack_strings([e.get(name, "") for e in entries]))
+    cols["t"] = ("f8", 1, ti_seconds([e.get("ti") for e in entries]).astype("<f8").tobytes())
+    for name in VECTORS:
+        if not any(name in e for e in entries):
+            continue
+        v = np.array([e.get(name, (np.nan,) * 3) for e in entries], dtype=np.float64).reshape(n, 3)
+        kind = "f8"
+        if name in SINGLE_VECTORS and np.array_equal(v.astype(np.float32).astype(np.float64), v, equal_nan=True):
+            kind = "f4"
+        cols[name] = (kind, 3, v.astype("<" + kind).tobytes())
+    for name in SCALARS:
+        if any(name in e for e in entries):
+            cols[name] = ("f8", 1, np.array([e.get(name, np.nan) for e in entries], dtype="<f8").tobytes())
+    for name, missing in INTEGERS.items():
+        if any(name in e for e in entries):
+            cols[name] = ("i4", 1, np.array([e.get(name, missing) for e in entries], dtype="<i4").tobytes())
+    extra = [{k: v for k, v in e.items() if k not in KNOWN} for e in entries]
+    if any(extra):
+        cols["extra"] = ("str", 1, pack_strings([json.dumps(x, separators=(",", ":")) if x else "" for x in extra]))
+    return cols
+
+
+def column_arrays(entries):
+    """{name: array}, what MetaPack.column gives for a bundle of these entries, without writing one."""
+    out = {}
+    for name, (kind, width, data) in metadata_columns(entries).items():
+        if kind == "str":
+            out[name] = unpack_strings(np.frombuffer(data, dtype=np.uint8), len(entries))
+        else:
+            a = np.frombuffer(data, dtype="<" + kind)
+            out[name] = a.reshape(len(entries), width) if width > 1 else a
+    return out
+
+
+def write_metapack(entries, path):
+    """Write the bundle; returns its SHA-256 (hex)."""
+    cols = metadata_columns(entries)
+    at = HEADER.size + COLUMN.size * len(cols)
+    directory, body = [], []
+    for name, (kind, width, data) in cols.items():
+        at += -at % ALIGN
+        directory.append(COLUMN.pack(name.encode(), kind.encode(), width, at, len(data)))
+        body.append((at, data))
+        at += len(data)
+    digest = hashlib.sha256()
+    with open(path, "wb") as f:
+        for chunk in [HEADER.pack(MAGIC, VERSION, len(entries), len(cols))] + directory:
+            f.write(chunk)
+            digest.update(chunk)
+        for offset, data in body:
+            pad = b"\0" * (offset - f.tell())
+            for chunk in (pad, data):
+                f.write(chunk)
+                digest.update(chunk)
+    return digest.hexdigest()
+
+
+def file_sha256(path, block=1 << 24):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(block), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class MetaPack:
+    """A mapped .cpmeta file: column(name) gives a (count,) or (count, width) array view."""
+
+    def __init__(self, path):
+        self.path = path
+        self.buf = np.memmap(path, dtype=np.uint8, mode="r")
+        magic, version, self.count, ncols = HEADER.unpack_from(self.buf)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path}: not a version {VERSION} .cpmeta file")
+        self.directory = {}
+        for k in range(ncols):
+            name, kind, width, offset, nbytes = COLUMN.unpack_from(self.buf, HEADER.size + k * COLUMN.size)
+            self.directory[name.rstrip(b"\0").decode()] = (kind.rstrip(b"\0").decode(), width, offset, nbytes)
+
+    def __len__(self):
+        return self.count
+
+    def __contains__(self, name):
+        return name in self.directory
+
+    def column(self, name):
+        kind, width, offset, nbytes = self.directory[name]
+        raw = self.buf[offset:offset + nbytes]
+        if kind == "str":
+            return unpack_strings(raw, self.count)
+        a = raw.view("<" + kind)
+        return a.reshape(self.count, width) if width > 1 else a
+
+    def entries(self):
+        """The metadata as JSON-ready dicts, keys in the usual order."""
+        cols = {name: self.column(name) for name in self.directory if name != "t"}
+        out = []
+        for i in range(self.count):
+            e = {"nm": cols["nm"][i], "ti": cols["ti"][i]}
+            for name in VECTORS:
+                if name in cols and not np.isnan(cols[name][i, 0]):
+                    e[name] = cols[name][i].astype(np.float64).tolist()
+            for name in SCALARS:
+                if name in cols and not np.isnan(cols[name][i]):
+                    e[name] = float(cols[name][i])
+            for name, missing in INTEGERS.items():
+                if name in cols and cols[name][i] != missing:
+                    e[name] = int(cols[name][i])
+            if "extra" in cols and cols["extra"][i]:
+                e.update(json.loads(cols["extra"][i]))
+            out.append(e)
+        return out
+
+
+def pack_path(meta_path):
+    root, ext = os.path.splitext(meta_path)
+    return (root if ext == ".json" else meta_path) + ".cpmeta"
+
+
+def pack_file(meta_path, out_path=None):
+    """Pack one metadata file and check it reads back the same. Returns (out_path, manifest entry)."""
+    out_path = out_path or pack_path(meta_path)
+    with open(meta_path, "r", encoding="utf-8") as f:
+        entries = json.load(f)
+    sha = write_metapack(entries, out_path)
+    if MetaPack(out_path).entries() != entries:
+        raise SystemExit(f"{out_path}: doesn't read back as {meta_path}")
+    return out_path, {"file": os.path.basename(out_path), "entries": len(entries),
+                      "bytes": os.path.getsize(out_path), "sha256": sha}
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Convert imageMetadata JSON to and from columnar .cpmeta bundles.")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    p = sub.add_parser("pack", help="pack one metadata file")
+    p.add_argument("meta")
+    p.add_argument("out", nargs="?", help="default: the metadata name with .cpmeta")
+    p = sub.add_parser("unpack", help="write a bundle back out as JSON")
+    p.add_argument("pack")
+    p.add_argument("out")
+    for cmd, text in (("catalog", "pack every instrument of a catalog and record the bundles in it"),
+                      ("check", "check each instrument's bundle against its recorded sha256")):
+        p = sub.add_parser(cmd, help=text)
+        src = p.add_mutually_exclusive_group(required=True)
+        src.add_argument("--catalog", help="catalog JSON (relative to the data folder, or a path)")
+        src.add_argument("--mission", help="use data/<mission>/dataset.json")
+        p.add_argument("--data", default=DATA_DIR, help="data folder (default: %(default)s)")
+    args = ap.parse_args()
+
+    if args.cmd == "pack":
+        t0 = time.perf_counter()
+        out, info = pack_file(args.meta, args.out)
+        print(f"Wrote {out}: {info['entries']} entries, {os.path.getsize(args.meta) / 2**20:.1f} MB -> "
+              f"{info['bytes'] / 2**20:.1f} MB in {time.perf_counter() - t0:.1f}s (sha256 {info['sha256'][:16]}...)")
+    elif args.cmd == "unpack":
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(MetaPack(args.pack).entries(), f, separators=(",", ":"))
+        print(f"Wrote {args.out}")
+    elif args.cmd == "check":
+        bad = 0
+        for mission in fetch_datasets(args.data, args.catalog, args.mission):
+            for inst in mission["instruments"]:
+                info = inst.get("metaPack")
+                if not info:
+                    continue
+                path = os.path.join(Instrument(mission, inst, args.data).folder, info["file"])
+                ok = os.path.isfile(path) and file_sha256(path) == info["sha256"]
+                bad += not ok
+                print(f"{path}: {'OK' if ok else 'MISSING OR CHANGED'}")
+        if bad:
+            raise SystemExit(f"{bad} bundle(s) don't match the catalog")
+    else:
+        catalog_file = catalog_path(args.data, args.catalog, args.mission)
+        datasets = fetch_datasets(args.data, args.catalog, args.mission)
+        for mission in datasets:
+            for inst in mission["instruments"]:
+                instr = Instrument(mission, inst, args.data)
+                _, inst["metaPack"] = pack_file(instr.meta_path)
+                print(f"{instr.meta_path}: {inst['metaPack']['entries']} entries -> {inst['metaPack']['file']} "
+                      f"({inst['metaPack']['bytes'] / 2**20:.1f} MB)")
+        write_catalog(catalog_file, datasets)
+        print(f"Updated {catalog_file}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+# metastream.py - read an imageMetadata JSON array an entry at a time, in
+#   bounded memory, optionally just the entries that start in a byte range (so
+#   several processes can share one file).
+#
+# The file is read in blocks through an incremental UTF-8 decoder and each
+# entry is parsed with json's raw_decode; byte offsets are kept by adding up
+# the encoded length of the text consumed. A byte range [start, end) covers
+# the entries whose '{' lies in it: a reader starting mid-file skips to the
+# next '{', which assumes entries are flat (no objects nested inside an
+# entry, true of every metadata file the tools write). If that assumption
+# fails, the parse fails loudly rather than skipping entries; read from 0
+# (one range) to avoid it.
+
+import os
+import re
+import json
+import codecs
+import hashlib
+
+import numpy as np
+
+BLOCK = 1 << 22         # bytes read at a time
+CHUNK = 8192            # entries per chunk from iter_chunks
+
+_SEP = re.compile(r"[\s,\[]*")
+
+
+def _nbytes(text, a, b):
+    """UTF-8 length of text[a:b]."""
+    seg = text[a:b]
+    return len(seg) if seg.isascii() else len(seg.encode("utf-8"))
+
+
+def _next_object(path, start):
+    """Byte offset of the first '{' at or after start."""
+    with open(path, "rb") as f:
+        f.seek(start)
+        at = start
+        while True:
+            block = f.read(BLOCK)
+            if not block:
+                return at
+            k = block.find(b"{")
+            if k >= 0:
+                return at + k
+            at += len(block)
+
+
+def iter_entries(path, start=0, end=None, block=BLOCK):
+    """(byte offset, entry) for each entry of the array that starts in [start, end)."""
+    dec = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder("utf-8")()
+    if start > 0:
+        start = _next_object(path, start)
+    with open(path, "rb") as f:
+        f.seek(start)
+        buf, pos, eof = "", start, False        # pos: byte offset of buf[0]
+        while not eof:
+            more = f.read(block)
+            eof = not more
+            buf += utf8.decode(more, final=eof)
+            i = 0
+            while True:
+                j = _SEP.match(buf, i).end()
+                at = pos + _nbytes(buf, i, j)
+                if j >= len(buf):
+                    pos, i = at, j
+                    break
+                if buf[j] == "]":
+                    return
+                if buf[j] != "{":
+                    raise ValueError(f"{path}: expected an entry at byte {at}, found {buf[j]!r}")
+                if end is not None and at >= end:
+                    return
+                try:
+                    entry, k = dec.raw_decode(buf, j)
+                except json.JSONDecodeError:
+                    if eof:
+                        raise
+                    pos, i = at, j
+                    break
+                yield at, entry
+                pos, i = at + _nbytes(buf, j, k), k
+            buf = buf[i:]
+    if buf.strip():
+        raise ValueError(f"{path}: unexpected end of file")
+
+
+def string_hashes(strings):
+    """64-bit hashes (blake2b) of strings, as int64, for matching names without keeping them."""
+    return np.array([int.from_bytes(hashlib.blake2b(s.encode(), digest_size=8).digest(), "little", signed=True)
+                     for s in strings], dtype=np.int64)
+
+
+def iter_chunks(path, start=0, end=None, size=CHUNK):
+    """Lists of up to size entries, in file order (see iter_entries)."""
+    chunk = []
+    for _, entry in iter_entries(path, start, end):
+        chunk.append(entry)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def byte_ranges(path, parts):
+    """[start, end) ranges splitting the file into about equal parts."""
+    size = os.path.getsize(path)
+    cuts = np.linspace(0, size, max(1, parts) + 1).astype(np.int64)
+    return [(int(a), int(b)) for a, b in zip(cuts[:-1], cuts[1:]) if b > a]
@@ -0,0 +1,137 @@
+# objmodel.py - load an OBJ shape model with the same vertex numbering the
+#   client uses, so vertex i here is bit i of a visTable row.
+#
+# The client loads models with OBJLoader2().setUseIndices(true). That loader
+# does not keep the order of the 'v' lines: it numbers vertices in order of
+# their first reference in the face stream (polygons are fan-triangulated as
+# (1, i, i+1)), keyed on the reference text (so "12", "12/3" and "12//7" are
+# different vertices). Vertices that no face references are dropped. This is
+# why a dataset's nVerts can differ from the number of 'v' lines.
+
+import numpy as np
+
+
+class ObjModel:
+    """positions: (n, 3) float32 in loader order. faces: (m, 3) int32 into positions."""
+
+    def __init__(self, positions, faces, obj_index=None):
+        self.positions = positions
+        self.faces = faces
+        self.obj_index = obj_index      # 'v' line (0-based) of each position, or None
+        self._adjacency = None
+
+    @property
+    def nverts(self):
+        return len(self.positions)
+
+    def face_normals(self):
+        """Unnormalized face normals, (b-a) x (c-a), in float64."""
+        p = self.positions.astype(np.float64)
+        a, b, c = p[self.faces[:, 0]], p[self.faces[:, 1]], p[self.faces[:, 2]]
+        return np.cross(b - a, c - a)
+
+    def vertex_areas(self):
+        """Each vertex's share of the surface (a third of each face it is on), in model units squared."""
+        area = 0.5 * np.sqrt((self.face_normals() ** 2).sum(axis=1))
+        return np.bincount(self.faces.ravel(), weights=np.repeat(area / 3, 3), minlength=self.nverts)
+
+    def adjacency(self):
+        """CSR vertex adjacency (indptr, indices) of the faces, built on first use."""
+        if self._adjacency is None:
+            self._adjacency = vertex_adjacency(self.faces, self.nverts)
+        return self._adjacency
+
+    def dilate(self, mask, rings=1):
+        """mask grown by rings of face neighbors (same result as one_ring applied rings times)."""
+        return dilate(self.adjacency(), mask, rings)
+
+
+def load_obj(path):
+    """Read an OBJ file and number its vertices like OBJLoader2 (see above)."""
+    v_lines = []
+    face_refs = []          # [(ref tokens, number of 'v' lines seen so far)]
+    with open(path, "r", encoding="utf-8", errors="ignore") as f:
+        for line in f:
+            if not line or line[0] not in "vf":
+                continue
+            parts = line.split()
+            if not parts:
+                continue
+            tag = parts[0]
+            if tag == "v":
+                v_lines.append(parts[1:4])
+            elif tag == "f":
+                if len(parts) >= 4:
+                    face_refs.append((parts[1:], len(v_lines)))
+
+    verts = np.array(v_lines, dtype=np.float64).astype(np.float32).reshape(-1, 3)
+    if not face_refs:
+        return ObjModel(np.zeros((0, 3), np.float32), np.zeros((0, 3), np.int32), np.zeros(0, np.int64))
+
+    # Fan-triangulate, keeping the reference text of every corner
+    tri_refs = []
+    for refs, seen in face_refs:
+        for i in range(1, len(refs) - 1):
+            tri_refs.append((refs[0], refs[i], refs[i + 1], seen))
+
+    # Number the distinct reference strings by first appearance
+    keys = {}
+    key_vindex = []
+    faces = np.empty((len(tri_refs), 3), dtype=np.int32)
+    for t, (r0, r1, r2, seen) in enumerate(tri_refs):
+        for k, ref in enumerate((r0, r1, r2)):
+            idx = keys.get(ref)
+            if idx is None:
+                idx = len(key_vindex)
+                keys[ref] = idx
+                vi = int(ref.split("/", 1)[0])
+                key_vindex.append(vi - 1 if vi > 0 else vi + seen)
+            faces[t, k] = idx
+
+    obj_index = np.array(key_vindex, dtype=np.int64)
+    return ObjModel(verts[obj_index], faces, obj_index)
+
+
+def one_ring(faces, mask):
+    """
+    Grow a per-vertex mask by one ring: every vertex of a face that touches a
+    masked vertex becomes masked (the client's expandPaint(1)).
+    """
+    hit = mask[faces].any(axis=1)
+    out = mask.copy()
+    out[faces[hit].ravel()] = True
+    return out
+
+
+def vertex_adjacency(faces, nverts):
+    """
+    Neighbors of each vertex (vertices sharing a face with it), as CSR arrays:
+    vertex v's neighbors are indices[indptr[v]:indptr[v + 1]], sorted.
+    """
+    src = faces[:, [0, 0, 1, 1, 2, 2]].ravel().astype(np.int64)
+    dst = faces[:, [1, 2, 0, 2, 0, 1]].ravel().astype(np.int64)
+    pairs = np.unique(src * nverts + dst)
+    indptr = np.zeros(nverts + 1, dtype=np.int64)
+    np.cumsum(np.bincount(pairs // nverts, minlength=nverts), out=indptr[1:])
+    return indptr, (pairs % nverts).astype(np.int32)
+
+
+def dilate(adjacency, mask, rings=1):
+    """
+    Grow a per-vertex mask by rings of neighbors, like expandPaint(rings).
+    Each ring only gathers the neighbors of the vertices the previous ring
+    added, so the cost follows the size of the mask, not of the model.
+    """
+    indptr, indices = adjacency
+    out = mask.copy()
+    frontier = np.nonzero(mask)[0]
+    for _ in range(rings):
+        if frontier.size == 0:
+            break
+        starts, lens = indptr[frontier], indptr[frontier + 1] - indptr[frontier]
+        run_start = np.cumsum(lens) - lens
+        nb = indices[np.arange(int(lens.sum())) + np.repeat(starts - run_start, lens)]
+        nb = nb[~out[nb]]
+        out[nb] = True
+        frontier = np.unique(nb)
+    return out
@@ -0,0 +1,136 @@
+# pyramid.py - a coarse visibility level over patches of vertices, to skip
+#   most rows of the fine visTable during an ROI search.
+#
+# Vertices are grouped into patches of about patch_size consecutive vertices
+# along a Hilbert curve through the body (so each patch is a compact piece of
+# surface), and each image gets one bit per patch: set if the image sees any
+# vertex of the patch. For an ROI, an image can share at most
+#
+#     sum over the ROI's patches p that the image sees of |ROI ∩ p|
+#
+# vertices with the query, so rows where that bound is below mustMatch are
+# rejected without reading their fine row; only the rest are checked bit for
+# bit. The result is exactly checkvis2's.
+#
+# Stored as <visTable>.pyr.npz: patch_of (nVerts,) int32, the vertex -> patch
+# map in client vertex order, and coarse, (rows, ceil(patches/64)*8) uint8
+# rows in visTable bit order.
+#
+#   python -m cometvis.pyramid <model.obj> <visTable> [--patch-size 256] [--nverts N]
+#
+# The table's rows are nVerts bits (--nverts, the catalog's value; default:
+# the model's vertex count); bits past the model's last vertex belong to no
+# patch.
+
+import time
+import argparse
+
+import numpy as np
+
+from cometvis.objmodel import load_obj
+from cometvis.renumber import curve_keys
+from cometvis.vistable import match_counts, open_rows, row_bytes
+
+PATCH_SIZE = 256
+COARSE_BITS = 1 << 26       # fine table bits reduced at a time
+
+
+def make_patches(positions, patch_size=PATCH_SIZE):
+    """Patch number of each vertex: runs of patch_size vertices in Hilbert order."""
+    order = np.argsort(curve_keys(positions), kind="stable")
+    patch_of = np.empty(len(positions), dtype=np.int32)
+    patch_of[order] = np.arange(len(positions)) // patch_size
+    return patch_of
+
+
+def coarse_rows(rows, patch_of):
+    """Coarse rows of a (mapped) fine table: bit p set if any vertex of patch p is."""
+    nverts = len(patch_of)
+    npatch = int(patch_of.max()) + 1 if nverts else 0
+    order = np.argsort(patch_of, kind="stable")
+    starts = np.searchsorted(patch_of[order], np.arange(npatch))
+    out = np.zeros((len(rows), row_bytes(npatch)), dtype=np.uint8)
+    step = max(1, COARSE_BITS // (rows.shape[1] * 8))
+    for lo in range(0, len(rows), step):
+        bits = np.unpackbits(np.asarray(rows[lo:lo + step]), axis=1, bitorder="little")[:, :nverts]
+        packed = np.packbits(np.logical_or.reduceat(bits[:, order], starts, axis=1), axis=1, bitorder="little")
+        out[lo:lo + len(packed), :packed.shape[1]] = packed
+    return out
+
+
+class Pyramid:
+
+    def __init__(self, patch_of, coarse):
+        self.patch_of = patch_of
+        self.coarse = coarse
+
+    @classmethod
+    def build(cls, rows, positions, patch_size=PATCH_SIZE):
+        patch_of = make_patches(positions, patch_size)
+        return cls(patch_of, coarse_rows(rows, patch_of))
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as z:
+            return cls(z["patch_of"], z["coarse"])
+
+    def save(self, path):
+        with open(path, "wb") as f:
+            np.savez(f, patch_of=self.patch_of, coarse=self.coarse)
+
+    @property
+    def npatch(self):
+        return int(self.patch_of.max()) + 1 if len(self.patch_of) else 0
+
+    def bound(self, vertices):
+        """For each row, the most ROI vertices it could see, from the coarse level alone."""
+        patches, weight = np.unique(self.patch_of[vertices], return_counts=True)
+        bits = (self.coarse[:, patches >> 3] >> (patches & 7).astype(np.uint8)) & 1
+        return bits.astype(np.int64) @ weight
+
+    def candidates(self, vertices, must_match):
+        """Rows that the coarse level can't rule out."""
+        return self.bound(vertices) >= must_match
+
+    def match(self, rows, vertices, query, must_match, candidates=None):
+        """
+        checkvis2's test (bool per row), reading only the fine rows that pass
+        the coarse bound. query is the ROI as a packed row.
+        """
+        keep = self.candidates(vertices, must_match)
+        if candidates is not None:
+            keep &= candidates
+        idx = np.nonzero(keep)[0]
+        hits = np.zeros(len(keep), dtype=bool)
+        if idx.size:
+            hits[idx] = match_counts(rows[idx], query) >= must_match
+        return hits
+
+
+def pyramid_path(vis_file):
+    return vis_file + ".pyr.npz"
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Build the coarse patch level of a visTable.")
+    ap.add_argument("model", help="the mission's OBJ model")
+    ap.add_argument("vis")
+    ap.add_argument("--patch-size", type=int, default=PATCH_SIZE, help="vertices per patch (default: %(default)s)")
+    ap.add_argument("--out", help="output file (default: <visTable>.pyr.npz)")
+    ap.add_argument("--nverts", type=int, help="the catalog's nVerts, if it differs from the vertex count")
+    args = ap.parse_args()
+    t0 = time.perf_counter()
+    model = load_obj(args.model)
+    nverts = args.nverts or model.nverts
+    if nverts < model.nverts:
+        raise SystemExit(f"--nverts {nverts} is less than the model's {model.nverts} vertices")
+    rows = open_rows(args.vis, nverts)
+    pyr = Pyramid.build(rows, model.positions, args.patch_size)
+    out = args.out or pyramid_path(args.vis)
+    pyr.save(out)
+    print(f"Wrote {out}: {pyr.npatch} patches, {len(rows)} coarse rows of {pyr.coarse.shape[1]} bytes "
+          f"in {time.perf_counter() - t0:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+# renumber.py - renumber a model's vertices along a space-filling curve, and
+#   permute the bits of its visTables to match.
+#
+# The client numbers vertices in order of first reference in the OBJ's face
+# stream (see objmodel.py), which for most models is unrelated to where the
+# vertices are. A painted region, or an image's visible set, then has its bits
+# spread over every word of a row, so checkvis2's early exit (nMatched >=
+# mustMatch) comes late and sparse tables stay large. Here each vertex gets a
+# Hilbert (or Morton) key from its position; faces are written in key order,
+# each rotated (winding kept) to start at its lowest-key corner, so vertices
+# are first referenced, and therefore numbered, in nearly curve order. The new
+# OBJ is loaded back to get the exact numbering the client will see, and every
+# row of each visTable is permuted to it.
+#
+#   python -m cometvis.renumber <model.obj> <out.obj> [--curve hilbert|morton]
+#                               [--tables visTable.bin ...] [--suffix .renum]
+#                               [--nverts N]
+#
+# The new OBJ has only 'v' and 'f' lines, one 'v' line per client vertex (with
+# the original text), so nVerts is unchanged. Tables are read with the rows of
+# --nverts (the catalog's nVerts; default: the model's vertex count), and any
+# bits past the model's last vertex stay where they are. Metadata files don't
+# change. Renumber every visTable of the mission together, then replace the
+# model and the tables. Derived files (.inv, .pyr.npz, sparse tables, shards,
+# and the model's .bvh) must be rebuilt from the new model and tables.
+
+import time
+import argparse
+
+import numpy as np
+
+from cometvis.objmodel import load_obj
+from cometvis.vistable import open_rows, row_bytes
+
+CURVE_BITS = 16             # bits per axis of the curve grid
+PERMUTE_BITS = 1 << 26      # table bits permuted at a time
+
+
+def _spread3(v):
+    """Spread the low 21 bits of v so there are two zero bits between each."""
+    v = v.astype(np.uint64) & np.uint64(0x1FFFFF)
+    for shift, mask in ((32, 0x1F00000000FFFF), (16, 0x1F0000FF0000FF), (8, 0x100F00F00F00F00F),
+                        (4, 0x10C30C30C30C30C3), (2, 0x1249249249249249)):
+        v = (v | (v << np.uint64(shift))) & np.uint64(mask)
+    return v
+
+
+def morton_keys(grid):
+    """Morton (Z-order) key of each (n, 3) integer grid point."""
+    return (_spread3(grid[:, 0]) << np.uint64(2)) | (_spread3(grid[:, 1]) << np.uint64(1)) | _spread3(grid[:, 2])
+
+
+def hilbert_keys(grid, bits=CURVE_BITS):
+    """Hilbert key of each (n, 3) integer grid point (Skilling's transpose algorithm)."""
+    x = [grid[:, i].astype(np.uint64) for i in range(3)]
+    q = 1 << (bits - 1)
+    while q > 1:                        # inverse undo
+        p = np.uint64(q - 1)
+        for i in range(3):
+            hi = (x[i] & np.uint64(q)) != 0
+            t = (x[0] ^ x[i]) & p
+            x[0] = np.where(hi, x[0] ^ p, x[0] ^ t)
+            if i:
+                x[i] = np.where(hi, x[i], x[i] ^ t)
+        q >>= 1
+    for i in range(1, 3):               # Gray encode
+        x[i] ^= x[i - 1]
+    t = np.zeros_like(x[0])
+    q = 1 << (bits - 1)
+    while q > 1:
+        t ^= np.where((x[2] & np.uint64(q)) != 0, np.uint64(q - 1), np.uint64(0))
+        q >>= 1
+    x = [xi ^ t for xi in x]
+    return morton_keys(np.stack(x, axis=1))     # interleave the transposed bits, x[0] highest
+
+
+def curve_keys(positions, curve="hilbert", bits=CURVE_BITS):
+    p = positions.astype(np.float64)
+    lo, span = p.min(axis=0), np.ptp(p, axis=0).max() or 1.0
+    grid = np.minimum(((p - lo) / span * (1 << bits)).astype(np.int64), (1 << bits) - 1)
+    return hilbert_keys(grid, bits) if curve == "hilbert" else morton_keys(grid)
+
+
+def curve_faces(faces, keys):
+    """Faces sorted by their lowest corner key, each rotated to start at that corner."""
+    k = keys[faces]
+    first = np.argmin(k, axis=1)
+    rot = faces[np.arange(len(faces))[:, None], (first[:, None] + np.arange(3)) % 3]
+    return rot[np.argsort(k.min(axis=1), kind="stable")]
+
+
+def read_v_lines(path):
+    with open(path, "r", encoding="utf-8", errors="ignore") as f:
+        return [line.strip() for line in f if line.startswith("v ")]
+
+
+def write_renumbered_obj(src_path, model, out_path, curve="hilbert"):
+    """
+    Write the model with curve-ordered faces, reload it, and return (new model,
+    perm) where new vertex j is old vertex perm[j].
+    """
+    keys = curve_keys(model.positions, curve)
+    order = np.argsort(keys, kind="stable")         # 'v' line k of the output = old vertex order[k]
+    line_of = np.empty_like(order)
+    line_of[order] = np.arange(len(order))
+    v_lines = read_v_lines(src_path)
+    faces = curve_faces(model.faces, keys)
+    with open(out_path, "w", encoding="utf-8") as f:
+        f.writelines(v_lines[model.obj_index[i]] + "\n" for i in order)
+        f.writelines(f"f {a + 1} {b + 1} {c + 1}\n" for a, b, c in line_of[faces])
+    new = load_obj(out_path)
+    return new, order[new.obj_index]
+
+
+def permute_table(rows, perm, nverts, out_path):
+    """
+    Write rows with bit j of each new row taken from bit perm[j] of the old row.
+    Bits past the end of perm (nverts above the model's vertex count, and row
+    padding) are copied unchanged.
+    """
+    rb = row_bytes(nverts)
+    if len(perm) > rb * 8:
+        raise ValueError(f"{len(perm)} vertices don't fit in rows of {nverts}")
+    perm = np.concatenate([perm, np.arange(len(perm), rb * 8)])
+    step = max(1, PERMUTE_BITS // (rb * 8))
+    with open(out_path, "wb") as f:
+        for lo in range(0, len(rows), step):
+            bits = np.unpackbits(np.asarray(rows[lo:lo + step]), axis=1, bitorder="little")
+            f.write(np.packbits(bits[:, perm], axis=1, bitorder="little").tobytes())
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Renumber model vertices along a space-filling curve.")
+    ap.add_argument("model")
+    ap.add_argument("out")
+    ap.add_argument("--curve", choices=("hilbert", "morton"), default="hilbert")
+    ap.add_argument("--tables", nargs="*", default=[], help="visTables of this model to permute")
+    ap.add_argument("--suffix", default=".renum", help="suffix for the permuted tables (default: %(default)s)")
+    ap.add_argument("--nverts", type=int, help="the catalog's nVerts, if it differs from the vertex count")
+    args = ap.parse_args()
+
+    t0 = time.perf_counter()
+    model = load_obj(args.model)
+    new, perm = write_renumbered_obj(args.model, model, args.out, args.curve)
+    if new.nverts != model.nverts or not np.array_equal(new.positions, model.positions[perm]):
+        raise SystemExit(f"Renumbered model doesn't match the original ({new.nverts} vs {model.nverts} vertices)")
+    print(f"Wrote {args.out}: {new.nverts} vertices, {len(new.faces)} triangles "
+          f"({args.curve} order) in {time.perf_counter() - t0:.1f}s")
+    nverts = args.nverts or model.nverts
+    if nverts < model.nverts:
+        raise SystemExit(f"--nverts {nverts} is less than the model's {model.nverts} vertices")
+    for vis in args.tables:
+        t0 = time.perf_counter()
+        rows = open_rows(vis, nverts)
+        permute_table(rows, perm, nverts, vis + args.suffix)
+        print(f"Wrote {vis + args.suffix}: {len(rows)} rows in {time.perf_counter() - t0:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,330 @@
+# search.py - region searches over an installed dataset without the browser:
+#   the spatial (mustMatch), meters-per-pixel, emission, incidence and phase
+#   filters of client/src/filters/FilterEngine.js, vectorized over images and
+#   batched over regions.
+#
+# A Mission is opened from its catalog. Each instrument's visTable is
+# memory-mapped, and its metadata columns come from the .cpmeta bundle the
+# catalog records as "metaPack" (metapack.py), also mapped, or else from the
+# metadata JSON. The model is loaded once for its positions and vertex normals.
+#
+# A Region stands for a painted ROI: model vertices given by index, or those
+# whose direction from the body center falls inside a lat/lon polygon
+# (planetocentric degrees, so an overhang contributes both surfaces). Like
+# ROI.setFromPaint it has numPainted, a bounding box, the average position
+# and the unit average vertex normal. The filters, as FilterEngine applies
+# them (an image fails when its value is above high or below low, so a NaN
+# angle passes):
+#
+#   overlap     the image's bbox (b1/b2) meets the region's, and its row has
+#               at least ceil(numPainted * percent / 100) of the region's
+#               vertices (prepareImageCandidates + checkvis2)
+#   m2          meters per pixel at the region's average position (the
+#               image's m2 from d1 when the region is empty)
+#   emission    angle between the average normal and the direction to sc
+#   incidence   angle between the average normal and the sun direction (su)
+#   phase       angle between the directions to sc and to the sun
+#
+# Mission.search() takes a list of regions and returns, for each, the indices
+# of the images that pass every filter, per instrument. The overlap counts
+# come from the vertex -> image index (invindex.py, <visTable>.inv) when one
+# has been built, in time proportional to the region. Otherwise the table is
+# read once, a chunk of rows at a time, for the whole batch, testing each
+# region's bbox candidates against only the bytes its vertices occupy.
+#
+#   from cometvis.search import Mission
+#   m = Mission.open(mission="cg67p")
+#   hits = m.search([m.region(vertices=roi), m.region(polygon=[(10, 20), (10, 40), (30, 40)])],
+#                   percent=75, emission=(0, 60))
+#
+#   python -m cometvis.search --mission cg67p --vertices roi.txt --emission 0 60
+#   python -m cometvis.search --mission cg67p --polygon "10,20 10,40 30,40 30,20"
+#   python -m cometvis.search --mission cg67p --queries queries.json --out results.json
+#
+# A queries file is a JSON list of {"name", "vertices": [...]} or
+# {"name", "polygon": [[lat, lon], ...]}. Leaving out a filter leaves it off:
+# "--m2 0 10" matches the client's default slider.
+
+import os
+import json
+import math
+import time
+import argparse
+
+import numpy as np
+
+from cometvis.binmesh import vertex_normals
+from cometvis.datasets import DATA_DIR, Instrument, fetch_datasets
+from cometvis.invindex import InvertedIndex, index_path
+from cometvis.metapack import MetaPack, column_arrays
+from cometvis.objmodel import load_obj
+from cometvis.vistable import chunks, open_rows
+
+COLUMNS = ("nm", "sc", "su", "b1", "b2", "d1", "rz")
+
+
+def _unit(v):
+    """Rows of v normalized, as THREE.Vector3.normalize (a zero vector stays zero)."""
+    length = np.sqrt((v * v).sum(axis=-1, keepdims=True))
+    return v / np.where(length > 0, length, 1)
+
+
+def _degrees(cos):
+    """Math.acos(cos) * 180 / Math.PI, NaN outside [-1, 1] as in JS."""
+    with np.errstate(invalid="ignore"):
+        return np.arccos(cos) * 180 / math.pi
+
+
+def _passes(values, limits):
+    low, high = limits
+    return ~((values > high) | (values < low))
+
+
+def lat_lon(positions):
+    """Planetocentric latitude and longitude (degrees) of each position."""
+    p = positions.astype(np.float64)
+    r = np.sqrt((p * p).sum(axis=1))
+    lat = np.degrees(np.arcsin(np.clip(p[:, 2] / np.where(r > 0, r, 1), -1, 1)))
+    return lat, np.degrees(np.arctan2(p[:, 1], p[:, 0]))
+
+
+def in_polygon(lat, lon, polygon):
+    """
+    Points inside a [(lat, lon), ...] polygon (even-odd rule in the lat/lon
+    plane). Longitudes are tried as given and 360 either way, so a polygon
+    crossing 180 can use longitudes past it.
+    """
+    poly = np.asarray(polygon, dtype=np.float64)
+    y0, x0 = poly[:, 0], poly[:, 1]
+    y1, x1 = np.roll(y0, -1), np.roll(x0, -1)
+    inside = np.zeros(len(lat), dtype=bool)
+    for shift in (0.0, 360.0, -360.0):
+        x = lon + shift
+        odd = np.zeros(len(lat), dtype=bool)
+        for ya, xa, yb, xb in zip(y0, x0, y1, x1):
+            if ya == yb:
+                continue
+            crosses = (ya > lat) != (yb > lat)
+            at = xa + (lat - ya) * (xb - xa) / (yb - ya)
+            odd ^= crosses & (x < at)
+        inside |= odd
+    return inside
+
+
+class Region:
+    """A set of model vertices and what ROI.setFromPaint derives from it."""
+
+    def __init__(self, vertices, positions, normals):
+        self.vertices = np.unique(np.asarray(vertices, dtype=np.int64))
+        if len(self.vertices) and (self.vertices[0] < 0 or self.vertices[-1] >= len(positions)):
+            raise ValueError(f"vertex indices must be in 0..{len(positions) - 1}")
+        self.count = len(self.vertices)
+        if self.count:
+            p = positions[self.vertices].astype(np.float64)
+            self.lo, self.hi = p.min(axis=0), p.max(axis=0)
+            self.position = p.sum(axis=0) / self.count
+            self.normal = _unit(normals[self.vertices].astype(np.float64).sum(axis=0) / self.count)
+
+    def must_match(self, percent):
+        """FilterEngine.applyGeoFilter's mustMatch."""
+        return math.ceil(self.count * percent / 100)
+
+    def byte_masks(self):
+        """(byte index, bit mask) of the region in a visTable row."""
+        at = self.vertices >> 3
+        index, first = np.unique(at, return_index=True)
+        bits = (1 << (self.vertices & 7)).astype(np.uint8)
+        return index, np.bitwise_or.reduceat(bits, first) if len(bits) else bits
+
+
+class ImageSet:
+    """One instrument's images: metadata columns and the mapped visTable (and inverted index, if built)."""
+
+    def __init__(self, instr):
+        self.instr = instr
+        self.name = instr.inst.get("shortName") or instr.inst["instrumentFolder"].strip("/")
+        pack = instr.inst.get("metaPack")
+        pack_file = os.path.join(instr.folder, pack["file"]) if pack else None
+        if pack_file and os.path.isfile(pack_file):
+            bundle = MetaPack(pack_file)
+            self.count = len(bundle)
+            cols = {name: bundle.column(name) for name in COLUMNS if name in bundle}
+        else:
+            entries = instr.load_metadata()
+            self.count = len(entries)
+            cols = {name: a for name, a in column_arrays(entries).items() if name in COLUMNS}
+        self.names = cols["nm"]
+        self.sc = np.asarray(cols["sc"], dtype=np.float64)
+        self.sun = _unit(np.asarray(cols["su"], dtype=np.float64))
+        self.b1, self.b2 = cols.get("b1"), cols.get("b2")
+        self.d1 = cols.get("d1", np.full(self.count, np.nan))
+        self.rz = np.asarray(cols.get("rz", np.zeros(self.count)), dtype=np.float64)
+        self.rows = open_rows(instr.vis_path, instr.nverts, self.count)
+        inv = index_path(instr.vis_path)
+        self.index = InvertedIndex(inv) if os.path.isdir(inv) else None
+
+        self.m2dist = (.001 * (instr.default_res / 2)) / math.tan(math.pi * (instr.xfov / 2.0) / 180.0)
+        self.res_scale = np.where(self.rz != 0, instr.default_res / np.where(self.rz != 0, self.rz, 1), 1.0)
+        m2 = self.d1 * (1.0 / self.m2dist) * self.res_scale
+        self.m2 = np.floor(m2 * 100 + 0.5) / 100      # getM2FromDistance: Math.round(m2 * 100) / 100
+
+    def candidates(self, region):
+        """Images whose bbox meets the region's (Box3.intersectsBox), as prepareImageCandidates."""
+        if self.b1 is None:
+            return np.ones(self.count, dtype=bool)
+        return ~((self.b2 < region.lo).any(axis=1) | (self.b1 > region.hi).any(axis=1))
+
+    def overlap(self, regions, percent):
+        """For each region, the images passing the spatial filter (bool arrays; all True for an empty region)."""
+        hits = [np.ones(self.count, dtype=bool) for _ in regions]
+        todo = [(k, r, self.candidates(r), r.must_match(percent)) for k, r in enumerate(regions) if r.count]
+        if self.index is not None:
+            for k, r, cand, must in todo:
+                hits[k] = self.index.match(r.vertices, must, self.count, cand)
+            return hits
+        masks = {k: r.byte_masks() for k, r, _, _ in todo}
+        for k, _, cand, _ in todo:
+            hits[k] = np.zeros(self.count, dtype=bool)
+        for sl in chunks(self.rows):
+            block = np.asarray(self.rows[sl])
+            for k, r, cand, must in todo:
+                rows = np.nonzero(cand[sl])[0]
+                if not len(rows):
+                    continue
+                at, mask = masks[k]
+                seen = np.unpackbits(block[rows][:, at] & mask, axis=1).sum(axis=1)
+                hits[k][sl.start + rows] = seen >= must
+        return hits
+
+    def photometric(self, region, images, m2=None, emission=None, incidence=None, phase=None):
+        """The subset of images (indices) passing the m2, emission, incidence and phase filters."""
+        keep = np.ones(len(images), dtype=bool)
+        if not region.count:        # nothing painted: only m2, from each image's d1
+            if m2 is not None:
+                keep &= _passes(self.m2[images], m2)
+            return images[keep]
+        to_sc = self.sc[images] - region.position
+        sc_hat = _unit(to_sc)
+        sun = self.sun[images]
+        if m2 is not None:
+            low, high = m2
+            dist2 = (to_sc * to_sc).sum(axis=1) * self.res_scale[images] ** 2
+            keep &= ~((dist2 > (high * self.m2dist) ** 2) | (dist2 < (low * self.m2dist) ** 2))
+        if emission is not None:
+            keep &= _passes(_degrees(sc_hat @ region.normal), emission)
+        if incidence is not None:
+            keep &= _passes(_degrees(sun @ region.normal), incidence)
+        if phase is not None:
+            keep &= _passes(_degrees((sc_hat * sun).sum(axis=1)), phase)
+        return images[keep]
+
+
+class Mission:
+    """A mission's model and the ImageSet of each of its instruments."""
+
+    def __init__(self, mission, data_dir=DATA_DIR):
+        self.mission = mission
+        instruments = [Instrument(mission, inst, data_dir) for inst in mission["instruments"]]
+        model = load_obj(instruments[0].model_path)
+        self.positions = model.positions
+        self.normals = vertex_normals(model).astype(np.float32)     # the client's float32 normal attribute
+        self.images = [ImageSet(instr) for instr in instruments]
+        self._lat_lon = None
+
+    @classmethod
+    def open(cls, data_dir=DATA_DIR, catalog=None, mission=None):
+        """The first mission of a catalog (or data/<mission>/dataset.json)."""
+        datasets = fetch_datasets(data_dir, catalog, mission)
+        if not datasets:
+            raise SystemExit("No datasets found.")
+        return cls(datasets[0], data_dir)
+
+    def region(self, vertices=None, polygon=None):
+        """A Region from vertex indices or a [(lat, lon), ...] polygon."""
+        if polygon is not None:
+            if self._lat_lon is None:
+                self._lat_lon = lat_lon(self.positions)
+            vertices = np.nonzero(in_polygon(*self._lat_lon, polygon))[0]
+        return Region(vertices if vertices is not None else [], self.positions, self.normals)
+
+    def search(self, regions, percent=75, m2=None, emission=None, incidence=None, phase=None):
+        """
+        For each region, {instrument name: sorted indices of the images that
+        pass}. Filters are (low, high) pairs; None leaves one off.
+        """
+        out = [{} for _ in regions]
+        for images in self.images:
+            spatial = images.overlap(regions, percent)
+            for k, region in enumerate(regions):
+                out[k][images.name] = images.photometric(region, np.nonzero(spatial[k])[0], m2, emission,
+                                                         incidence, phase)
+        return out
+
+
+def _read_vertices(text):
+    """Vertex indices from a file (JSON list, or numbers separated by spaces/commas/newlines) or a literal list."""
+    if os.path.isfile(text):
+        with open(text, "r", encoding="utf-8") as f:
+            text = f.read()
+    text = text.strip()
+    if text.startswith("["):
+        return json.loads(text)
+    return [int(v) for v in text.replace(",", " ").split()]
+
+
+def _read_polygon(text):
+    return [tuple(float(x) for x in point.split(",")) for point in text.split()]
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Find the images of a region (or many) with the client's filters.")
+    src = ap.add_mutually_exclusive_group()
+    src.add_argument("--catalog", help="catalog JSON (relative to the data folder, or a path)")
+    src.add_argument("--mission", help="use data/<mission>/dataset.json")
+    ap.add_argument("--data", default=DATA_DIR, help="data folder (default: %(default)s)")
+    q = ap.add_mutually_exclusive_group(required=True)
+    q.add_argument("--vertices", help="file of vertex indices, or a list like '1,2,3'")
+    q.add_argument("--polygon", help="'lat,lon lat,lon ...' in degrees")
+    q.add_argument("--queries", help="JSON list of {name, vertices | polygon}")
+    ap.add_argument("--percent", type=float, default=75, help="percent overlap (default: %(default)s, as the client)")
+    for name, unit in (("m2", "meters per pixel"), ("emission", "degrees"), ("incidence", "degrees"),
+                       ("phase", "degrees")):
+        ap.add_argument("--" + name, type=float, nargs=2, metavar=("LOW", "HIGH"), help=unit)
+    ap.add_argument("--out", help="write the results as JSON")
+    args = ap.parse_args()
+
+    t0 = time.perf_counter()
+    mission = Mission.open(args.data, args.catalog, args.mission)
+    print(f"{mission.mission.get('mission', '')}: {len(mission.positions)} vertices, "
+          + ", ".join(f"{s.name} {s.count} images{' (indexed)' if s.index else ''}" for s in mission.images)
+          + f", opened in {time.perf_counter() - t0:.1f}s")
+    if args.queries:
+        with open(args.queries, "r", encoding="utf-8") as f:
+            queries = json.load(f)
+    elif args.vertices:
+        queries = [{"name": "vertices", "vertices": _read_vertices(args.vertices)}]
+    else:
+        queries = [{"name": "polygon", "polygon": _read_polygon(args.polygon)}]
+    regions = [mission.region(q.get("vertices"), q.get("polygon")) for q in queries]
+
+    t0 = time.perf_counter()
+    hits = mission.search(regions, args.percent, args.m2, args.emission, args.incidence, args.phase)
+    elapsed = time.perf_counter() - t0
+    results = []
+    for k, (query, region, found) in enumerate(zip(queries, regions, hits)):
+        name = query.get("name", str(k))
+        images = {s.name: [{"index": int(i), "nm": s.names[i]} for i in found[s.name]] for s in mission.images}
+        results.append({"name": name, "painted": region.count, "mustMatch": region.must_match(args.percent),
+                        "images": images})
+        if k < 20:
+            print(f"  {name}: {region.count} vertices -> "
+                  + ", ".join(f"{len(v)} {s}" for s, v in images.items()))
+    print(f"{len(regions)} region(s) searched in {elapsed:.2f}s")
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=1)
+        print(f"Wrote {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,179 @@
+# shards.py - split an instrument's visTable and metadata into monthly shards,
+#   so a time-limited search (or a client showing one mission phase) only
+#   reads the months it needs.
+#
+# Images are grouped by the YYYYMM of their 'ti' (the same month folder
+# CometView.getImagePath uses for the JPG), and each month becomes an ordinary
+# visTable/metadata pair, rows in time order, plus a .cpmeta bundle
+# (metapack.py) for its time column:
+#
+#   <out>/201408.bin  <out>/201408.json  <out>/201408.cpmeta  ...
+#   <out>/shards.json    the shard index:
+#     {"version": 1, "nVerts", "rowBytes", "rows",
+#      "shards": [{"month", "visTable", "metaData", "metaPack", "rows",
+#                  "ranges", "tiFirst", "tiLast", "t0", "t1"}, ...]}
+#
+# "ranges" maps shard rows back to the full table: [[lo, hi], ...] runs whose
+# concatenation gives the full-table row of each shard row (a single run when
+# the full table is in time order). t0/t1 are the first and last times in
+# seconds since 1970 UTC. ShardSet.search() is the reference time-window
+# query: it scans only the shards overlapping [t0, t1] and returns full-table
+# row numbers, the same ones a full scan would.
+#
+#   python -m cometvis.shards split <visTable> <metaData> <out_dir> --nverts N
+#   python -m cometvis.shards catalog --mission cg67p     # <instrumentFolder>/shards/ for each
+#                                                         # instrument, recorded as "shards"
+
+import os
+import json
+import time
+import argparse
+import itertools
+
+import numpy as np
+
+from cometvis.datasets import DATA_DIR, Instrument, catalog_path, fetch_datasets, write_catalog
+from cometvis.metapack import MetaPack, ti_seconds, write_metapack
+from cometvis.vistable import load_meta, match_counts, open_rows, row_bytes, write_meta, write_rows
+
+INDEX_NAME = "shards.json"
+INDEX_VERSION = 1
+
+
+def month_of(ti):
+    """YYYYMM of a 'ti' string, as CometView.getImagePath takes it."""
+    return ti[:4] + ti[5:7]
+
+
+def runs(index):
+    """[[lo, hi], ...] runs of consecutive values whose concatenation is index."""
+    index = np.asarray(index, dtype=np.int64)
+    if len(index) == 0:
+        return []
+    breaks = np.nonzero(np.diff(index) != 1)[0] + 1
+    starts = np.concatenate([[0], breaks])
+    ends = np.concatenate([breaks, [len(index)]])
+    return [[int(index[s]), int(index[e - 1]) + 1] for s, e in zip(starts, ends)]
+
+
+def write_shards(rows, meta, nverts, out_dir):
+    """Write one shard per month and the index; returns the index."""
+    os.makedirs(out_dir, exist_ok=True)
+    tis = [e.get("ti", "") for e in meta]
+    order = sorted(range(len(meta)), key=lambda i: tis[i])
+    shards = []
+    for month, group in itertools.groupby(order, key=lambda i: month_of(tis[i])):
+        idx = list(group)
+        sub = [meta[i] for i in idx]
+        name = month or "unknown"
+        write_rows(rows, os.path.join(out_dir, name + ".bin"), idx)
+        write_meta(sub, os.path.join(out_dir, name + ".json"))
+        write_metapack(sub, os.path.join(out_dir, name + ".cpmeta"))
+        t = ti_seconds([tis[i] for i in idx])
+        shards.append({"month": month, "visTable": name + ".bin", "metaData": name + ".json",
+                       "metaPack": name + ".cpmeta", "rows": len(idx), "ranges": runs(idx),
+                       "tiFirst": tis[idx[0]], "tiLast": tis[idx[-1]],
+                       "t0": float(np.nanmin(t)) if np.isfinite(t).any() else None,
+                       "t1": float(np.nanmax(t)) if np.isfinite(t).any() else None})
+    index = {"version": INDEX_VERSION, "nVerts": nverts, "rowBytes": row_bytes(nverts), "rows": len(meta),
+             "shards": shards}
+    with open(os.path.join(out_dir, INDEX_NAME), "w", encoding="utf-8") as f:
+        json.dump(index, f, indent=1)
+    return index
+
+
+class ShardSet:
+    """A shard index and the files it names, opened on demand."""
+
+    def __init__(self, index_path):
+        with open(index_path, "r", encoding="utf-8") as f:
+            self.index = json.load(f)
+        if self.index.get("version") != INDEX_VERSION:
+            raise ValueError(f"{index_path}: not a version {INDEX_VERSION} shard index")
+        self.folder = os.path.dirname(index_path)
+        self.nverts = self.index["nVerts"]
+        self.shards = self.index["shards"]
+
+    def select(self, t0=None, t1=None):
+        """Shards whose time span overlaps [t0, t1] (None: open-ended)."""
+        return [s for s in self.shards
+                if s["t0"] is None
+                or ((t1 is None or s["t0"] <= t1) and (t0 is None or s["t1"] >= t0))]
+
+    def rows(self, shard):
+        return open_rows(os.path.join(self.folder, shard["visTable"]), self.nverts, shard["rows"])
+
+    def times(self, shard):
+        return MetaPack(os.path.join(self.folder, shard["metaPack"])).column("t")
+
+    @staticmethod
+    def table_rows(shard):
+        """Full-table row number of each shard row."""
+        return np.concatenate([np.arange(lo, hi) for lo, hi in shard["ranges"]] or [np.zeros(0, np.int64)])
+
+    def search(self, query, must_match, t0=None, t1=None):
+        """Full-table rows sharing at least must_match of the query's bits, with ti in [t0, t1]."""
+        hits = []
+        for shard in self.select(t0, t1):
+            keep = match_counts(self.rows(shard), query) >= must_match
+            keep &= in_window(self.times(shard), t0, t1)
+            hits.append(self.table_rows(shard)[keep])
+        return np.sort(np.concatenate(hits)) if hits else np.zeros(0, dtype=np.int64)
+
+
+def in_window(t, t0=None, t1=None):
+    keep = np.ones(len(t), dtype=bool)
+    if t0 is not None:
+        keep &= t >= t0
+    if t1 is not None:
+        keep &= t <= t1
+    return keep
+
+
+def full_search(rows, t, query, must_match, t0=None, t1=None):
+    """The same query over the whole table (t: each row's time), for comparison."""
+    return np.nonzero((match_counts(rows, query) >= must_match) & in_window(t, t0, t1))[0]
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Split visTables and metadata into monthly shards.")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    p = sub.add_parser("split", help="shard one visTable/metadata pair")
+    p.add_argument("vis")
+    p.add_argument("meta")
+    p.add_argument("out_dir")
+    p.add_argument("--nverts", type=int, required=True)
+    p = sub.add_parser("catalog", help="shard every instrument of a catalog and record the indexes in it")
+    src = p.add_mutually_exclusive_group(required=True)
+    src.add_argument("--catalog", help="catalog JSON (relative to the data folder, or a path)")
+    src.add_argument("--mission", help="use data/<mission>/dataset.json")
+    p.add_argument("--data", default=DATA_DIR, help="data folder (default: %(default)s)")
+    p.add_argument("--folder", default="shards", help="shard folder within each instrument folder (default: %(default)s)")
+    args = ap.parse_args()
+
+    if args.cmd == "split":
+        jobs = [(args.vis, args.meta, args.nverts, args.out_dir, None)]
+    else:
+        catalog_file = catalog_path(args.data, args.catalog, args.mission)
+        datasets = fetch_datasets(args.data, args.catalog, args.mission)
+        jobs = []
+        for mission in datasets:
+            for inst in mission["instruments"]:
+                instr = Instrument(mission, inst, args.data)
+                jobs.append((instr.vis_path, instr.meta_path, instr.nverts,
+                             os.path.join(instr.folder, args.folder), inst))
+    for vis, meta_file, nverts, out_dir, inst in jobs:
+        t0 = time.perf_counter()
+        meta = load_meta(meta_file)
+        index = write_shards(open_rows(vis, nverts, len(meta)), meta, nverts, out_dir)
+        print(f"{vis}: {len(meta)} rows -> {len(index['shards'])} monthly shards in {out_dir} "
+              f"({time.perf_counter() - t0:.1f}s)")
+        if inst is not None:
+            inst["shards"] = os.path.join(args.folder, INDEX_NAME).replace(os.sep, "/")
+    if args.cmd == "catalog":
+        write_catalog(catalog_file, datasets)
+        print(f"Updated {catalog_file}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+# sparsetable.py - a compressed visTable: only the nonzero 64-bit words of each row.
+#
+# An image sees a small part of the body, so most words of a dense visTable
+# row are zero. A sparse table keeps, for each row, the indices and values of
+# its nonzero words (CSR layout):
+#
+#   nverts        the model's vertex count
+#   row_offsets   (rows+1,) int64; row i's words are [row_offsets[i], row_offsets[i+1])
+#   word_index    word number within the row (uint16 when rows have < 65536 words, else uint32)
+#   word_value    the word itself (uint64, same bit order as the dense table)
+#
+# stored as one .npz. match_counts() answers checkvis2's question (how many of
+# the query's bits each row shares) directly on this form: gather the query's
+# word at each stored index, AND, popcount, and sum per row, touching only the
+# stored words.
+#
+#   python -m cometvis.sparsetable encode <visTable> <out.npz> --nverts N
+#   python -m cometvis.sparsetable decode <in.npz> <visTable>
+
+import time
+import argparse
+
+import numpy as np
+
+from cometvis.vistable import _POP8, chunks, open_rows, row_bytes
+
+QUERY_WORDS = 1 << 22       # stored words handled at a time by match_counts
+
+
+def _popcount64(words):
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(words)
+    return _POP8[words.view(np.uint8)].reshape(-1, 8).sum(axis=1, dtype=np.uint8)
+
+
+class SparseTable:
+
+    def __init__(self, nverts, row_offsets, word_index, word_value):
+        self.nverts = int(nverts)
+        self.row_offsets = row_offsets
+        self.word_index = word_index
+        self.word_value = word_value
+
+    def __len__(self):
+        return len(self.row_offsets) - 1
+
+    @property
+    def nbytes(self):
+        return self.row_offsets.nbytes + self.word_index.nbytes + self.word_value.nbytes
+
+    @classmethod
+    def encode(cls, rows, nverts):
+        """Build from a (mapped) dense table."""
+        nwords = row_bytes(nverts) // 8
+        idx_type = np.uint16 if nwords <= 0xFFFF else np.uint32
+        counts, index, value = [], [], []
+        for sl in chunks(rows):
+            words = np.asarray(rows[sl]).view(np.uint64)
+            nz = words != 0
+            counts.append(nz.sum(axis=1))
+            index.append(np.nonzero(nz)[1].astype(idx_type))
+            value.append(words[nz])
+        row_offsets = np.zeros(len(rows) + 1, dtype=np.int64)
+        if counts:
+            np.cumsum(np.concatenate(counts), out=row_offsets[1:])
+        return cls(nverts, row_offsets,
+                   np.concatenate(index) if index else np.zeros(0, idx_type),
+                   np.concatenate(value) if value else np.zeros(0, np.uint64))
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as z:
+            return cls(z["nverts"], z["row_offsets"], z["word_index"], z["word_value"])
+
+    def save(self, path):
+        with open(path, "wb") as f:
+            np.savez(f, nverts=np.int64(self.nverts), row_offsets=self.row_offsets,
+                     word_index=self.word_index, word_value=self.word_value)
+
+    def row(self, i):
+        """Row i as dense bytes."""
+        words = np.zeros(row_bytes(self.nverts) // 8, dtype=np.uint64)
+        lo, hi = self.row_offsets[i], self.row_offsets[i + 1]
+        words[self.word_index[lo:hi]] = self.word_value[lo:hi]
+        return words.tobytes()
+
+    def write_dense(self, path, step=4096):
+        nwords = row_bytes(self.nverts) // 8
+        with open(path, "wb") as f:
+            for lo in range(0, len(self), step):
+                hi = min(lo + step, len(self))
+                block = np.zeros((hi - lo, nwords), dtype=np.uint64)
+                a, b = self.row_offsets[lo], self.row_offsets[hi]
+                rows = np.repeat(np.arange(hi - lo), np.diff(self.row_offsets[lo:hi + 1]))
+                block[rows, self.word_index[a:b]] = self.word_value[a:b]
+                f.write(block.tobytes())
+
+    def match_counts(self, query):
+        """For each row, how many of the dense query row's bits it shares."""
+        q = np.frombuffer(query, dtype=np.uint64)
+        out = np.zeros(len(self), dtype=np.int64)
+        lo = 0
+        while lo < len(self):
+            # a run of rows holding about QUERY_WORDS stored words
+            start = self.row_offsets[lo]
+            hi = max(lo + 1, int(np.searchsorted(self.row_offsets, start + QUERY_WORDS, side="right")) - 1)
+            hi = min(hi, len(self))
+            stop = self.row_offsets[hi]
+            hits = _popcount64(q[self.word_index[start:stop]] & self.word_value[start:stop])
+            csum = np.zeros(stop - start + 1, dtype=np.int64)
+            np.cumsum(hits, out=csum[1:])
+            ends = self.row_offsets[lo:hi + 1] - start
+            out[lo:hi] = csum[ends[1:]] - csum[ends[:-1]]
+            lo = hi
+        return out
+
+    def match(self, query, must_match, candidates=None):
+        """Bool per row: shares at least must_match bits with the query (checkvis2's test)."""
+        hits = self.match_counts(query) >= must_match
+        return hits if candidates is None else hits & candidates
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Convert visTables to and from the sparse-word format.")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    p = sub.add_parser("encode")
+    p.add_argument("vis")
+    p.add_argument("out")
+    p.add_argument("--nverts", type=int, required=True, help="model vertex count (mission nVerts)")
+    p = sub.add_parser("decode")
+    p.add_argument("sparse")
+    p.add_argument("out")
+    args = ap.parse_args()
+
+    t0 = time.perf_counter()
+    if args.cmd == "encode":
+        rows = open_rows(args.vis, args.nverts)
+        table = SparseTable.encode(rows, args.nverts)
+        table.save(args.out)
+        print(f"Wrote {args.out}: {len(table)} rows, {table.nbytes / 2**20:.1f} MB "
+              f"({table.nbytes / max(rows.nbytes, 1):.1%} of {rows.nbytes / 2**20:.1f} MB) "
+              f"in {time.perf_counter() - t0:.1f}s")
+    else:
+        table = SparseTable.load(args.sparse)
+        table.write_dense(args.out)
+        print(f"Wrote {args.out}: {len(table)} rows of {row_bytes(table.nverts)} bytes "
+              f"in {time.perf_counter() - t0:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
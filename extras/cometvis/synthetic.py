@@ -0,0 +1,170 @@
+# synthetic.py - a small made-up dataset for trying out and benchmarking the
+#   cometvis tools without real mission data: a bumpy, self-occluding body,
+#   spacecraft positions around it, and a catalog in the data-folder layout.
+#
+#   python -m cometvis.synthetic /tmp/syndata --images 500 --res 120
+#
+# writes /tmp/syndata/synth/{dataset.json, model.obj, cam/imageMetadata_phase1.json}.
+#
+# roi() and best_time() are the query regions and timing the benchmarks and
+# loadtest.py share.
+
+import os
+import json
+import math
+import time
+import argparse
+
+import numpy as np
+
+from cometvis.objmodel import ObjModel
+from cometvis.vistable import pack_row, write_meta
+
+
+def bumpy_model(res=80, seed=0):
+    """
+    A UV sphere (res latitude bands) pushed out by smooth bumps and a deep
+    groove, so plenty of vertices are hidden by other parts of the body.
+    Faces are in shuffled order, like a real model's are relative to its 'v' lines.
+    """
+    rng = np.random.default_rng(seed)
+    lat = np.linspace(0, math.pi, res + 1)[1:-1]
+    lon = np.linspace(0, 2 * math.pi, 2 * res, endpoint=False)
+    th, ph = np.meshgrid(lat, lon, indexing="ij")
+    dirs = np.stack([np.sin(th) * np.cos(ph), np.sin(th) * np.sin(ph), np.cos(th)], axis=-1).reshape(-1, 3)
+    dirs = np.vstack([[0, 0, 1], dirs, [0, 0, -1]])
+    x, y, z = dirs.T
+    r = (2.0 + 0.35 * np.sin(5 * x) * np.cos(4 * y) + 0.25 * np.sin(7 * z + 1)
+         - 0.8 * np.exp(-(z / 0.25) ** 2) + 0.6 * np.maximum(x, 0) ** 3)
+    positions = (dirs * r[:, None]).astype(np.float32)
+
+    m = 2 * res
+    faces = [[0, 1 + j, 1 + (j + 1) % m] for j in range(m)]
+    for i in range(res - 2):
+        for j in range(m):
+            a, b = 1 + i * m + j, 1 + i * m + (j + 1) % m
+            faces += [[a, a + m, b + m], [a, b + m, b]]
+    last, base = len(positions) - 1, 1 + (res - 2) * m
+    faces += [[base + j, last, base + (j + 1) % m] for j in range(m)]
+    faces = np.array(faces, dtype=np.int32)[rng.permutation(len(faces))]
+    return ObjModel(positions, faces)
+
+
+def write_obj(model, path):
+    with open(path, "w") as f:
+        f.writelines(f"v {x:.6f} {y:.6f} {z:.6f}\n" for x, y, z in model.positions)
+        f.writelines(f"f {a + 1} {b + 1} {c + 1}\n" for a, b, c in model.faces)
+
+
+def random_entries(count, seed=1, dist=(8.0, 60.0), jitter=0.05, start="2015-01-01"):
+    """Phase-1 style metadata entries, one per hour from start, looking roughly at the body."""
+    rng = np.random.default_rng(seed)
+    t0 = np.datetime64(start + "T00:00:00")
+    entries = []
+    for k in range(count):
+        d = rng.normal(size=3)
+        d /= np.linalg.norm(d)
+        sc = d * rng.uniform(*dist)
+        cv = -d + rng.normal(size=3) * jitter
+        cv /= np.linalg.norm(cv)
+        side = np.cross(cv, [0.0, 0.0, 1.0])
+        side /= np.linalg.norm(side)
+        up = np.cross(side, cv)
+        sun = rng.normal(size=3)
+        entries.append({
+            "nm": f"SYN_{k:06d}",
+            "ti": str(t0 + np.timedelta64(k, "h")),
+            "sc": sc.tolist(),
+            "cv": cv.tolist(),
+            "up": up.tolist(),
+            "su": (sun / np.linalg.norm(sun) * 1.5e8).tolist(),
+        })
+    return entries
+
+
+def random_table(model, vis_file, meta_file, images=2000, seed=2, cap=(3.0, 40.0)):
+    """
+    A visTable of made-up visibility, for timing the table tools at scale
+    without running a visibility engine: image k sees the vertices within a
+    random angular cap (degrees) around a random direction. Writes the table
+    and matching metadata (random_entries plus b1/b2/d1/d2). Returns the metadata.
+    """
+    rng = np.random.default_rng(seed)
+    p = model.positions.astype(np.float64)
+    unit = p / np.linalg.norm(p, axis=1)[:, None]
+    entries = random_entries(images, seed)
+    kept = []
+    with open(vis_file, "wb") as f:
+        for e in entries:
+            d = rng.normal(size=3)
+            mask = unit @ (d / np.linalg.norm(d)) > math.cos(math.radians(rng.uniform(*cap)))
+            if not mask.any():
+                continue
+            dist = np.linalg.norm(p[mask] - e["sc"], axis=1)
+            e["b1"], e["b2"] = p[mask].min(axis=0).tolist(), p[mask].max(axis=0).tolist()
+            e["d1"], e["d2"] = float(dist.min()), float(dist.max())
+            f.write(pack_row(mask, model.nverts))
+            kept.append(e)
+    write_meta(kept, meta_file)
+    return kept
+
+
+def roi(positions, center, k):
+    """The k vertices nearest vertex 'center'."""
+    d = np.linalg.norm(positions - positions[center], axis=1)
+    return np.sort(np.argpartition(d, min(k, len(d) - 1))[:k])
+
+
+def best_time(fn, repeat):
+    """(fastest of repeat calls to fn, in seconds, and its result)."""
+    best, out = float("inf"), None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        out = fn()
+        best = min(best, time.perf_counter() - t0)
+    return best, out
+
+
+def make_dataset(data_dir, images=200, res=80, seed=1, fov=5.0, default_res=1024):
+    """Write a synthetic mission under data_dir/synth and return its catalog path (relative to data_dir)."""
+    mission_dir = os.path.join(data_dir, "synth")
+    os.makedirs(os.path.join(mission_dir, "cam"), exist_ok=True)
+    model = bumpy_model(res)
+    write_obj(model, os.path.join(mission_dir, "model.obj"))
+    with open(os.path.join(mission_dir, "cam", "imageMetadata_phase1.json"), "w") as f:
+        json.dump(random_entries(images, seed), f)
+    catalog = [{
+        "mission": "Synthetic",
+        "missionFolder": "synth/",
+        "model": "model.obj",
+        "nVerts": model.nverts,
+        "instruments": [{
+            "instrumentFolder": "cam/",
+            "metaData": "imageMetadata_phase1.json",
+            "visTable": "visTable.bin",
+            "xFOV": fov,
+            "yFOV": fov,
+            "defaultRes": default_res,
+            "longName": "Synthetic camera",
+            "shortName": "SYN",
+            "imgFolder": "images/",
+        }],
+    }]
+    with open(os.path.join(mission_dir, "dataset.json"), "w") as f:
+        json.dump(catalog, f, indent=2)
+    return os.path.join("synth", "dataset.json")
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Write a synthetic dataset for the cometvis tools.")
+    ap.add_argument("data_dir")
+    ap.add_argument("--images", type=int, default=200)
+    ap.add_argument("--res", type=int, default=80, help="latitude bands of the model (vertices ~ 2*res^2)")
+    ap.add_argument("--seed", type=int, default=1)
+    args = ap.parse_args()
+    catalog = make_dataset(args.data_dir, args.images, args.res, args.seed)
+    print(f"Wrote {os.path.join(args.data_dir, catalog)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,342 @@
+# validate_meta.py - check an imageMetadata file (and its visTable) without
+#   loading it whole, on several cores, and write a machine-readable report.
+#
+# The file is split into byte ranges (metastream.py); each worker streams its
+# range in chunks and checks them with array operations:
+#
+#   entry          an object with string nm and ti, and 3-number vectors
+#   ti             parses as a time; times never decrease through the file
+#   nm             no name appears twice (and, with --nm-month, nm's YYYYMM
+#                  agrees with ti's, as check_date_consistency.py checks)
+#   finite         no NaN/inf in sc, cv, up, su, b1, b2, d1, d2
+#   cv, up         unit length, and perpendicular to each other
+#   sc, su         lengths (km) within plausible ranges (--sc-range, --su-range)
+#   bbox           b1 <= b2 on every axis; b1/b2 either in every entry or in none
+#   depth          d1/d2 together, 0 < d1 <= d2, and consistent with the bbox
+#                  (d1 no nearer than the bbox's nearest depth along cv, d2 no
+#                  farther than its farthest corner)
+#   rz             a positive integer when present
+#   vis            with --vis: the table holds one row of row_bytes(nVerts)
+#                  per entry, no entry's row is empty, and an entry's vc (if
+#                  it has one) is its row's number of set bits
+#
+# The report (--report, or stdout with --json) is
+#   {"file", "entries", "bytes", "seconds", "workers", "ok",
+#    "checks": {name: {"failed": n, "examples": [{"index", "nm", "detail"}, ...]}}}
+# and the exit status is 1 if any check failed.
+#
+#   python -m cometvis.validate_meta imageMetadata_phase2.json [--vis visTable.bin --nverts N]
+#   python -m cometvis.validate_meta --mission cg67p --report report.json
+
+import os
+import json
+import time
+import argparse
+import concurrent.futures
+
+import numpy as np
+
+from cometvis.datasets import DATA_DIR, Instrument, fetch_datasets
+from cometvis.metapack import ti_seconds
+from cometvis.metastream import byte_ranges, iter_chunks, string_hashes
+from cometvis.vistable import popcounts, row_bytes
+
+CHECKS = ("entry", "ti", "ti_order", "nm_duplicate", "nm_month", "finite", "cv_norm", "up_norm",
+          "cv_up_orthogonal", "sc_range", "su_range", "bbox", "depth", "rz", "vis_rows", "vis_empty", "vis_count")
+EXAMPLES = 10               # examples kept per check
+UNIT_TOL = 1e-6
+ORTHO_TOL = 1e-6
+DEPTH_TOL = 0.001           # km
+SC_RANGE = (0.1, 1.0e7)     # km from the body center
+SU_RANGE = (1.0e7, 1.0e10)  # km from the sun
+VECTORS = ("sc", "cv", "up", "su", "b1", "b2")
+
+
+class Findings:
+    """Failure counts and the first few examples per check, with entry indices local to a range."""
+
+    def __init__(self):
+        self.failed = dict.fromkeys(CHECKS, 0)
+        self.examples = {name: [] for name in CHECKS}
+
+    def add(self, name, index, nm, detail):
+        self.failed[name] += 1
+        if len(self.examples[name]) < EXAMPLES:
+            self.examples[name].append({"index": int(index), "nm": nm, "detail": detail})
+
+    def flag(self, name, bad, base, names, detail):
+        """Record every entry where the boolean array bad is set; detail(k) describes entry k."""
+        for k in np.nonzero(bad)[0][:EXAMPLES]:
+            if len(self.examples[name]) < EXAMPLES:
+                self.examples[name].append({"index": int(base + k), "nm": names[k], "detail": detail(k)})
+        self.failed[name] += int(np.count_nonzero(bad))
+
+    def merge(self, other, offset):
+        for name in CHECKS:
+            self.failed[name] += other.failed[name]
+            room = EXAMPLES - len(self.examples[name])
+            self.examples[name] += [dict(x, index=x["index"] + offset) for x in other.examples[name][:room]]
+
+
+def _vectors(chunk, name):
+    """(n, 3) float array of a vector field (NaN where missing), and which entries have it."""
+    has = np.array([name in e for e in chunk])
+    out = np.full((len(chunk), 3), np.nan)
+    try:
+        out[has] = np.array([e[name] for e in chunk if name in e], dtype=np.float64).reshape(-1, 3)
+        bad = np.zeros(len(chunk), dtype=bool)
+    except (TypeError, ValueError):
+        bad = np.zeros(len(chunk), dtype=bool)
+        for k, e in enumerate(chunk):
+            if name in e:
+                try:
+                    out[k] = np.array(e[name], dtype=np.float64).reshape(3)
+                except (TypeError, ValueError):
+                    bad[k] = True
+    return out, has, bad
+
+
+def _scalars(chunk, name):
+    has = np.array([name in e for e in chunk])
+    vals = [e.get(name) for e in chunk]
+    bad = np.array([h and not isinstance(v, (int, float)) for h, v in zip(has, vals)], dtype=bool)
+    out = np.array([float(v) if h and not b else np.nan for h, b, v in zip(has, bad, vals)])
+    return out, has, bad
+
+
+def _norm(v):
+    return np.sqrt((v * v).sum(axis=1))
+
+
+def check_chunk(chunk, base, found, opts):
+    """Checks that need only this chunk. Returns (times, name hashes, has a bbox, names, vc or -1)."""
+    n = len(chunk)
+    ok = np.array([isinstance(e, dict) and isinstance(e.get("nm"), str) and isinstance(e.get("ti"), str)
+                   for e in chunk])
+    chunk = [e if good else {} for e, good in zip(chunk, ok)]
+    names = [e.get("nm", "") for e in chunk]
+    found.flag("entry", ~ok, base, names, lambda k: "not an object with string nm and ti")
+
+    tis = [e.get("ti", "") for e in chunk]
+    try:
+        t = ti_seconds(tis)
+    except ValueError:
+        t = np.full(n, np.nan)
+        for k, ti in enumerate(tis):
+            try:
+                t[k] = ti_seconds([ti])[0]
+            except ValueError:
+                pass
+    found.flag("ti", ok & np.isnan(t), base, names, lambda k: f"ti {tis[k]!r} is not a time")
+    dec = np.zeros(n, dtype=bool)
+    dec[1:] = t[1:] < t[:-1]
+    found.flag("ti_order", dec, base, names, lambda k: f"ti {tis[k]} is before the previous entry's {tis[k - 1]}")
+
+    if opts.get("nm_month") is not None:
+        off = opts["nm_month"]
+        nm_ym = [nm[off:off + 6] if off >= 0 else nm[nm.find("T") - 8:nm.find("T") - 2] if nm.find("T") >= 8 else ""
+                 for nm in names]
+        ti_ym = [ti[:4] + ti[5:7] for ti in tis]
+        bad = np.array([a != b for a, b in zip(nm_ym, ti_ym)]) & ok
+        found.flag("nm_month", bad, base, names, lambda k: f"nm month {nm_ym[k]!r} vs ti month {ti_ym[k]!r}")
+
+    vec, has = {}, {}
+    for name in VECTORS:
+        vec[name], has[name], bad = _vectors(chunk, name)
+        found.flag("entry", bad, base, names, lambda k, name=name: f"{name} is not 3 numbers")
+    d1, has_d1, bad1 = _scalars(chunk, "d1")
+    d2, has_d2, bad2 = _scalars(chunk, "d2")
+    found.flag("entry", bad1 | bad2, base, names, lambda k: "d1/d2 is not a number")
+
+    finite = np.ones(n, dtype=bool)
+    for name in VECTORS:
+        finite &= ~has[name] | np.isfinite(vec[name]).all(axis=1)
+    finite &= ~has_d1 | np.isfinite(d1)
+    finite &= ~has_d2 | np.isfinite(d2)
+    found.flag("finite", ~finite & ok, base, names, lambda k: "NaN or infinite value")
+
+    with np.errstate(invalid="ignore"):
+        for name, check in (("cv", "cv_norm"), ("up", "up_norm")):
+            length = _norm(vec[name])
+            missing = ~has[name] & ok
+            found.flag("entry", missing, base, names, lambda k, name=name: f"no {name}")
+            found.flag(check, has[name] & (np.abs(length - 1) > UNIT_TOL), base, names,
+                       lambda k, length=length, name=name: f"|{name}| = {length[k]:.9g}")
+        dot = (vec["cv"] * vec["up"]).sum(axis=1)
+        found.flag("cv_up_orthogonal", has["cv"] & has["up"] & (np.abs(dot) > ORTHO_TOL), base, names,
+                   lambda k: f"cv . up = {dot[k]:.3g}")
+        for name, check, (lo, hi) in (("sc", "sc_range", opts["sc_range"]), ("su", "su_range", opts["su_range"])):
+            length = _norm(vec[name])
+            found.flag("entry", ~has[name] & ok, base, names, lambda k, name=name: f"no {name}")
+            found.flag(check, has[name] & ~((length >= lo) & (length <= hi)), base, names,
+                       lambda k, length=length, name=name: f"|{name}| = {length[k]:.6g} km")
+
+        both = has["b1"] & has["b2"]
+        inverted = both & (vec["b1"] > vec["b2"]).any(axis=1)
+        found.flag("bbox", has["b1"] != has["b2"], base, names, lambda k: "only one of b1/b2")
+        found.flag("bbox", inverted, base, names, lambda k: f"b1 {vec['b1'][k].tolist()} > b2 {vec['b2'][k].tolist()}")
+
+        # Depth bounds from the bbox corners
+        corners = np.stack([np.where(np.array([(c >> a) & 1 for a in range(3)], dtype=bool), vec["b2"], vec["b1"])
+                            for c in range(8)], axis=1)
+        rel = corners - vec["sc"][:, None, :]
+        cv_hat = vec["cv"] / _norm(vec["cv"])[:, None]
+        near = (rel * cv_hat[:, None, :]).sum(axis=2).min(axis=1)
+        far = np.sqrt((rel * rel).sum(axis=2)).max(axis=1)
+        pair = has_d1 & has_d2
+        found.flag("depth", has_d1 != has_d2, base, names, lambda k: "only one of d1/d2")
+        found.flag("depth", pair & ~((d1 > 0) & (d1 <= d2)), base, names, lambda k: f"d1 {d1[k]:.6g}, d2 {d2[k]:.6g}")
+        outside = pair & both & ~inverted & ((d1 < near - DEPTH_TOL) | (d2 > far + DEPTH_TOL))
+        found.flag("depth", outside, base, names,
+                   lambda k: f"d1/d2 {d1[k]:.6g}/{d2[k]:.6g} outside the bbox's {near[k]:.6g}..{far[k]:.6g}")
+
+    rz = [e.get("rz") for e in chunk]
+    bad = np.array([v is not None and not (isinstance(v, int) and not isinstance(v, bool) and v > 0) for v in rz])
+    found.flag("rz", bad, base, names, lambda k: f"rz {rz[k]!r}")
+
+    vc = np.array([e["vc"] if isinstance(e.get("vc"), int) else -1 for e in chunk], dtype=np.int64)
+    return t, string_hashes(names), has["b1"] | has["b2"], names, vc
+
+
+def check_range(path, start, end, opts):
+    """Stream one byte range. Returns (count, findings, times, name hashes, has a bbox, vc)."""
+    found = Findings()
+    count = 0
+    parts = []
+    for chunk in iter_chunks(path, start, end):
+        t, hashes, has_box, names, vc = check_chunk(chunk, count, found, opts)
+        if parts and len(t) and t[0] < parts[-1][0][-1]:
+            found.add("ti_order", count, names[0], "ti is before the previous entry's")
+        parts.append((t, hashes, has_box, vc))
+        count += len(chunk)
+    cat = lambda k, dt: np.concatenate([p[k] for p in parts]) if parts else np.zeros(0, dt)
+    return count, found, cat(0, np.float64), cat(1, np.int64), cat(2, bool), cat(3, np.int64)
+
+
+def validate(path, vis=None, nverts=None, workers=1, **opts):
+    """Run every check; returns the report dict."""
+    opts.setdefault("sc_range", SC_RANGE)
+    opts.setdefault("su_range", SU_RANGE)
+    t_start = time.perf_counter()
+    if workers <= 1:
+        results = [check_range(path, 0, None, opts)]
+    else:
+        ranges = byte_ranges(path, workers * 4)
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as ex:
+            results = list(ex.map(check_range, [path] * len(ranges), [a for a, _ in ranges],
+                                  [b for _, b in ranges], [opts] * len(ranges)))
+
+    found, offset = Findings(), 0
+    times, hashes, has_box, vcs = [], [], [], []
+    for count, part, t, h, b, vc in results:
+        if offset and count and times and len(times[-1]) and t[0] < times[-1][-1]:
+            found.add("ti_order", offset, "", "ti is before the previous entry's")
+        found.merge(part, offset)
+        times.append(t)
+        hashes.append(h)
+        has_box.append(b)
+        vcs.append(vc)
+        offset += count
+    total = offset
+    hashes = np.concatenate(hashes) if hashes else np.zeros(0, np.int64)
+    has_box = np.concatenate(has_box) if has_box else np.zeros(0, bool)
+    vc = np.concatenate(vcs) if vcs else np.zeros(0, np.int64)
+
+    _, first, inverse = np.unique(hashes, return_index=True, return_inverse=True)
+    dup = np.ones(total, dtype=bool)
+    dup[first] = False
+    for k in np.nonzero(dup)[0][:EXAMPLES]:
+        found.examples["nm_duplicate"].append({"index": int(k), "nm": "",
+                                               "detail": f"same name as entry #{first[inverse[k]]}"})
+    found.failed["nm_duplicate"] = int(dup.sum())
+    if has_box.any() and not has_box.all():
+        missing = np.nonzero(~has_box)[0]
+        found.failed["bbox"] += len(missing)
+        room = EXAMPLES - len(found.examples["bbox"])
+        found.examples["bbox"] += [{"index": int(k), "nm": "", "detail": "no b1/b2, unlike other entries"}
+                                   for k in missing[:max(room, 0)]]
+
+    report_vis = None
+    if vis:
+        rb = row_bytes(nverts)
+        size = os.path.getsize(vis)
+        report_vis = {"file": vis, "nVerts": nverts, "rowBytes": rb, "bytes": size}
+        if size != total * rb:
+            found.add("vis_rows", 0, "", f"{size} bytes is not {total} rows of {rb} bytes"
+                      + (f" (it is {size / rb:g} rows)" if size % rb == 0 else ""))
+        else:
+            rows = np.memmap(vis, dtype=np.uint8, mode="r", shape=(total, rb)) if total else np.zeros((0, rb), np.uint8)
+            counts = popcounts(rows)
+            empty = counts == 0
+            for k in np.nonzero(empty)[0][:EXAMPLES]:
+                found.examples["vis_empty"].append({"index": int(k), "nm": "", "detail": "row has no visible vertices"})
+            found.failed["vis_empty"] = int(empty.sum())
+            stale = (vc >= 0) & (vc != counts)
+            for k in np.nonzero(stale)[0][:EXAMPLES]:
+                found.examples["vis_count"].append({"index": int(k), "nm": "",
+                                                    "detail": f"vc {vc[k]}, but its row has {counts[k]} bits set"})
+            found.failed["vis_count"] = int(stale.sum())
+            report_vis["visibleMean"] = float(counts.mean()) if total else 0.0
+
+    return {"file": path, "entries": total, "bytes": os.path.getsize(path),
+            "seconds": round(time.perf_counter() - t_start, 3), "workers": max(1, workers), "vis": report_vis,
+            "ok": not any(found.failed.values()),
+            "checks": {name: {"failed": found.failed[name], "examples": found.examples[name]} for name in CHECKS}}
+
+
+def print_report(report):
+    print(f"{report['file']}: {report['entries']} entries, {report['bytes'] / 2**20:.1f} MB, "
+          f"checked in {report['seconds']:.2f}s on {report['workers']} worker(s)")
+    for name, res in report["checks"].items():
+        if res["failed"]:
+            print(f"  {name}: {res['failed']} failed")
+            for x in res["examples"][:3]:
+                print(f"    #{x['index']}{' ' + x['nm'] if x['nm'] else ''}: {x['detail']}")
+    print("  OK" if report["ok"] else "  FAILED")
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Validate imageMetadata files (and visTables) in bounded memory.")
+    ap.add_argument("meta", nargs="?", help="metadata JSON (or use --catalog/--mission)")
+    src = ap.add_mutually_exclusive_group()
+    src.add_argument("--catalog", help="validate every instrument of this catalog")
+    src.add_argument("--mission", help="use data/<mission>/dataset.json")
+    ap.add_argument("--data", default=DATA_DIR, help="data folder (default: %(default)s)")
+    ap.add_argument("--vis", help="visTable to check against the metadata (with --nverts)")
+    ap.add_argument("--nverts", type=int)
+    ap.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 2) - 1))
+    ap.add_argument("--nm-month", type=int, nargs="?", const=-1, metavar="OFFSET",
+                    help="check nm's YYYYMM against ti's (at OFFSET in nm, or 8 characters before its 'T')")
+    ap.add_argument("--sc-range", type=float, nargs=2, default=SC_RANGE, metavar=("MIN", "MAX"))
+    ap.add_argument("--su-range", type=float, nargs=2, default=SU_RANGE, metavar=("MIN", "MAX"))
+    ap.add_argument("--report", help="write the JSON report here")
+    ap.add_argument("--json", action="store_true", help="print the JSON report instead of a summary")
+    args = ap.parse_args()
+    if bool(args.meta) == bool(args.catalog or args.mission):
+        ap.error("give a metadata file, or --catalog/--mission")
+    if args.vis and not args.nverts:
+        ap.error("--vis needs --nverts")
+
+    jobs = [(args.meta, args.vis, args.nverts)]
+    if not args.meta:
+        jobs = []
+        for mission in fetch_datasets(args.data, args.catalog, args.mission):
+            for inst in mission["instruments"]:
+                instr = Instrument(mission, inst, args.data)
+                jobs.append((instr.meta_path, instr.vis_path if os.path.isfile(instr.vis_path) else None, instr.nverts))
+    opts = {"nm_month": args.nm_month, "sc_range": tuple(args.sc_range), "su_range": tuple(args.su_range)}
+    reports = [validate(meta, vis, nverts, args.workers, **opts) for meta, vis, nverts in jobs]
+    out = reports[0] if args.meta else {"ok": all(r["ok"] for r in reports), "reports": reports}
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump(out, f, indent=1)
+    if args.json:
+        print(json.dumps(out, indent=1))
+    else:
+        for r in reports:
+            print_report(r)
+    return 0 if out["ok"] else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
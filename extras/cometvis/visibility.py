@@ -0,0 +1,329 @@
+# visibility.py - per-image vertex visibility, as computed by the client's
+#   Preprocessor.computeVisibleVertices(), plus the pieces it depends on.
+#
+# For every model vertex v (nudged by MILLIMETER on each axis, as the client
+# does), a ray is cast from the spacecraft toward v:
+#   1. view-rect clip: the ray must hit the image rectangle (CometView.computeViewRect,
+#      placed at d1 along the camera vector, or 100 km when d1 is not known yet);
+#   2. first hit: the nearest front-facing triangle hit must be within METER
+#      of v's own distance, otherwise something is in front of v.
+# The visible set gives b1/b2 (bounding box of visible vertices) and d1/d2
+# (min/max depth along the camera vector), and is then grown by one ring of
+# neighbors (expandPaint(1)) to make the visTable row.
+#
+# Ray/triangle tests follow three.js Ray.intersectTriangle step for step, in
+# float64 on the float32 model positions, so results match the browser's
+# except where a ray grazes a triangle edge to within rounding.
+#
+# The occlusion test is done by an "engine" (see ENGINES). The raycast engine
+# below projects the front-facing triangles onto the image plane, bins them in
+# a grid, and tests each ray only against the triangles in its grid cell.
+
+import math
+import importlib
+
+import numpy as np
+
+
+MILLIMETER = 0.000001   # in km
+METER = 0.001           # in km
+LARGENUMBER = 1.0e12    # NormalDepth's initial min/max
+DEFAULT_DIST_TO_PLANE = 100     # CometView uses this when d1 is not known
+
+PAIR_CHUNK = 1 << 20    # ray/triangle pairs tested at a time
+
+
+# ---- three.js-compatible vector math (same operation order) -----------------
+
+def _dot(a, b):
+    return a[..., 0] * b[..., 0] + a[..., 1] * b[..., 1] + a[..., 2] * b[..., 2]
+
+
+def _cross(a, b):
+    return np.stack((a[..., 1] * b[..., 2] - a[..., 2] * b[..., 1],
+                     a[..., 2] * b[..., 0] - a[..., 0] * b[..., 2],
+                     a[..., 0] * b[..., 1] - a[..., 1] * b[..., 0]), axis=-1)
+
+
+def _normalize(v):
+    """Vector3.normalize(): v * (1 / |v|)."""
+    length = np.sqrt(_dot(v, v))
+    length = np.where(length == 0, 1.0, length)
+    return v * (1.0 / length)[..., None]
+
+
+def ray_triangle(origin, dirs, a, b, c, cull=True):
+    """
+    three.js Ray.intersectTriangle over arrays of rays and/or triangles
+    (broadcast together). Returns the distance to each hit point, inf on a miss.
+    With cull=True, back faces are skipped (a FrontSide material).
+    """
+    edge1 = b - a
+    edge2 = c - a
+    normal = _cross(edge1, edge2)
+    DdN = _dot(dirs, normal)
+    ok = (DdN < 0) if cull else (DdN != 0)
+    sign = np.where(DdN > 0, 1.0, -1.0)
+    DdN = np.abs(DdN)
+    diff = origin - a
+    DdQxE2 = sign * _dot(dirs, _cross(diff, edge2))
+    DdE1xQ = sign * _dot(dirs, _cross(edge1, diff))
+    QdN = -sign * _dot(diff, normal)
+    ok &= (DdQxE2 >= 0) & (DdE1xQ >= 0) & (DdQxE2 + DdE1xQ <= DdN) & (QdN >= 0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        t = np.where(ok, QdN / np.where(ok, DdN, 1.0), np.inf)
+        point = origin + dirs * t[..., None]
+        delta = point - origin
+        dist = np.sqrt(_dot(delta, delta))
+    return np.where(ok, dist, np.inf)
+
+
+# ---- camera ---------------------------------------------------------------------
+
+class View:
+    """Camera geometry for one metadata entry (CometView's sc, cv, up and view rect)."""
+
+    def __init__(self, entry, xfov, yfov):
+        self.sc = np.array(entry["sc"], dtype=np.float64)
+        self.normal = np.array(entry["cv"], dtype=np.float64)
+        self.up = np.array(entry["up"], dtype=np.float64)
+        d1 = entry.get("d1")
+        self.dist_to_plane = DEFAULT_DIST_TO_PLANE if d1 is None else d1
+        self.res = entry.get("rz")      # image width in pixels, if it differs from defaultRes
+        self.xfov, self.yfov = xfov, yfov
+        self.corners = self._view_rect()
+
+    def _view_rect(self):
+        """CometView.computeViewRect corners (UL, UR, LR, LL), stored as float32 like createViewRect."""
+        d = self.dist_to_plane
+        c = self.sc + _normalize(self.normal) * d
+        xr = self.xfov * (math.pi / 180) * 0.5
+        yr = self.yfov * (math.pi / 180) * 0.5
+        up_vec = _normalize(self.up) * (d * math.tan(yr))
+        right = _normalize(_cross(self.normal, self.up)) * (d * math.tan(xr))
+        corners = np.array([c + up_vec - right, c + up_vec + right,
+                            c - up_vec + right, c - up_vec - right])
+        return corners.astype(np.float32).astype(np.float64)
+
+    def in_view_rect(self, dirs):
+        """Rays (from sc) that hit the front of the view rect's two triangles."""
+        ul, ur, lr, ll = self.corners
+        hit = np.isfinite(ray_triangle(self.sc, dirs, ul, ll, ur))
+        rest = ~hit
+        hit[rest] = np.isfinite(ray_triangle(self.sc, dirs[rest], ur, ll, lr))
+        return hit
+
+    def basis(self):
+        """Orthonormal camera basis (forward, right, up) for image-plane projections."""
+        fwd = self.normal / np.linalg.norm(self.normal)
+        right = np.cross(fwd, self.up)
+        right /= np.linalg.norm(right)
+        return fwd, right, np.cross(right, fwd)
+
+
+# ---- first-hit engines ----------------------------------------------------------
+
+class RaycastEngine:
+    """Nearest front-facing triangle hit per ray, using an image-plane grid of triangles."""
+
+    name = "raycast"
+
+    def __init__(self, model, **options):
+        p = model.positions.astype(np.float64)
+        self.a = p[model.faces[:, 0]]
+        self.b = p[model.faces[:, 1]]
+        self.c = p[model.faces[:, 2]]
+        self.normals = _cross(self.b - self.a, self.c - self.a)
+
+    def visible(self, view, points, dirs, dist):
+        """The client's test: the first hit along the ray is within METER of the vertex."""
+        return np.abs(self.nearest(view, dirs) - dist) < METER
+
+    def nearest(self, view, dirs):
+        """Distance from view.sc to the first front-facing hit along each ray (inf if none)."""
+        origin = view.sc
+        best = np.full(len(dirs), np.inf)
+        if len(dirs) == 0:
+            return best
+
+        # Back faces can never be hit (FrontSide): cull them once for all rays,
+        # keeping the nearly edge-on ones for the exact test.
+        rel = self.a - origin
+        facing = _dot(rel, self.normals)
+        tol = 1e-12 * np.sqrt(_dot(rel, rel) * _dot(self.normals, self.normals))
+        tris = np.nonzero(facing < tol)[0]
+
+        fwd, right, up = view.basis()
+        # Triangles that reach behind (or almost to) the camera plane don't
+        # project cleanly; they are tested against every ray.
+        z = np.stack([(v[tris] - origin) @ fwd for v in (self.a, self.b, self.c)], axis=1)
+        near = z.min(axis=1) <= 1e-9
+        far_tris = tris[~near]
+        self._scan(origin, dirs, np.arange(len(dirs)), tris[near], best)
+
+        # Project rays and triangles onto the image plane (tangent coordinates)
+        dz = dirs @ fwd
+        rays = np.nonzero(dz > 0)[0]
+        if len(rays) < len(dirs):
+            # (Not reached for rays through the view rect.) Test the rest exhaustively.
+            self._scan(origin, dirs, np.nonzero(dz <= 0)[0], far_tris, best)
+        if len(rays) == 0 or len(far_tris) == 0:
+            return best
+        rx = (dirs[rays] @ right) / dz[rays]
+        ry = (dirs[rays] @ up) / dz[rays]
+
+        zf = z[~near]
+        tx = np.stack([((v[far_tris] - origin) @ right) for v in (self.a, self.b, self.c)], axis=1) / zf
+        ty = np.stack([((v[far_tris] - origin) @ up) for v in (self.a, self.b, self.c)], axis=1) / zf
+        pad = 1e-9 + 1e-9 * max(np.abs(rx).max(), np.abs(ry).max())
+        x0, x1 = rx.min() - pad, rx.max() + pad
+        y0, y1 = ry.min() - pad, ry.max() + pad
+        tx0, tx1 = tx.min(axis=1) - pad, tx.max(axis=1) + pad
+        ty0, ty1 = ty.min(axis=1) - pad, ty.max(axis=1) + pad
+        inside = (tx1 >= x0) & (tx0 <= x1) & (ty1 >= y0) & (ty0 <= y1)
+        far_tris, tx0, tx1, ty0, ty1 = far_tris[inside], tx0[inside], tx1[inside], ty0[inside], ty1[inside]
+        if len(far_tris) == 0:
+            return best
+
+        # Grid with about one cell per two triangles over the rays' extent
+        w, h = max(x1 - x0, 1e-12), max(y1 - y0, 1e-12)
+        ncells = int(np.clip(len(far_tris) // 2, 1, 1 << 22))
+        gx = int(np.clip(round(math.sqrt(ncells * w / h)), 1, 1 << 12))
+        gy = int(np.clip(round(ncells / gx), 1, 1 << 12))
+        sx, sy = gx / w, gy / h
+
+        cx0 = np.clip(((tx0 - x0) * sx).astype(np.int64), 0, gx - 1)
+        cx1 = np.clip(((tx1 - x0) * sx).astype(np.int64), 0, gx - 1)
+        cy0 = np.clip(((ty0 - y0) * sy).astype(np.int64), 0, gy - 1)
+        cy1 = np.clip(((ty1 - y0) * sy).astype(np.int64), 0, gy - 1)
+        nx = cx1 - cx0 + 1
+        counts = nx * (cy1 - cy0 + 1)
+        rep = np.repeat(np.arange(len(far_tris)), counts)
+        k = np.arange(len(rep)) - np.repeat(np.cumsum(counts) - counts, counts)
+        cells = (cy0[rep] + k // nx[rep]) * gx + (cx0[rep] + k % nx[rep])
+        order = np.argsort(cells, kind="stable")
+        cell_tris = far_tris[rep[order]]
+        cell_end = np.cumsum(np.bincount(cells, minlength=gx * gy))
+        cell_start = cell_end - np.bincount(cells, minlength=gx * gy)
+
+        ray_cell = (np.clip(((ry - y0) * sy).astype(np.int64), 0, gy - 1) * gx
+                    + np.clip(((rx - x0) * sx).astype(np.int64), 0, gx - 1))
+        self._scan_cells(origin, dirs, rays, cell_start[ray_cell],
+                         cell_end[ray_cell] - cell_start[ray_cell], cell_tris, best)
+        return best
+
+    def _scan_cells(self, origin, dirs, rays, starts, counts, cell_tris, best):
+        """Test each ray against its cell's triangles, PAIR_CHUNK pairs at a time."""
+        has = counts > 0
+        rays, starts, counts = rays[has], starts[has], counts[has]
+        ends = np.cumsum(counts)
+        lo = 0
+        while lo < len(rays):
+            hi = int(np.searchsorted(ends, ends[lo] - counts[lo] + PAIR_CHUNK, side="right"))
+            hi = max(hi, lo + 1)
+            r, s, n = rays[lo:hi], starts[lo:hi], counts[lo:hi]
+            offsets = np.cumsum(n) - n
+            pair_ray = np.repeat(r, n)
+            pair_tri = cell_tris[np.repeat(s - offsets, n) + np.arange(int(n.sum()))]
+            dist = ray_triangle(origin, dirs[pair_ray], self.a[pair_tri], self.b[pair_tri],
+                                self.c[pair_tri])
+            best[r] = np.minimum(best[r], np.minimum.reduceat(dist, offsets))
+            lo = hi
+
+    def _scan(self, origin, dirs, rays, tris, best):
+        """Test every ray in rays against every triangle in tris."""
+        if len(rays) == 0 or len(tris) == 0:
+            return
+        step = max(1, PAIR_CHUNK // len(tris))
+        for i in range(0, len(rays), step):
+            r = rays[i:i + step]
+            dist = ray_triangle(origin, dirs[r][:, None, :], self.a[tris][None], self.b[tris][None],
+                                self.c[tris][None])
+            best[r] = np.minimum(best[r], dist.min(axis=1))
+
+
+# Engines are imported on first use, so optional dependencies stay optional.
+# An engine is built as Engine(model, **options) and provides
+# visible(view, points, dirs, dist) -> bool per vertex (for rays through the view rect).
+ENGINES = {
+    "raycast": "cometvis.visibility:RaycastEngine",
+    "zbuffer": "cometvis.zbuffer:ZBufferEngine",
+    "dsk": "cometvis.dsk:DskEngine",
+    "bvh": "cometvis.bvh:BvhEngine",
+}
+
+
+def make_engine(name, model, **options):
+    if name not in ENGINES:
+        raise SystemExit(f"Unknown engine {name!r}; choose from {', '.join(ENGINES)}")
+    module, cls = ENGINES[name].split(":")
+    return getattr(importlib.import_module(module), cls)(model, **options)
+
+
+# ---- per-image visibility -------------------------------------------------------
+
+class ViewVisibility:
+    """Result for one image: visTable mask (after dilation), b1/b2, d1/d2, and the raw visible count."""
+
+    def __init__(self, mask, b1, b2, d1, d2, count):
+        self.mask = mask
+        self.b1, self.b2 = b1, b2
+        self.d1, self.d2 = d1, d2
+        self.count = count
+
+    @property
+    def any_visible(self):
+        return self.count > 0
+
+
+def visible_vertices(model, view, engine):
+    """
+    Vertices whose ray from sc clears the view rect and that the engine finds
+    unoccluded. Returns (mask, nudged positions, positions - sc).
+    """
+    points = model.positions.astype(np.float64) + MILLIMETER
+    vert_to_sc = points - view.sc
+    dist = np.sqrt(_dot(vert_to_sc, vert_to_sc))
+    dirs = _normalize(_normalize(vert_to_sc))   # Raycaster.set, then the mesh's ray transform re-normalizes
+
+    mask = np.zeros(len(points), dtype=bool)
+    cand = np.nonzero(view.in_view_rect(dirs))[0]
+    if len(cand):
+        mask[cand] = engine.visible(view, points[cand], dirs[cand], dist[cand])
+    return mask, points, vert_to_sc
+
+
+def view_visibility(model, view, engine, rings=1):
+    """Visibility, bbox and depth range for one image (computeVisibleVertices + expandPaint)."""
+    mask, points, vert_to_sc = visible_vertices(model, view, engine)
+    count = int(mask.sum())
+    if count:
+        vis = points[mask]
+        b1, b2 = vis.min(axis=0).tolist(), vis.max(axis=0).tolist()
+        depth = _dot(vert_to_sc[mask], view.normal)
+        d1, d2 = float(depth.min()), float(depth.max())
+    else:
+        b1, b2 = [math.inf] * 3, [-math.inf] * 3
+        d1, d2 = LARGENUMBER, -LARGENUMBER
+    mask = model.dilate(mask, rings)
+    return ViewVisibility(mask, b1, b2, d1, d2, count)
+
+
+# ---- image scale (FilterEngine.getM2FromDistance) -------------------------------
+
+def m2_multiplier(xfov, default_res):
+    """dist * m2_multiplier == meters per pixel at defaultRes."""
+    m2dist = (.001 * (default_res / 2)) / math.tan(math.pi * (xfov / 2.0) / 180.0)
+    return 1.0 / m2dist
+
+
+def m2_from_distance(entry, dist, multiplier, default_res):
+    m2 = dist * multiplier
+    if "rz" in entry:
+        m2 *= default_res / entry["rz"]
+    return _js_round(m2 * 100) / 100
+
+
+def _js_round(x):
+    """Math.round: halves round up (toward +inf)."""
+    return math.floor(x + 0.5)
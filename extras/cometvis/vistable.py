@@ -0,0 +1,396 @@
+# vistable.py - the visTable file format, and tools for whole tables.
+#
+# A visTable is a flat file of fixed-size rows, one per entry of the metadata
+# file (same order). Each row is a bitset over the model's vertices: bit i is
+# set if vertex i is visible in that image. Bits are LSB-first within a byte
+# (ROI.setNthBit), and rows are padded to a multiple of 64 bits so the server's
+# checkvis2 code can treat them as uint64 words.
+#
+# Tables are memory-mapped and processed CHUNK_BYTES at a time, so multi-GB
+# tables stream at disk speed. From the extras folder:
+#
+#   python -m cometvis.vistable inspect  <visTable> [--meta M] [--nverts N]
+#   python -m cometvis.vistable validate <visTable> <metaData> [--nverts N]
+#   python -m cometvis.vistable split    <visTable> <metaData> (--parts K | --rows R) [--nverts N]
+#   python -m cometvis.vistable concat   <outVis> <outMeta> <vis1> <meta1> [<vis2> <meta2> ...] [--nverts N]
+#   python -m cometvis.vistable reorder  <visTable> <metaData> <outVis> <outMeta> (--by-ti | --order M) [--nverts N]
+#   python -m cometvis.vistable stats    <visTable> <metaData> <model.obj> <outMeta> [--nverts N]
+#
+# stats sets each entry's vc (visible vertices in its row) and va (their area,
+# each vertex counting a third of its faces' area), as build_vistable does.
+#
+# Without --nverts, the row size comes from the file size and the metadata
+# length, and the padding-bit check is skipped.
+
+import os
+import sys
+import json
+import shutil
+import argparse
+
+import numpy as np
+
+from cometvis.objmodel import load_obj
+
+CHUNK_BYTES = 64 << 20      # bytes of table handled at a time
+_POP8 = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+def row_bytes(nverts):
+    """Bytes per visTable row for a model with nverts vertices."""
+    return -(-nverts // 64) * 8
+
+
+def pack_row(mask, nverts):
+    """Pack a per-vertex bool mask into one visTable row (bytes)."""
+    nbits = row_bytes(nverts) * 8
+    mask = np.asarray(mask, dtype=bool)[:nbits]   # like the client, bits past the row are dropped
+    bits = np.zeros(nbits, dtype=bool)
+    bits[:mask.size] = mask
+    return np.packbits(bits, bitorder="little").tobytes()
+
+
+def unpack_row(row, nverts):
+    """Inverse of pack_row: per-vertex bool mask of length nverts."""
+    bits = np.unpackbits(np.frombuffer(row, dtype=np.uint8), bitorder="little")
+    return bits[:nverts].astype(bool)
+
+
+def map_rows(path, rb, count=None, mode="r"):
+    """Memory-map a table with rb-byte rows as a (rows, rb) uint8 array."""
+    size = os.path.getsize(path)
+    if size % rb:
+        raise ValueError(f"{path}: {size} bytes is not a whole number of {rb}-byte rows")
+    if count is not None and size // rb != count:
+        raise ValueError(f"{path}: {size // rb} rows, expected {count}")
+    if size == 0:
+        return np.zeros((0, rb), dtype=np.uint8)
+    return np.memmap(path, dtype=np.uint8, mode=mode, shape=(size // rb, rb))
+
+
+def open_rows(path, nverts, count=None, mode="r"):
+    """
+    Memory-map a visTable as a (rows, row_bytes) uint8 array. With count, the
+    file must hold exactly that many rows (e.g. the metadata length).
+    """
+    return map_rows(path, row_bytes(nverts), count, mode)
+
+
+def chunks(rows):
+    """Row slices covering rows, about CHUNK_BYTES each."""
+    step = max(1, CHUNK_BYTES // max(rows.shape[1], 1))
+    for lo in range(0, len(rows), step):
+        yield slice(lo, min(lo + step, len(rows)))
+
+
+def _row_popcounts(block):
+    """Set bits per row of an in-memory (rows, row_bytes) uint8 block."""
+    if hasattr(np, "bitwise_count"):        # NumPy 2
+        return np.bitwise_count(block.view(np.uint64)).sum(axis=1, dtype=np.int64)
+    return _POP8[block].sum(axis=1, dtype=np.int64)
+
+
+def popcounts(rows):
+    """Number of set bits (visible vertices) in each row."""
+    out = np.zeros(len(rows), dtype=np.int64)
+    for sl in chunks(rows):
+        out[sl] = _row_popcounts(np.asarray(rows[sl]))
+    return out
+
+
+def area_table(weights, nverts):
+    """
+    (row_bytes, 256) table for weighted_counts: at each byte of a row, the sum
+    of weights over the vertices of each byte value's set bits.
+    """
+    rb = row_bytes(nverts)
+    w = np.zeros(rb * 8)
+    n = min(len(weights), nverts)
+    w[:n] = weights[:n]
+    bits = (np.arange(256)[:, None] >> np.arange(8)) & 1      # LSB first, like the rows
+    return w.reshape(rb, 8) @ bits.T.astype(np.float64)
+
+
+def weighted_counts(rows, table):
+    """For each row, the sum of a per-vertex weight (see area_table) over its set bits."""
+    rb = table.shape[0]
+    out = np.zeros(len(rows))
+    step = max(1, (CHUNK_BYTES >> 6) // rb)     # the gather is 8 bytes per row byte
+    cols = np.arange(rb)
+    for lo in range(0, len(rows), step):
+        block = np.asarray(rows[lo:lo + step])
+        out[lo:lo + len(block)] = table[cols, block].sum(axis=1)
+    return out
+
+
+def visible_stats(rows, table):
+    """
+    (vc, va) per row: visible vertices, and their area (the row's weighted
+    count with per-vertex areas, rounded to 1e-6: 1 m^2 for a km model).
+    """
+    return popcounts(rows), np.round(weighted_counts(rows, table), 6)
+
+
+def match_counts(rows, query):
+    """
+    For each row, how many of the query row's bits it shares (what checkvis2
+    compares with mustMatch), scanning the whole table.
+    """
+    query = np.frombuffer(query, dtype=np.uint8)
+    out = np.zeros(len(rows), dtype=np.int64)
+    for sl in chunks(rows):
+        out[sl] = _row_popcounts(np.asarray(rows[sl]) & query)
+    return out
+
+
+def padding_mask(nverts):
+    """Per-byte mask of a row's padding bits (bits nverts and up)."""
+    rb = row_bytes(nverts)
+    bits = np.zeros(rb * 8, dtype=bool)
+    bits[nverts:] = True
+    return np.packbits(bits, bitorder="little")
+
+
+def bad_padding(rows, nverts):
+    """Indices of rows with any padding bit set."""
+    mask = padding_mask(nverts)
+    cols = np.nonzero(mask)[0]
+    if cols.size == 0:
+        return np.zeros(0, dtype=np.int64)
+    bad = []
+    for sl in chunks(rows):
+        hits = (np.asarray(rows[sl, cols.min():]) & mask[cols.min():]).any(axis=1)
+        bad.append(np.nonzero(hits)[0] + sl.start)
+    return np.concatenate(bad) if bad else np.zeros(0, dtype=np.int64)
+
+
+def load_meta(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def write_meta(meta, path):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(meta, f, separators=(",", ":"))
+
+
+def validate(rows, meta=None, nverts=None):
+    """
+    Problems with a mapped table (and its metadata): row count, duplicate
+    names, padding bits, and empty rows (the server never writes those).
+    Returns a list of messages, empty if the table is good.
+    """
+    problems = []
+    if meta is not None:
+        if len(meta) != len(rows):
+            problems.append(f"{len(rows)} rows but {len(meta)} metadata entries")
+        names = [e.get("nm") for e in meta]
+        if len(set(names)) != len(names):
+            problems.append(f"{len(names) - len(set(names))} duplicate 'nm' entries")
+        missing = [i for i, e in enumerate(meta) if not all(k in e for k in ("b1", "b2", "d1", "d2"))]
+        if missing:
+            problems.append(f"{len(missing)} entries without b1/b2/d1/d2 (first at {missing[0]})")
+    if nverts is not None:
+        if rows.shape[1] != row_bytes(nverts):
+            problems.append(f"row size {rows.shape[1]} bytes, but nVerts={nverts} needs {row_bytes(nverts)}")
+        else:
+            bad = bad_padding(rows, nverts)
+            if bad.size:
+                problems.append(f"{bad.size} rows have padding bits set (first at {bad[0]})")
+    empty = np.nonzero(popcounts(rows) == 0)[0]
+    if empty.size:
+        problems.append(f"{empty.size} rows have no visible vertices (first at {empty[0]})")
+    return problems
+
+
+def write_rows(rows, out_path, index=None):
+    """Write rows (all of them, or rows[index] in that order) to out_path."""
+    with open(out_path, "wb") as f:
+        if index is None:
+            for sl in chunks(rows):
+                f.write(np.asarray(rows[sl]).tobytes())
+            return
+        index = np.asarray(index, dtype=np.int64)
+        step = max(1, CHUNK_BYTES // max(rows.shape[1], 1))
+        for lo in range(0, len(index), step):
+            f.write(rows[index[lo:lo + step]].tobytes())
+
+
+def concat_files(paths, out_path):
+    """Concatenate table files byte for byte."""
+    with open(out_path, "wb") as out:
+        for path in paths:
+            with open(path, "rb") as f:
+                shutil.copyfileobj(f, out, CHUNK_BYTES)
+
+
+def ti_order(meta):
+    """Row order that sorts meta by 'ti' (stable)."""
+    return sorted(range(len(meta)), key=lambda i: meta[i].get("ti", ""))
+
+
+def name_order(meta, names):
+    """Row order that puts meta in the order of names (every name must be in meta)."""
+    index = {e["nm"]: i for i, e in enumerate(meta)}
+    missing = [nm for nm in names if nm not in index]
+    if missing:
+        raise ValueError(f"{len(missing)} names are not in the table (first: {missing[0]})")
+    return [index[nm] for nm in names]
+
+
+def _open_pair(vis, meta_file, nverts):
+    meta = load_meta(meta_file) if meta_file else None
+    if nverts:
+        return map_rows(vis, row_bytes(nverts)), meta
+    if not meta:
+        raise SystemExit("Need --nverts, or metadata to infer the row size from")
+    size = os.path.getsize(vis)
+    if size % len(meta) or (size // len(meta)) % 8:
+        raise SystemExit(f"{vis}: {size} bytes is not {len(meta)} rows of whole 64-bit words; pass --nverts")
+    return map_rows(vis, size // len(meta)), meta
+
+
+def _cmd_inspect(args):
+    rows, meta = _open_pair(args.vis, args.meta, args.nverts)
+    counts = popcounts(rows)
+    print(f"{args.vis}: {len(rows)} rows of {rows.shape[1]} bytes ({rows.shape[1] * 8} bits)")
+    if len(rows):
+        nbits = args.nverts or rows.shape[1] * 8
+        print(f"Visible vertices per row: min {counts.min()}, median {int(np.median(counts))}, "
+              f"mean {counts.mean():.1f}, max {counts.max()} ({counts.mean() / nbits:.2%} of {nbits})")
+        for k in np.argsort(-counts)[:args.show]:
+            print(f"  row {k}{' ' + meta[k]['nm'] if meta and k < len(meta) else ''}: {counts[k]}")
+    return 0
+
+
+def _cmd_validate(args):
+    rows, meta = _open_pair(args.vis, args.meta, args.nverts)
+    if not args.nverts:
+        print("No --nverts: padding bits not checked")
+    problems = validate(rows, meta, args.nverts)
+    for p in problems:
+        print(p)
+    print(f"{args.vis}: {len(rows)} rows: {'FAIL' if problems else 'PASS'}")
+    return 1 if problems else 0
+
+
+def _cmd_split(args):
+    rows, meta = _open_pair(args.vis, args.meta, args.nverts)
+    per = args.rows or -(-len(rows) // args.parts)
+    for part, lo in enumerate(range(0, len(rows), max(per, 1))):
+        hi = min(lo + per, len(rows))
+        vis_out, meta_out = f"{args.vis}.{part:03d}", f"{args.meta}.{part:03d}"
+        write_rows(rows[lo:hi], vis_out)
+        write_meta(meta[lo:hi], meta_out)
+        print(f"Wrote {vis_out} and {meta_out} (rows {lo}-{hi - 1})")
+    return 0
+
+
+def _cmd_concat(args):
+    pairs = list(zip(args.inputs[0::2], args.inputs[1::2]))
+    if len(args.inputs) % 2 or not pairs:
+        raise SystemExit("concat needs <vis> <meta> pairs")
+    meta, rb = [], None
+    for vis, meta_file in pairs:
+        rows, m = _open_pair(vis, meta_file, args.nverts)
+        problems = validate(rows, m, args.nverts)
+        if rb not in (None, rows.shape[1]) or problems:
+            raise SystemExit(f"{vis}: " + ("; ".join(problems) or f"row size {rows.shape[1]} differs from {rb}"))
+        rb = rows.shape[1]
+        meta.extend(m)
+    names = [e["nm"] for e in meta]
+    if len(set(names)) != len(names):
+        raise SystemExit("The inputs share image names; merge them with build_vistable --base-meta instead")
+    concat_files([vis for vis, _ in pairs], args.out_vis)
+    write_meta(meta, args.out_meta)
+    print(f"Wrote {args.out_vis} and {args.out_meta} ({len(meta)} rows)")
+    return 0
+
+
+def _cmd_reorder(args):
+    rows, meta = _open_pair(args.vis, args.meta, args.nverts)
+    if len(rows) != len(meta):
+        raise SystemExit(f"{len(rows)} rows but {len(meta)} metadata entries")
+    if args.by_ti:
+        order = ti_order(meta)
+    else:
+        try:
+            order = name_order(meta, [e["nm"] for e in load_meta(args.order)])
+        except ValueError as e:
+            raise SystemExit(str(e))
+    write_rows(rows, args.out_vis, order)
+    write_meta([meta[i] for i in order], args.out_meta)
+    print(f"Wrote {args.out_vis} and {args.out_meta} ({len(order)} of {len(rows)} rows)")
+    return 0
+
+
+def _cmd_stats(args):
+    rows, meta = _open_pair(args.vis, args.meta, args.nverts)
+    if len(rows) != len(meta):
+        raise SystemExit(f"{len(rows)} rows but {len(meta)} metadata entries")
+    model = load_obj(args.model)
+    vc, va = visible_stats(rows, area_table(model.vertex_areas(), args.nverts or model.nverts))
+    for e, count, area in zip(meta, vc.tolist(), va.tolist()):
+        e["vc"], e["va"] = count, area
+    write_meta(meta, args.out_meta)
+    if len(rows):
+        print(f"Visible area per row: min {va.min():.3f}, median {np.median(va):.3f}, max {va.max():.3f} "
+              f"(model surface {model.vertex_areas().sum():.3f})")
+    print(f"Wrote {args.out_meta} ({len(meta)} entries with vc and va)")
+    return 0
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Inspect, validate, split, concatenate and reorder visTables.")
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("--nverts", type=int, help="model vertex count (mission nVerts)")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+
+    p = sub.add_parser("inspect", parents=[common], help="row count and visible vertices per row")
+    p.add_argument("vis")
+    p.add_argument("--meta")
+    p.add_argument("--show", type=int, default=5, help="list the rows with the most visible vertices")
+    p.set_defaults(func=_cmd_inspect)
+
+    p = sub.add_parser("validate", parents=[common], help="check a table against its metadata")
+    p.add_argument("vis")
+    p.add_argument("meta")
+    p.set_defaults(func=_cmd_validate)
+
+    p = sub.add_parser("split", parents=[common], help="split a table and its metadata into numbered parts")
+    p.add_argument("vis")
+    p.add_argument("meta")
+    n = p.add_mutually_exclusive_group(required=True)
+    n.add_argument("--parts", type=int)
+    n.add_argument("--rows", type=int)
+    p.set_defaults(func=_cmd_split)
+
+    p = sub.add_parser("concat", parents=[common], help="concatenate tables and their metadata")
+    p.add_argument("out_vis")
+    p.add_argument("out_meta")
+    p.add_argument("inputs", nargs="+", metavar="vis meta")
+    p.set_defaults(func=_cmd_concat)
+
+    p = sub.add_parser("reorder", parents=[common], help="permute rows by time, or into another metadata file's order")
+    p.add_argument("vis")
+    p.add_argument("meta")
+    p.add_argument("out_vis")
+    p.add_argument("out_meta")
+    o = p.add_mutually_exclusive_group(required=True)
+    o.add_argument("--by-ti", action="store_true")
+    o.add_argument("--order", help="metadata file whose 'nm' order to follow (may be a subset)")
+    p.set_defaults(func=_cmd_reorder)
+
+    p = sub.add_parser("stats", parents=[common], help="add visible-vertex counts and areas (vc, va) to the metadata")
+    p.add_argument("vis")
+    p.add_argument("meta")
+    p.add_argument("model", help="the mission's shape model (OBJ)")
+    p.add_argument("out_meta")
+    p.set_defaults(func=_cmd_stats)
+
+    args = ap.parse_args()
+    sys.exit(args.func(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+# zbuffer.py - depth-buffer visibility engine.
+#
+# Instead of casting a ray per vertex, rasterize the front-facing triangles
+# into a depth image at the camera's FOV and a fraction (scale) of its
+# resolution (defaultRes, or the image's own 'rz'). This is what a GPU would
+# do; here triangles are grouped by screen-box size and each group is
+# rasterized on one NumPy grid, with the edge functions and 1/depth (both
+# affine in screen space) evaluated from per-triangle coefficients, and each
+# covered pixel's depth is the exact distance to the triangle's plane along
+# that pixel's ray.
+#
+# A vertex is then classified by the 3x3 pixels around it, with a tolerance of
+# tol_px pixel footprints at its depth (never less than METER): visible if
+# all of them are drawn within the tolerance of its depth, hidden if all of
+# them are in front of it by more (plus their own spread in depth, which is
+# large on grazing surfaces). The rest - vertices on silhouettes and occlusion
+# edges, where a pixel-center sample can't decide - get the raycast engine's
+# exact first-hit test, so the result is the client's to within the rare
+# vertex the neighborhood test would misclassify. At the defaults (scale 0.5,
+# tol_px 4) bench_engines.py finds every visible set identical to the raycast
+# engine's on synthetic models of 3k, 28k and 115k vertices, at about 1.4x its
+# speed on the larger two (on very small models the raycast engine is faster).
+# exact=False lets the depth test alone decide, as a GPU would. That mode is
+# experimental: faster, but it differs from the client at 2-3% of the visible
+# vertices.
+
+import math
+
+import numpy as np
+
+from cometvis.visibility import METER, RaycastEngine, _dot
+
+PIXEL_CHUNK = 1 << 22   # triangle/pixel pairs rasterized at a time
+
+
+class ZBufferEngine:
+    name = "zbuffer"
+
+    def __init__(self, model, default_res=1024, scale=0.5, tol_px=4.0, exact=True, **options):
+        self.raycast = RaycastEngine(model)
+        self.a, self.b, self.c = self.raycast.a, self.raycast.b, self.raycast.c
+        self.normals = self.raycast.normals
+        self.default_res = default_res
+        self.scale = scale
+        self.tol_px = tol_px
+        self.exact = exact
+
+    def raster_size(self, view):
+        tx = math.tan(math.radians(view.xfov) * 0.5)
+        ty = math.tan(math.radians(view.yfov) * 0.5)
+        w = max(1, int(round((view.res or self.default_res) * self.scale)))
+        h = max(1, int(round(w * ty / tx)))
+        return w, h, tx, ty
+
+    def depth_buffer(self, view):
+        """
+        Depth (distance along the camera vector) of the nearest front face at
+        each pixel center; inf where nothing is drawn. Returns (zbuf, frame),
+        where frame holds what is needed to map points to pixels.
+        """
+        origin = view.sc
+        fwd, right, up = view.basis()
+        w, h, tx, ty = self.raster_size(view)
+        inv = np.zeros(w * h)               # 1 / depth, so the nearest face has the largest value
+        frame = (origin, fwd, right, up, w, h, tx, ty)
+
+        rel = self.a - origin
+        facing = _dot(rel, self.normals)
+        tris = np.nonzero(facing < 0)[0]
+        verts = [v[tris] - origin for v in (self.a, self.b, self.c)]
+        z = np.stack([v @ fwd for v in verts], axis=1)
+        ok = z.min(axis=1) > 1e-9          # triangles reaching behind the camera are not drawn
+        tris, z = tris[ok], z[ok]
+        verts = [v[ok] for v in verts]
+
+        # Pixel coordinates of the corners (x right, y down; pixel centers at +0.5)
+        px = np.stack([((v @ right) / z[:, k] / tx + 1) * 0.5 * w for k, v in enumerate(verts)], axis=1)
+        py = np.stack([(1 - (v @ up) / z[:, k] / ty) * 0.5 * h for k, v in enumerate(verts)], axis=1)
+        i0 = np.clip(np.ceil(px.min(axis=1) - 0.5), 0, w).astype(np.int64)
+        i1 = np.clip(np.floor(px.max(axis=1) - 0.5), -1, w - 1).astype(np.int64)
+        j0 = np.clip(np.ceil(py.min(axis=1) - 0.5), 0, h).astype(np.int64)
+        j1 = np.clip(np.floor(py.max(axis=1) - 0.5), -1, h - 1).astype(np.int64)
+        nx = i1 - i0 + 1
+        ny = j1 - j0 + 1
+        drawn = (nx > 0) & (ny > 0)
+        tris, px, py, i0, j0, nx, ny = tris[drawn], px[drawn], py[drawn], i0[drawn], j0[drawn], nx[drawn], ny[drawn]
+        if len(tris) == 0:
+            return np.full(w * h, np.inf), frame
+
+        # Triangle setup. Each edge function and the inverse depth are affine in
+        # the pixel offset (i, j) from the box corner: f = f0 + fx * i + fy * j.
+        # Edges are oriented so inside is f >= 0 for either screen winding.
+        area = (px[:, 1] - px[:, 0]) * (py[:, 2] - py[:, 0]) - (px[:, 2] - px[:, 0]) * (py[:, 1] - py[:, 0])
+        s = np.sign(area)
+        cx, cy = i0 + 0.5, j0 + 0.5
+        edges = []
+        for k0, k1 in ((0, 1), (1, 2), (2, 0)):
+            ex = -(py[:, k1] - py[:, k0]) * s
+            ey = (px[:, k1] - px[:, k0]) * s
+            edges.append((ex * (cx - px[:, k0]) + ey * (cy - py[:, k0]), ex, ey))
+        # 1/depth where the pixel's ray (fwd + x*right + y*up) meets the triangle's plane N . (p - o) = d
+        nrm = self.normals[tris]
+        plane_d = facing[tris]
+        qx = (nrm @ right) * (2 * tx / w) / plane_d
+        qy = -(nrm @ up) * (2 * ty / h) / plane_d
+        q0 = ((nrm @ fwd) + (nrm @ right) * (cx / w * 2 - 1) * tx + (nrm @ up) * (1 - cy / h * 2) * ty) / plane_d
+
+        # Rasterize triangles in groups of similar box size, each group on one
+        # (group, rows, cols) grid of pixel offsets, PIXEL_CHUNK pixels at a time.
+        bx = 1 << np.ceil(np.log2(nx)).astype(np.int64)
+        by = 1 << np.ceil(np.log2(ny)).astype(np.int64)
+        group = by * (2 * w) + bx
+        order = np.argsort(group, kind="stable")
+        starts = np.flatnonzero(np.r_[True, group[order][1:] != group[order][:-1]])
+        for g0, g1 in zip(starts, np.r_[starts[1:], len(order)]):
+            gx, gy = int(bx[order[g0]]), int(by[order[g0]])
+            ii = np.arange(gx, dtype=np.float64)
+            jj = np.arange(gy, dtype=np.float64)[:, None]
+            step = max(1, PIXEL_CHUNK // (gx * gy))
+            for c0 in range(g0, g1, step):
+                t = order[c0:min(g1, c0 + step)]
+                inside = (ii < nx[t, None, None]) & (jj < ny[t, None, None])
+                for f0, fx, fy in edges:
+                    inside &= (f0[t, None, None] + fy[t, None, None] * jj) + fx[t, None, None] * ii >= 0
+                tri, pj, pi = np.nonzero(inside)
+                t = t[tri]
+                q = q0[t] + qx[t] * pi + qy[t] * pj
+                np.maximum.at(inv, (j0[t] + pj) * w + (i0[t] + pi), q)
+        with np.errstate(divide="ignore"):
+            return 1.0 / inv, frame
+
+    def visible(self, view, points, dirs, dist):
+        zbuf, (origin, fwd, right, up, w, h, tx, ty) = self.depth_buffer(view)
+        rel = points - origin
+        zv = rel @ fwd
+        out = np.zeros(len(points), dtype=bool)
+        ok = np.nonzero(zv > 0)[0]
+        zv = zv[ok]
+        u = ((rel[ok] @ right) / zv / tx + 1) * 0.5 * w
+        v = (1 - (rel[ok] @ up) / zv / ty) * 0.5 * h
+        i = np.floor(u).astype(np.int64)
+        j = np.floor(v).astype(np.int64)
+        tol = np.maximum(METER, self.tol_px * zv * (2 * tx / w))
+        if not self.exact:
+            out[ok] = zv <= zbuf[np.clip(j, 0, h - 1) * w + np.clip(i, 0, w - 1)] + tol
+            return out
+
+        near = np.full(len(ok), np.inf)
+        far = np.full(len(ok), -np.inf)
+        for di in (-1, 0, 1):
+            for dj in (-1, 0, 1):
+                d = zbuf[np.clip(j + dj, 0, h - 1) * w + np.clip(i + di, 0, w - 1)]
+                np.minimum(near, d, out=near)
+                np.maximum(far, d, out=far)
+        seen = (near >= zv - tol) & (far <= zv + tol)
+        with np.errstate(invalid="ignore"):     # inf - inf where nothing is drawn: not hidden
+            hidden = far + (far - near) < zv - tol  # a surface that steep could reach the vertex's depth
+        out[ok] = seen
+        rest = ok[~(seen | hidden)]
+        if len(rest):
+            out[rest] = np.abs(self.raycast.nearest(view, dirs[rest]) - dist[rest]) < METER
+        return out
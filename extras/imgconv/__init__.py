@@ -0,0 +1,4 @@
+# imgconv - helpers shared by the image conversion programs in extras
+#   (shortcut_pds_to_png.py, pds_to_jpgs_parallel.py, and the FITS converters
+#   under preprocessing/). Scripts outside the extras folder add extras to
+#   sys.path before importing this package.
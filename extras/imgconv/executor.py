@@ -0,0 +1,144 @@
+# executor.py - ways to run a two-stage (read -> encode) conversion over many files.
+#
+# The converters do two kinds of work per file: read/decode the source frame
+# (mostly I/O), then stretch and JPEG-encode it (NumPy + Pillow, which release
+# the GIL for most of their work). Three modes are offered:
+#
+#   process  one file per task in a ProcessPoolExecutor (the original behavior)
+#   thread   one process; I/O threads read frames into a bounded queue and
+#            encode threads drain it, so imports (astropy) happen once and no
+#            frames are pickled
+#   hybrid   a few processes, each running the threaded pipeline over a batch
+#            of files (for when the GIL-held parts become the bottleneck)
+#
+# read(task) -> item and encode(item) -> result must be module-level functions
+# (so the process modes can pickle them), and should catch their own errors and
+# return them as results, like the converters' process_one() does.
+
+import os
+import queue
+import threading
+import concurrent.futures
+
+MODES = ("process", "thread", "hybrid")
+
+_DONE = object()
+
+
+class _Failure:
+    def __init__(self, exc):
+        self.exc = exc
+
+
+def default_threads():
+    return max(2, min(8, os.cpu_count() or 4))
+
+
+def run_tasks(tasks, read, encode, mode="process", workers=4, threads=None,
+              io_threads=2, queue_size=None, batch_size=64):
+    """
+    Yield encode(read(task)) for every task. In 'process' mode results come in
+    task order; in the threaded modes they come in completion order.
+
+    workers     processes (process and hybrid modes)
+    threads     encode threads per process (thread and hybrid modes)
+    io_threads  read threads per process (thread and hybrid modes)
+    queue_size  decoded frames allowed to wait for an encoder (default 2*threads)
+    batch_size  tasks handed to a process at a time (hybrid mode)
+    """
+    if mode not in MODES:
+        raise ValueError(f"unknown mode {mode!r}, expected one of {', '.join(MODES)}")
+    threads = threads or default_threads()
+    queue_size = queue_size or 2 * threads
+
+    if mode == "process":
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as ex:
+            yield from ex.map(_read_encode, [(read, encode, t) for t in tasks], chunksize=1)
+
+    elif mode == "thread":
+        yield from threaded_pipeline(tasks, read, encode, threads, io_threads, queue_size)
+
+    else:
+        tasks = list(tasks)
+        batches = [(read, encode, tasks[i:i + batch_size], threads, io_threads, queue_size)
+                   for i in range(0, len(tasks), batch_size)]
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as ex:
+            for results in ex.map(_run_batch, batches, chunksize=1):
+                yield from results
+
+
+def threaded_pipeline(tasks, read, encode, threads, io_threads=2, queue_size=None):
+    """
+    Run read() on io_threads threads and encode() on threads threads, with at
+    most queue_size decoded items buffered in between. Yields results as they finish.
+    """
+    tasks = iter(tasks)
+    task_lock = threading.Lock()
+    frames = queue.Queue(maxsize=queue_size or 2 * threads)
+    results = queue.Queue()
+    readers_left = [io_threads]
+
+    def reader():
+        try:
+            while True:
+                with task_lock:
+                    task = next(tasks, _DONE)
+                if task is _DONE:
+                    break
+                frames.put(read(task))
+        except BaseException as e:
+            results.put(_Failure(e))
+        finally:
+            with task_lock:
+                readers_left[0] -= 1
+                last = readers_left[0] == 0
+            if last:
+                for _ in range(threads):
+                    frames.put(_DONE)
+
+    def encoder():
+        try:
+            while True:
+                item = frames.get()
+                if item is _DONE:
+                    break
+                results.put(encode(item))
+        except BaseException as e:
+            results.put(_Failure(e))
+        finally:
+            results.put(_DONE)
+
+    workers = [threading.Thread(target=reader, daemon=True) for _ in range(io_threads)]
+    workers += [threading.Thread(target=encoder, daemon=True) for _ in range(threads)]
+    for w in workers:
+        w.start()
+
+    encoders_left = threads
+    while encoders_left:
+        r = results.get()
+        if r is _DONE:
+            encoders_left -= 1
+        elif isinstance(r, _Failure):
+            raise r.exc
+        else:
+            yield r
+
+
+def mode_from_env(prefix):
+    """(mode, threads, io_threads) from <prefix>_MODE, <prefix>_THREADS, <prefix>_IO_THREADS."""
+    mode = os.environ.get(f"{prefix}_MODE", "process").lower()
+    if mode not in MODES:
+        raise SystemExit(f"{prefix}_MODE must be one of {', '.join(MODES)}, not {mode!r}")
+    threads = int(os.environ.get(f"{prefix}_THREADS", default_threads()))
+    io_threads = int(os.environ.get(f"{prefix}_IO_THREADS", "2"))
+    return mode, threads, io_threads
+
+
+def _read_encode(args):
+    read, encode, task = args
+    return encode(read(task))
+
+
+def _run_batch(args):
+    read, encode, tasks, threads, io_threads, queue_size = args
+    return list(threaded_pipeline(tasks, read, encode, threads, io_threads, queue_size))
@@ -0,0 +1,209 @@
+# raster_cache.py - optional on-disk cache of decoded, masked rasters.
+#
+# Decoding the archive (PDS3 parsing, FITS reads, or an ISIS run for NAC/WAC)
+# is by far the slowest part of making JPGs. The cache stores the decoded
+# frame once, so that sweeps over STRETCH_LOW/STRETCH_HIGH, JPG_QUALITY, or the
+# percentile cutoffs re-encode straight from a memory-mapped array.
+#
+# Layout under the cache root:
+#   <kk>/<key>.npy       raster, uint16 when integer data fits, else the source dtype
+#   <kk>/<key>.mask.npy  optional packed-bit mask of invalid pixels (1 = invalid)
+#   <kk>/<key>.json      shape, storage and source dtypes, offset, tag and decoder info
+#   stat/<hash>          maps (path, size, mtime) -> key, so unchanged files are not rehashed
+#
+# The key is a BLAKE2b hash of the source file contents plus a decoder tag, so
+# a changed file or a changed decoder never reuses a stale entry.
+#
+# Storage is lossless, so a cached run writes the same JPGs and stats as an
+# uncached one: integer data whose range fits in 16 bits is stored as uint16
+# (with an offset for signed data), float64 data that float32 holds exactly is
+# stored as float32, and anything else in its own dtype. Masked pixels, NaN and
+# inf keep their values; values() returns the frame in the decoder's dtype.
+#
+# Enable it in the converters by setting RASTER_CACHE=/path/to/cache.
+
+import os
+import json
+import hashlib
+import tempfile
+
+import numpy as np
+
+CACHE_VERSION = 2
+_HASH_CHUNK = 1 << 20
+
+
+class CachedRaster:
+    """A cache entry: raw stored array (memory-mapped), invalid mask, and header."""
+
+    def __init__(self, data, mask, header):
+        self.data = data        # np.memmap in the storage dtype
+        self.mask = mask        # bool array (True = invalid) or None
+        self.header = header
+
+    @property
+    def info(self):
+        return self.header.get("info", {})
+
+    def values(self, fill=None):
+        """Return the frame exactly as decoded (in the decoder's dtype), with invalid pixels set to fill if given."""
+        dtype = np.dtype(self.header["source_dtype"])
+        offset = self.header["offset"]
+        if offset != 0:
+            vals = (self.data.astype(np.int64) + offset).astype(dtype)
+        else:
+            vals = self.data.astype(dtype)
+        if fill is not None and self.mask is not None:
+            vals[self.mask] = fill
+        return vals
+
+
+class RasterCache:
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+        os.makedirs(os.path.join(self.root, "stat"), exist_ok=True)
+
+    # ---- keys -------------------------------------------------------------
+
+    def key_for(self, src_paths, tag):
+        """Content key for one or more source files (e.g. a .LBL and its .IMG)."""
+        if isinstance(src_paths, (str, os.PathLike)):
+            src_paths = [src_paths]
+        src_paths = [os.path.abspath(p) for p in src_paths]
+
+        stat_id = hashlib.blake2b(digest_size=16)
+        stat_id.update(f"{CACHE_VERSION}|{tag}".encode())
+        for p in src_paths:
+            st = os.stat(p)
+            stat_id.update(f"|{p}|{st.st_size}|{st.st_mtime_ns}".encode())
+        stat_file = os.path.join(self.root, "stat", stat_id.hexdigest())
+        try:
+            with open(stat_file, "r") as f:
+                return f.read().strip()
+        except OSError:
+            pass
+
+        h = hashlib.blake2b(digest_size=16)
+        h.update(f"{CACHE_VERSION}|{tag}".encode())
+        for p in src_paths:
+            with open(p, "rb") as f:
+                while True:
+                    chunk = f.read(_HASH_CHUNK)
+                    if not chunk:
+                        break
+                    h.update(chunk)
+        key = h.hexdigest()
+        _atomic_write(stat_file, key.encode())
+        return key
+
+    def _paths(self, key):
+        base = os.path.join(self.root, key[:2], key)
+        return base + ".npy", base + ".mask.npy", base + ".json"
+
+    # ---- read / write -----------------------------------------------------
+
+    def get(self, key):
+        """Return a CachedRaster for key, or None on a miss."""
+        data_path, mask_path, header_path = self._paths(key)
+        try:
+            with open(header_path, "r") as f:
+                header = json.load(f)
+        except OSError:
+            return None
+        data = np.load(data_path, mmap_mode="r")
+        mask = None
+        if header.get("has_mask"):
+            packed = np.load(mask_path, mmap_mode="r")
+            mask = np.unpackbits(packed, axis=-1, count=data.shape[-1]).astype(bool)
+        return CachedRaster(data, mask, header)
+
+    def put(self, key, values, mask=None, tag="", info=None):
+        """Store a decoded frame. mask is True where pixels are invalid."""
+        values = np.asarray(values)
+        if mask is not None and not mask.any():
+            mask = None
+        data, offset = _encode(values)
+
+        data_path, mask_path, header_path = self._paths(key)
+        os.makedirs(os.path.dirname(data_path), exist_ok=True)
+        _atomic_save(data_path, data)
+        if mask is not None:
+            _atomic_save(mask_path, np.packbits(mask, axis=-1))
+        header = {
+            "version": CACHE_VERSION,
+            "tag": tag,
+            "shape": list(values.shape),
+            "dtype": str(data.dtype),
+            "source_dtype": str(values.dtype),
+            "offset": offset,
+            "has_mask": mask is not None,
+            "info": info or {},
+        }
+        # header goes last: its presence marks a complete entry
+        _atomic_write(header_path, json.dumps(header).encode())
+        entry = self.get(key)
+        check = entry.values()
+        if check.dtype != values.dtype or not np.array_equal(check, values, equal_nan=check.dtype.kind in "fc"):
+            os.remove(header_path)
+            raise RuntimeError(f"raster cache entry {key} does not reproduce the decoded frame")
+        return entry
+
+    def fetch(self, src_paths, tag, decode):
+        """
+        Return the cached frame for src_paths, decoding and storing it on a miss.
+        decode() must return (values, mask, info), where mask may be None.
+        """
+        key = self.key_for(src_paths, tag)
+        hit = self.get(key)
+        if hit is not None:
+            return hit
+        values, mask, info = decode()
+        return self.put(key, values, mask, tag=tag, info=info)
+
+
+def cache_from_env(var="RASTER_CACHE"):
+    """RasterCache at $RASTER_CACHE, or None if caching is not enabled."""
+    root = os.environ.get(var)
+    return RasterCache(root) if root else None
+
+
+# ---- encoding -------------------------------------------------------------
+
+def _encode(values):
+    """Pick the smallest storage form that reproduces values exactly. Returns (data, offset)."""
+    if np.issubdtype(values.dtype, np.integer) or np.issubdtype(values.dtype, np.bool_):
+        lo = int(values.min()) if values.size else 0
+        hi = int(values.max()) if values.size else 0
+        if hi - lo <= 0xFFFF:
+            offset = lo if lo < 0 or hi > 0xFFFF else 0
+            return (values.astype(np.int64) - offset).astype(np.uint16), offset
+    elif values.dtype == np.float64:
+        with np.errstate(over="ignore"):
+            narrow = values.astype(np.float32)
+        if np.array_equal(narrow.astype(np.float64), values, equal_nan=True):
+            return narrow, 0
+    return values, 0
+
+
+def _atomic_write(path, payload):
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(payload)
+        os.replace(tmp, path)
+    except BaseException:
+        try: os.remove(tmp)
+        except OSError: pass
+        raise
+
+
+def _atomic_save(path, arr):
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-", suffix=".npy")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            np.save(f, np.ascontiguousarray(arr))
+        os.replace(tmp, path)
+    except BaseException:
+        try: os.remove(tmp)
+        except OSError: pass
+        raise
@@ -0,0 +1,231 @@
+# stats.py - per-image quality statistics computed while converting, written
+#   as one small columnar file per instrument.
+#
+# The converters already hold the decoded frame, its invalid-pixel mask and
+# its stretch percentiles; frame_stats() turns those into a compact record,
+# and StatsWriter collects the records and saves them as a .npz with one
+# array per column. QA reports and curation can then scan that file instead
+# of re-reading the raw archive (see testing/evaluate_used_img_quality.py).
+#
+# Stats are pluggable: @register_stat adds a column computed from the frame
+# context. Label quality flags are carried as strings (empty if absent).
+# Converters that never see the data values (the ISIS path, which only gets
+# ISIS's stretched 8-bit output) write label_stats() records instead: the
+# flags, with the pixel columns missing (NaN).
+#
+# Saving merges into an existing file by 'nm', the new records winning, so a
+# partial or repeated conversion keeps the records of the images it skipped.
+
+import os
+import re
+
+import numpy as np
+
+# Label keywords carried into the stats file when present
+LABEL_FLAG_KEYS = ("DATA_QUALITY_ID", "SHUTTER_FOUND_IN_ERROR", "TESTMODE_FLAG")
+
+BLANK_VALID_FRAC = 0.05     # frames with less valid area than this are "blank"
+BLANK_REL_STD = 1e-6        # ... as are frames with (almost) no signal variation
+
+_STATS = []                 # [(name, dtype, func(ctx))]
+
+
+def register_stat(name, dtype="f4"):
+    """Decorator: add a stats column computed by func(ctx) -> value."""
+    def deco(func):
+        _STATS.append((name, dtype, func))
+        return func
+    return deco
+
+
+class FrameContext:
+    """What a stat function may look at: the frame, its valid pixels, and extras."""
+
+    def __init__(self, values, mask, lo=None, hi=None, sat_frac=None, flags=None):
+        self.values = values
+        self.mask = mask if mask is not None else np.zeros(values.shape, dtype=bool)
+        self.valid = values[~self.mask]
+        self.lo, self.hi = lo, hi
+        self.sat_frac = sat_frac
+        self.flags = flags or {}
+        self._pct = None
+
+    def percentiles(self):
+        if self._pct is None:
+            if self.valid.size:
+                self._pct = np.percentile(self.valid, [1, 50, 99])
+            else:
+                self._pct = np.full(3, np.nan)
+        return self._pct
+
+
+# ---- built-in columns -------------------------------------------------------
+
+@register_stat("valid_frac")
+def _valid_frac(ctx):
+    return ctx.valid.size / max(ctx.values.size, 1)
+
+@register_stat("sat_frac")
+def _sat_frac(ctx):
+    if ctx.sat_frac is not None:
+        return ctx.sat_frac
+    # no saturation level known: fraction of valid pixels piled up at the maximum
+    if ctx.valid.size == 0:
+        return 0.0
+    vmax = ctx.valid.max()
+    return np.count_nonzero(ctx.valid == vmax) / ctx.valid.size
+
+@register_stat("mean")
+def _mean(ctx):
+    return ctx.valid.mean() if ctx.valid.size else np.nan
+
+@register_stat("std")
+def _std(ctx):
+    return ctx.valid.std() if ctx.valid.size else np.nan
+
+@register_stat("p01")
+def _p01(ctx):
+    return ctx.percentiles()[0]
+
+@register_stat("p50")
+def _p50(ctx):
+    return ctx.percentiles()[1]
+
+@register_stat("p99")
+def _p99(ctx):
+    return ctx.percentiles()[2]
+
+@register_stat("stretch_lo")
+def _stretch_lo(ctx):
+    return np.nan if ctx.lo is None else ctx.lo
+
+@register_stat("stretch_hi")
+def _stretch_hi(ctx):
+    return np.nan if ctx.hi is None else ctx.hi
+
+@register_stat("blank", "?")
+def _blank(ctx):
+    if _valid_frac(ctx) < BLANK_VALID_FRAC:
+        return True
+    std, mean = _std(ctx), _mean(ctx)
+    return bool(std <= BLANK_REL_STD * max(abs(mean), 1.0))
+
+@register_stat("smear")
+def _smear(ctx):
+    """Column-profile vs row-profile variation; >> 1 suggests vertical streaks (readout smear)."""
+    if ctx.values.ndim != 2 or ctx.valid.size == 0:
+        return np.nan
+    w = (~ctx.mask).astype(np.float32)
+    v = np.where(ctx.mask, 0.0, ctx.values).astype(np.float32)
+    col_n, row_n = w.sum(axis=0), w.sum(axis=1)
+    cols = v.sum(axis=0)[col_n > 0] / col_n[col_n > 0]
+    rows = v.sum(axis=1)[row_n > 0] / row_n[row_n > 0]
+    if cols.size < 2 or rows.size < 2:
+        return np.nan
+    return float(np.std(cols) / max(np.std(rows), 1e-12))
+
+for _key in LABEL_FLAG_KEYS:
+    register_stat(_key.lower(), "U32")(lambda ctx, _k=_key: ctx.flags.get(_k, ""))
+
+_FLAG_COLUMNS = {k.lower(): k for k in LABEL_FLAG_KEYS}
+
+
+def _missing(dtype):
+    """The value a column holds when it was not computed: NaN, False or ''."""
+    return {"f": np.nan, "b": False, "U": ""}.get(np.dtype(dtype).kind, 0)
+
+
+# ---- records and files ------------------------------------------------------
+
+def frame_stats(name, values, mask=None, lo=None, hi=None, sat_frac=None, flags=None):
+    """One stats record (a dict, 'nm' first) for a decoded frame."""
+    ctx = FrameContext(values, mask, lo, hi, sat_frac, flags)
+    rec = {"nm": name}
+    for col, _, func in _STATS:
+        rec[col] = func(ctx)
+    return rec
+
+
+def label_stats(name, flags=None):
+    """A record with only the label flags, for frames whose data values are not at hand."""
+    flags = flags or {}
+    rec = {"nm": name}
+    for col, dtype, _ in _STATS:
+        rec[col] = flags.get(_FLAG_COLUMNS[col], "") if col in _FLAG_COLUMNS else _missing(dtype)
+    return rec
+
+
+def read_label_text(path):
+    """The attached PDS3 label of an .IMG (LABEL_RECORDS * RECORD_BYTES bytes)."""
+    with open(path, "rb") as f:
+        head = f.read(131072)
+    text = head.decode("utf-8", errors="ignore")
+    lr = re.search(r"\bLABEL_RECORDS\s*=\s*(\d+)", text)
+    rb = re.search(r"\bRECORD_BYTES\s*=\s*(\d+)", text)
+    if lr and rb:
+        text = head[:int(lr.group(1)) * int(rb.group(1))].decode("utf-8", errors="ignore")
+    return text
+
+
+def label_flags_from_text(header):
+    """Pick LABEL_FLAG_KEYS out of raw PDS3 label text."""
+    flags = {}
+    for key in LABEL_FLAG_KEYS:
+        m = re.search(rf'(?m)^\s*{key}\s*=\s*"?([^"\r\n]*?)"?\s*$', header)
+        if m:
+            flags[key] = m.group(1).strip()
+    return flags
+
+
+def label_flags_from_pvl(meta):
+    """Pick LABEL_FLAG_KEYS out of a pvl label (top level or IMAGE object)."""
+    flags = {}
+    for key in LABEL_FLAG_KEYS:
+        for scope in (meta, meta.get("IMAGE", {})):
+            if key in scope:
+                flags[key] = str(scope[key]).strip('"')
+                break
+    return flags
+
+
+class StatsWriter:
+    """Collects stats records, and merges them into one columnar .npz file."""
+
+    def __init__(self, path):
+        self.path = path
+        self.records = []
+
+    def add(self, rec):
+        if rec is not None:
+            self.records.append(rec)
+
+    def save(self):
+        """Write the records, keeping those of an existing file for images not converted this time."""
+        if not self.records:
+            return None
+        merged = {}
+        if os.path.exists(self.path):
+            old = load_stats(self.path)
+            for i, nm in enumerate(old["nm"]):
+                merged[str(nm)] = {col: arr[i] for col, arr in old.items()}
+        merged.update((r["nm"], r) for r in self.records)
+        records = [merged[nm] for nm in sorted(merged)]
+        cols = {"nm": np.array([r["nm"] for r in records], dtype=str)}
+        for col, dtype, _ in _STATS:
+            cols[col] = np.array([r.get(col, _missing(dtype)) for r in records], dtype=dtype)
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        tmp = self.path + ".tmp.npz"
+        np.savez(tmp, **cols)
+        os.replace(tmp, self.path)
+        return self.path
+
+
+def load_stats(path):
+    """Load a stats file as {column: array}."""
+    with np.load(path) as z:
+        return {k: z[k] for k in z.files}
+
+
+def stats_enabled(var="IMAGE_STATS"):
+    """Stats are on unless IMAGE_STATS=0."""
+    return os.environ.get(var, "1").lower() not in ("0", "false", "no", "off")
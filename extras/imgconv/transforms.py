@@ -0,0 +1,59 @@
+# transforms.py - geometric transforms applied to a decoded frame just before
+#   it is encoded: overscan crop, left-right flop, and 90° rotations.
+#
+# All transforms return NumPy views of the input (slicing / np.rot90), so no
+# pixel data is copied until the single encode at the end. Dimensions come
+# from the array itself, which replaces the per-image ImageMagick 'identify'
+# probe that the overscan crop used to need.
+
+import os
+
+import numpy as np
+from PIL import Image
+
+# OSIRIS raw-with-overscan -> active science area (square frames only)
+CROP_MAP = {2304: 2048, 1152: 1024, 576: 512, 288: 256}
+
+
+def crop_overscan(arr, crop_map=CROP_MAP):
+    """Center-crop a square frame with overscan to its active area (view)."""
+    h, w = arr.shape[:2]
+    if h != w or w not in crop_map:
+        return arr
+    target = crop_map[w]
+    y0 = (h - target) // 2
+    x0 = (w - target) // 2
+    return arr[y0:y0 + target, x0:x0 + target]
+
+
+def flop(arr):
+    """Mirror left<->right, like ImageMagick -flop (view)."""
+    return arr[:, ::-1]
+
+
+def rotate90(arr, k=1):
+    """Rotate by k*90° counterclockwise (view)."""
+    return np.rot90(arr, k=k)
+
+
+def apply_transforms(arr, crop=False, flip=False, rot90=0):
+    """Crop, then flop, then rotate. Returns a view of arr."""
+    if crop:
+        arr = crop_overscan(arr)
+    if flip:
+        arr = flop(arr)
+    if rot90 % 4:
+        arr = rotate90(arr, rot90)
+    return arr
+
+
+def crop_from_env(var="CROP_OVERSCAN"):
+    """True if overscan cropping has been turned on (CROP_OVERSCAN=1)."""
+    return os.environ.get(var, "0").lower() in ("1", "true", "yes", "on")
+
+
+def encode_jpeg(img8, dst_file, quality=80, optimize=False):
+    """Write an 8-bit grayscale frame (any strides) as a JPEG. The only copy happens here."""
+    os.makedirs(os.path.dirname(dst_file) or ".", exist_ok=True)
+    im = Image.fromarray(np.ascontiguousarray(img8, dtype=np.uint8), mode="L")
+    im.save(dst_file, quality=quality, optimize=optimize)
@@ -4,9 +4,23 @@
 # Usage: python pds_to_jpgs.py <WAC|NAC> <fromDir> <toDir>
 
 # Works for WAC, NAC images, but not NAVCAM (see quick_pds_to_jpgs_parallel.py)
+#
+# Environment variables:
+#   PDS2JPGS_WORKERS - number of parallel workers (default: CPUs-2, clamped 1..6)
+#   JPG_QUALITY      - JPEG quality (default: 80)
+#   CROP_OVERSCAN    - 1 to crop overscan frames to their active area (default: off)
+#   RASTER_CACHE     - optional decoded-raster cache directory (see imgconv/raster_cache.py)
+#   IMAGE_STATS      - 0 to skip writing <toDir>/imageStats_<CAMERA>.npz (see imgconv/stats.py)
 
 import os, sys, subprocess, tempfile, concurrent.futures
 
+import numpy as np
+from PIL import Image
+
+from imgconv.raster_cache import cache_from_env
+from imgconv.stats import StatsWriter, label_flags_from_text, label_stats, read_label_text, stats_enabled
+from imgconv.transforms import apply_transforms, crop_from_env, encode_jpeg
+
 # ---- CLI ---------------------------------------------------------------
 if len(sys.argv) != 4 or sys.argv[1].upper() not in ("NAC", "WAC"):
     print("Usage: pds_to_jpgs_parallel.py <WAC|NAC> <fromDir> <toDir>")
@@ -32,6 +46,22 @@ MK_TM          = "/home/djk/anaconda3/envs/asp/data/rosetta_updated/kernels/mk/R
 DSK_SHAPE      = "/home/djk/anaconda3/envs/asp/data/rosetta_updated/kernels/dsk/ROS_CG_M004_OSPGDLR_N_V1.BDS"
 CK_FILE        = "/home/djk/anaconda3/envs/asp/data/rosetta_updated/kernels/ck/ROS_SC_MES_160101_160930_V03.bc"
 
+# ---- Optional decoded-raster cache -------------------------------------
+# With RASTER_CACHE=/path/to/cache, the isis2std raster for each .IMG is kept,
+# and later runs (e.g. a new JPG_QUALITY) skip rososiris2isis/spiceinit/isis2std.
+RASTER_CACHE = cache_from_env()
+DECODER_TAG  = f"isis2std-png-{CAMERA}-v1"
+JPG_QUALITY  = int(os.environ.get("JPG_QUALITY", "80"))
+
+# Overscan crop (2304->2048, 1152->1024, 576->512, 288->256), off by default so
+# output keeps matching the 'rz' values in existing metadata. CROP_OVERSCAN=1 enables it.
+CROP_OVERSCAN = crop_from_env()
+
+# Per-image quality stats. Only the quality flags from the .IMG label are
+# recorded: the converter sees ISIS's stretched 8-bit output, not the DN values,
+# so the pixel columns (valid/saturated fraction, percentiles, ...) are NaN.
+IMAGE_STATS = stats_enabled()
+
 def _exists_or_alias(p: str) -> bool:
     return p.startswith("$") or os.path.exists(p)
 
@@ -58,11 +88,30 @@ def parse_date_int(filename: str):
     except Exception:
         return None
 
+def read_png(png_file):
+    """Decode the isis2std PNG into an 8-bit grayscale array."""
+    with Image.open(png_file) as im:
+        return np.asarray(im.convert("L"))
+
+def write_jpg(img8, jpg_file):
+    """Crop overscan (if CROP_OVERSCAN), flop for WAC, and encode once with Pillow."""
+    h, w = img8.shape
+    img8 = apply_transforms(img8, crop=CROP_OVERSCAN, flip=(CAMERA == "WAC"))
+    if img8.shape != (h, w):
+        print(f"Cropping {os.path.basename(jpg_file)} from {w} to {img8.shape[1]}", flush=True)
+    encode_jpeg(img8, jpg_file, quality=JPG_QUALITY)
+
+def image_stats(base, src_file):
+    """Stats record (label flags only) for the converted frame, or None if IMAGE_STATS is off."""
+    if not IMAGE_STATS:
+        return None
+    return label_stats(base, label_flags_from_text(read_label_text(src_file)))
+
 def process_one(task):
-    """One .IMG → .JPG conversion; returns (ok:bool, message:str)."""
+    """One .IMG → .JPG conversion; returns (ok:bool, message:str, stats record or None)."""
     root, file = task
     if not file.endswith(".IMG"):
-        return (False, f"skip (not .IMG): {file}")
+        return (False, f"skip (not .IMG): {file}", None)
 
     src_file = os.path.join(root, file)
     out_root = mirror_root(root)
@@ -71,6 +120,15 @@ def process_one(task):
     base     = os.path.splitext(file)[0]
     jpg_file = os.path.join(out_root, base + ".jpg")
 
+    cache_key = None
+    if RASTER_CACHE is not None:
+        cache_key = RASTER_CACHE.key_for(src_file, DECODER_TAG)
+        entry = RASTER_CACHE.get(cache_key)
+        if entry is not None:
+            img8 = np.clip(entry.values(), 0, 255).astype(np.uint8)
+            write_jpg(img8, jpg_file)
+            return (True, jpg_file + " (from cache)", image_stats(base, src_file))
+
     # --- unique temp files per task (critical for parallel safety)
     tmpdir = tempfile.gettempdir()
     cub_tmp = tempfile.NamedTemporaryFile(delete=False, suffix=".cub"); cub_file = cub_tmp.name; cub_tmp.close()
@@ -81,7 +139,7 @@ def process_one(task):
         print(f"rososiris2isis from={src_file} to={cub_file}", flush=True)
         r = subprocess.run(['rososiris2isis', f'from={src_file}', f'to={cub_file}'], cwd=tmpdir)
         if r.returncode != 0:
-            return (False, f"rososiris2isis failed on {src_file}")
+            return (False, f"rososiris2isis failed on {src_file}", None)
 
         # Log the date for debugging parity with your serial output
         di = parse_date_int(file)
@@ -112,43 +170,21 @@ def process_one(task):
             # keep behavior: print label to help diagnose, then skip
             print(f"spiceinit failed on {cub_file}", file=sys.stderr)
             subprocess.run(["catlab", f"from={cub_file}", "to=stdout"])
-            return (False, f"spiceinit failed on {cub_file}")
+            return (False, f"spiceinit failed on {cub_file}", None)
 
         # .cub -> .png
         r = subprocess.run(['isis2std', f'from={cub_file}', f'to={png_file}', 'format=png'], cwd=tmpdir)
         if r.returncode != 0:
-            return (False, f"isis2std failed on {png_file}")
-
-        # .png -> .jpg
-        # Tricky - need to crop images with overscan (problem with WAC for now)
-# Map raw-with-overscan -> active science area
-        # 2304->2048, 1152->1024, 576->512, 288->256
-        # crop_map = {2304: 2048, 1152: 1024, 576: 512, 288: 256}
-
-        # # Query PNG dimensions using ImageMagick 'identify'
-        # try:
-        #     dim = subprocess.check_output(['identify', '-format', '%w %h', png_file], cwd=tmpdir)
-        #     w, h = map(int, dim.decode().strip().split())
-        # except Exception:
-        #     w = h = 0  # fall back to no-crop if identify is unavailable
-
-        crop_args = []
-        # if w == h and w in crop_map:
-        #     target = crop_map[w]
-        #     crop_args = ['-gravity', 'center', '-crop', f'{target}x{target}+0+0', '+repage']
-
-        # if crop_args:
-        #     print(f"Cropping {file} from {w} to {target}", flush=True)
-
-        flip_args = []
-        if CAMERA == "WAC":
-            flip_args = ['-flop']
-
-        r = subprocess.run(['convert', png_file, *crop_args, *flip_args, '-quality', '80', '-format', 'jpg', jpg_file])
-        if r.returncode != 0:
-            return (False, f"convert failed on {jpg_file}")
+            return (False, f"isis2std failed on {png_file}", None)
+
+        # .png -> .jpg: crop/flop are array views, so the dimensions come from the
+        # decoded PNG (no 'identify' probe) and there is a single encode.
+        img8 = read_png(png_file)
+        if cache_key is not None:
+            RASTER_CACHE.put(cache_key, img8, tag=DECODER_TAG)
+        write_jpg(img8, jpg_file)
 
-        return (True, jpg_file)
+        return (True, jpg_file, image_stats(base, src_file))
 
     finally:
         for p in (png_file, cub_file):
@@ -183,9 +219,11 @@ def main():
     print(f"Workers: {workers} | Tasks: {len(tasks)}", flush=True)
 
     done = 0
+    stats = StatsWriter(os.path.join(toDir, f"imageStats_{CAMERA}.npz"))
     try:
         with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as ex:
-            for ok, msg in ex.map(process_one, tasks, chunksize=1):
+            for ok, msg, rec in ex.map(process_one, tasks, chunksize=1):
+                stats.add(rec)
                 if ok:
                     done += 1
                     print(f"Finished {done}: {msg}", flush=True)
@@ -194,6 +232,8 @@ def main():
     except KeyboardInterrupt:
         print("\nInterrupted by user. Partial results kept.", flush=True)
 
+    if stats.save():
+        print(f"Wrote image stats for {len(stats.records)} images to {stats.path}", flush=True)
     print(f"All done. Successful JPGs: {done}/{len(tasks)}", flush=True)
 
 if __name__ == "__main__":
@@ -15,15 +15,25 @@
 #     FITS2JPGS_WORKERS   – number of worker processes (default: CPUs−2, max 6)
 #     JPG_QUALITY         – JPEG quality (default: 80)
 #     STRETCH_LOW/HIGH    – percentile stretch (default: 0.1 / 99.9)
+#     RASTER_CACHE        – optional decoded-raster cache directory; when set,
+#                           later runs re-encode from the cache instead of the FITS
+#     IMAGE_STATS         – 0 to skip writing <toDir>/imageStats.npz
+#     FITS2JPGS_MODE      – process (default), thread, or hybrid (see extras/imgconv/executor.py)
+#     FITS2JPGS_THREADS   – encode threads per process in thread/hybrid mode (default: CPUs, 2..8)
+#     FITS2JPGS_IO_THREADS – read threads per process in thread/hybrid mode (default: 2)
 #
 
 import os
 import sys
-import concurrent.futures
 
 import numpy as np
 from astropy.io import fits
-from PIL import Image
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+from imgconv.executor import mode_from_env, run_tasks
+from imgconv.raster_cache import cache_from_env
+from imgconv.stats import StatsWriter, frame_stats, stats_enabled
+from imgconv.transforms import apply_transforms, encode_jpeg
 
 # ---- CLI ---------------------------------------------------------------
 
@@ -45,10 +55,19 @@ def _workers_default():
 
 WORKERS = int(os.environ.get("FITS2JPGS_WORKERS", _workers_default()))
 JPG_QUALITY = int(os.environ.get("JPG_QUALITY", "80"))
+MODE, THREADS, IO_THREADS = mode_from_env("FITS2JPGS")
 
 STRETCH_LOW = float(os.environ.get("STRETCH_LOW", "0.1"))
 STRETCH_HIGH = float(os.environ.get("STRETCH_HIGH", "99.9"))
 
+# Optional decoded-raster cache (see extras/imgconv/raster_cache.py). When set,
+# re-runs with new STRETCH_*/JPG_QUALITY values skip reading the FITS files.
+RASTER_CACHE = cache_from_env()
+DECODER_TAG = "fits-hdu1-v1"   # bump when read_fits_frame changes
+
+# Per-image quality stats, collected into <toDir>/imageStats.npz
+IMAGE_STATS = stats_enabled()
+
 # Accept both .fits and .fit (case-insensitive)
 NEEDED_EXTS = (".fits", ".fit")
 
@@ -64,21 +83,16 @@ def is_fits(fname):
     lower = fname.lower()
     return any(lower.endswith(ext) for ext in NEEDED_EXTS)
 
-def fits_to_jpeg(src_file, dst_file):
+def read_fits_frame(src_file):
     """
-    Read a FITS file with Astropy, extract image data from HDU 1 if available
-    (e.g., ONC-LEVEL2c), otherwise HDU 0. Scale via percentiles and write a
-    grayscale JPEG using Pillow.
-
-    This Hyb2 variant **rotates the image counterclockwise by 90°** so the
-    resulting JPGs match the instrument orientation assumed by SPICE.
+    Read the 2D image from a FITS file: HDU 1 if available (e.g., ONC-LEVEL2c),
+    otherwise HDU 0. Returns (data, invalid_mask, info) as float32 with NaNs
+    zeroed, which is the form the raster cache stores.
     """
     with fits.open(src_file, memmap=True) as hdul:
         # Prefer HDU 1 if it has image data (typical for ONC L2c)
-        if len(hdul) > 1 and getattr(hdul[1], "data", None) is not None:
-            data = hdul[1].data
-        else:
-            data = hdul[0].data
+        hdu = 1 if len(hdul) > 1 and getattr(hdul[1], "data", None) is not None else 0
+        data = hdul[hdu].data
 
         if data is None:
             raise RuntimeError("No image data found in FITS HDUs")
@@ -91,43 +105,90 @@ def fits_to_jpeg(src_file, dst_file):
             raise RuntimeError("Unexpected data ndim=%d" % data.ndim)
 
         data = data.astype("float32")
+        invalid = ~np.isfinite(data)
         data = np.nan_to_num(data, nan=0.0)
+        return data, invalid, {"hdu": hdu}
 
-        # Percentile-based scaling
-        lo, hi = np.percentile(data, [STRETCH_LOW, STRETCH_HIGH])
-        if (not np.isfinite(lo)) or (not np.isfinite(hi)) or hi <= lo:
-            lo, hi = float(np.min(data)), float(np.max(data))
 
-        if hi == lo:
-            # Completely flat image -> mid-gray
-            img = np.full_like(data, 0.5, dtype="float32")
-        else:
-            img = (np.clip(data, lo, hi) - lo) / (hi - lo)
+def fits_to_jpeg(src_file, dst_file):
+    """
+    Read a FITS file with Astropy, extract image data from HDU 1 if available
+    (e.g., ONC-LEVEL2c), otherwise HDU 0. Scale via percentiles and write a
+    grayscale JPEG using Pillow. Returns the image's stats record (or None).
 
-        img8 = (img * 255.0).astype("uint8")
+    This Hyb2 variant **rotates the image counterclockwise by 90°** so the
+    resulting JPGs match the instrument orientation assumed by SPICE.
+    """
+    data, invalid = load_frame(src_file)
+    return encode_frame(data, invalid, dst_file)
 
 
-        # ADD: 90° COUNTERCLOCKWISE ROTATION FOR HYB2 to MATCH SPICE ----
-        img8 = np.rot90(img8, k=1)   # k=1 => 90 degrees counterclockwise
-        # -------------------------------
+def load_frame(src_file):
+    """The frame and its invalid mask, from the raster cache when enabled."""
+    if RASTER_CACHE is not None:
+        entry = RASTER_CACHE.fetch(src_file, DECODER_TAG, lambda: read_fits_frame(src_file))
+        return entry.values(), entry.mask
+    data, invalid, _ = read_fits_frame(src_file)
+    return data, invalid
 
-        im = Image.fromarray(img8, mode="L")
-        os.makedirs(os.path.dirname(dst_file), exist_ok=True)
-        im.save(dst_file, quality=JPG_QUALITY, optimize=True)
 
+def encode_frame(data, invalid, dst_file):
+    """Percentile-stretch a frame and write it as a JPEG. Returns its stats record (or None)."""
+    # Percentile-based scaling
+    lo, hi = np.percentile(data, [STRETCH_LOW, STRETCH_HIGH])
+    if (not np.isfinite(lo)) or (not np.isfinite(hi)) or hi <= lo:
+        lo, hi = float(np.min(data)), float(np.max(data))
 
-def process_one(task):
+    if hi == lo:
+        # Completely flat image -> mid-gray
+        img = np.full_like(data, 0.5, dtype="float32")
+    else:
+        img = (np.clip(data, lo, hi) - lo) / (hi - lo)
+
+    img8 = (img * 255.0).astype("uint8")
+
+    # 90° COUNTERCLOCKWISE ROTATION FOR HYB2 to MATCH SPICE (a view; copied once at encode)
+    img8 = apply_transforms(img8, rot90=1)
+
+    encode_jpeg(img8, dst_file, quality=JPG_QUALITY, optimize=True)
+
+    if IMAGE_STATS:
+        name = os.path.splitext(os.path.basename(dst_file))[0]
+        return frame_stats(name, data, invalid, lo, hi)
+    return None
+
+
+def read_task(task):
+    """Read stage: (task, data, invalid, error message or None)."""
     root, file = task
     src_file = os.path.join(root, file)
-    out_root = mirror_root(root)
-    base, _ = os.path.splitext(file)
-    jpg_file = os.path.join(out_root, base + ".jpg")
+    try:
+        data, invalid = load_frame(src_file)
+        return (task, data, invalid, None)
+    except Exception as e:
+        return (task, None, None, f"{src_file} -> {e}")
+
 
+def encode_task(item):
+    """Encode stage: returns (ok: bool, message: str, stats record or None)."""
+    (root, file), data, invalid, err = item
+    if err is not None:
+        return (False, err, None)
+    base, _ = os.path.splitext(file)
+    jpg_file = os.path.join(mirror_root(root), base + ".jpg")
     try:
-        fits_to_jpeg(src_file, jpg_file)
-        return (True, jpg_file)
+        rec = encode_frame(data, invalid, jpg_file)
+        return (True, jpg_file, rec)
     except Exception as e:
-        return (False, f"{src_file} -> {e}")
+        return (False, f"{os.path.join(root, file)} -> {e}", None)
+
+
+def process_one(task):
+    """
+    Convert one FITS file -> JPG using Astropy + Pillow.
+    Returns (ok: bool, message: str, stats record or None).
+    """
+    return encode_task(read_task(task))
 
 
 # ---- Main --------------------------------------------------------------
@@ -146,23 +207,28 @@ def main():
 
     total = len(tasks)
     print(
-        f"FITS->JPG Hyabusa2 (Astropy/Pillow) | Workers={WORKERS} | Tasks={total} | "
+        f"FITS->JPG Hyabusa2 (Astropy/Pillow) | Mode={MODE} | Workers={WORKERS} | Tasks={total} | "
         f"JPG_QUALITY={JPG_QUALITY} | STRETCH={STRETCH_LOW}–{STRETCH_HIGH}",
         flush=True,
     )
 
     done = 0
+    stats = StatsWriter(os.path.join(todir, "imageStats.npz"))
     try:
-        with concurrent.futures.ProcessPoolExecutor(max_workers=WORKERS) as ex:
-            for ok, msg in ex.map(process_one, tasks, chunksize=1):
-                if ok:
-                    done += 1
-                    print(f"[OK {done}/{total}] {msg}", flush=True)
-                else:
-                    print(f"[ERR] {msg}", flush=True)
+        results = run_tasks(tasks, read_task, encode_task, mode=MODE, workers=WORKERS,
+                            threads=THREADS, io_threads=IO_THREADS)
+        for ok, msg, rec in results:
+            stats.add(rec)
+            if ok:
+                done += 1
+                print(f"[OK {done}/{total}] {msg}", flush=True)
+            else:
+                print(f"[ERR] {msg}", flush=True)
     except KeyboardInterrupt:
         print("\nInterrupted by user. Partial results kept.", flush=True)
 
+    if stats.save():
+        print(f"Wrote image stats for {len(stats.records)} images to {stats.path}")
     print(f"All done. Successful JPGs: {done}/{total}")
 
 
@@ -9,9 +9,18 @@
 # This should work for all three Rosetta cameras, but is intended primarily
 # for NAVCAM, while other extractions (NAC and WAC) are better handled by
 # pds_to_jpgs_parallel.py which uses ISIS.
+#
+# Each file is decoded, stretched, flopped (WAC/NAVCAM) and encoded in-process
+# using shortcut_pds_to_png.py and imgconv/transforms.py: no temporary PNG and
+# no per-image converter or ImageMagick subprocesses.
 
 
-import os, sys, subprocess, tempfile, concurrent.futures
+import os, sys, pathlib, concurrent.futures
+
+from shortcut_pds_to_png import load_masked, stretch, stretch_range
+from imgconv.raster_cache import cache_from_env
+from imgconv.stats import StatsWriter, frame_stats, stats_enabled
+from imgconv.transforms import apply_transforms, crop_from_env, encode_jpeg
 
 # ---- CLI ---------------------------------------------------------------
 if len(sys.argv) != 4 or sys.argv[1].upper() not in ("NAVCAM", "NAC", "WAC"):
@@ -27,13 +36,13 @@ todir   = os.path.abspath(sys.argv[3])
 # - NAC/WAC typically use attached/level IMG -> .IMG
 NEEDED_EXT = ".LBL" if CAMERA == "NAVCAM" else ".IMG"
 
-# External tools we invoke (must be in PATH)
-PDS2PNG = "quick_pds_to_png.py"        #  PDS->PNG converter
-CONVERT = os.environ.get("IM_CONVERT", "convert")  # ImageMagick 'convert' (or set IM_CONVERT)
-
 # Optional env overrides
-TMPDIR      = os.environ.get("PDS_TMPDIR")          # where to put temp PNGs (e.g., /mnt/ssd/tmp)
-JPG_QUALITY = os.environ.get("JPG_QUALITY", "80")   # JPG quality (default 80)
+JPG_QUALITY   = int(os.environ.get("JPG_QUALITY", "80"))      # JPG quality (default 80)
+STRETCH_LOW   = float(os.environ.get("STRETCH_LOW", "0.5"))   # low percentile (default 0.5)
+STRETCH_HIGH  = float(os.environ.get("STRETCH_HIGH", "99.5")) # high percentile (default 99.5)
+CROP_OVERSCAN = crop_from_env()                               # CROP_OVERSCAN=1 crops overscan frames
+RASTER_CACHE  = cache_from_env()                              # RASTER_CACHE=dir caches decoded frames
+IMAGE_STATS   = stats_enabled()                               # IMAGE_STATS=0 skips imageStats_<CAMERA>.npz
 
 # ---- Helpers -----------------------------------------------------------
 def mirror_root(root: str) -> str:
@@ -49,10 +58,10 @@ def default_workers():
 
 def process_one(task):
     """
-    Convert one file -> JPG via:
-      quick_pds_to_png.y <in> <tmp.png>
-      convert <tmp.png> [-flop if WAC or NAVCAM] -quality <q> -format jpg <out.jpg>
-    Returns (ok: bool, message: str)
+    Convert one file -> JPG:
+      decode + mask (shortcut_pds_to_png) -> percentile stretch
+      -> [crop] -> [flop if WAC or NAVCAM] -> single JPEG encode
+    Returns (ok: bool, message: str, stats record or None)
     """
     root, file = task
     src_file = os.path.join(root, file)
@@ -62,35 +71,20 @@ def process_one(task):
     base, _ = os.path.splitext(file)
     jpg_file = os.path.join(out_root, base + ".jpg")
 
-    # Make unique temp PNG (in system temp or PDS_TMPDIR if set)
-    png_tmp = tempfile.NamedTemporaryFile(delete=False, suffix=".png", dir=TMPDIR)
-    png_file = png_tmp.name
-    png_tmp.close()
-
     try:
-        # 1) PDS -> PNG (handles .LBL vs attached .IMG automatically)
-        r = subprocess.run([PDS2PNG, src_file, png_file])
-        if r.returncode != 0 or not os.path.exists(png_file):
-            return (False, f"{PDS2PNG} failed: {src_file}")
-
-        # 2) PNG -> JPG (quality N; flop for WAC)
-        cmd = [CONVERT, png_file]
-        if CAMERA == "WAC" or CAMERA == "NAVCAM":
-            cmd += ["-flop"]  # mirror left↔right for WAC|NAVCAM
-        cmd += ["-quality", JPG_QUALITY, "-format", "jpg", jpg_file]
-        r = subprocess.run(cmd)
-        if r.returncode != 0 or not os.path.exists(jpg_file):
-            return (False, f"{CONVERT} failed: {jpg_file}")
-
-        return (True, jpg_file)
-
-    finally:
-        # Always try to clean temp
-        try:
-            if os.path.exists(png_file):
-                os.remove(png_file)
-        except OSError:
-            pass
+        # Label path: detached .LBL for NAVCAM, the .IMG itself for attached labels
+        arr, mask, info = load_masked(pathlib.Path(src_file), RASTER_CACHE)
+        lo, hi = stretch_range(arr, mask, p_lo=STRETCH_LOW, p_hi=STRETCH_HIGH)
+        img8 = stretch(arr, mask, lohi=(lo, hi))
+        # mirror left↔right for WAC|NAVCAM
+        img8 = apply_transforms(img8, crop=CROP_OVERSCAN, flip=CAMERA in ("WAC", "NAVCAM"))
+        encode_jpeg(img8, jpg_file, quality=JPG_QUALITY)
+        rec = None
+        if IMAGE_STATS:
+            rec = frame_stats(base, arr, mask, lo, hi, info.get("sat_frac"), info.get("flags"))
+        return (True, jpg_file, rec)
+    except Exception as e:
+        return (False, f"{src_file} -> {e}", None)
 
 # ---- Main --------------------------------------------------------------
 def main():
@@ -108,12 +102,15 @@ def main():
 
     workers = int(os.environ.get("PDS2JPGS_WORKERS", default_workers()))
     print(f"Camera={CAMERA} | Looking for *{NEEDED_EXT} | Workers={workers} | Tasks={len(tasks)} | "
-          f"TMPDIR={TMPDIR or 'system temp'} | JPG_QUALITY={JPG_QUALITY}", flush=True)
+          f"JPG_QUALITY={JPG_QUALITY} | STRETCH={STRETCH_LOW}–{STRETCH_HIGH} | "
+          f"CROP_OVERSCAN={CROP_OVERSCAN} | RASTER_CACHE={RASTER_CACHE.root if RASTER_CACHE else 'off'}", flush=True)
 
     done = 0
+    stats = StatsWriter(os.path.join(todir, f"imageStats_{CAMERA}.npz"))
     try:
         with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as ex:
-            for ok, msg in ex.map(process_one, tasks, chunksize=1):
+            for ok, msg, rec in ex.map(process_one, tasks, chunksize=1):
+                stats.add(rec)
                 if ok:
                     done += 1
                     print(f"[OK {done}/{len(tasks)}] {msg}", flush=True)
@@ -122,6 +119,8 @@ def main():
     except KeyboardInterrupt:
         print("\nInterrupted by user. Partial results kept.", flush=True)
 
+    if stats.save():
+        print(f"Wrote image stats for {len(stats.records)} images to {stats.path}")
     print(f"All done. Successful JPGs: {done}/{len(tasks)}")
 
 if __name__ == "__main__":
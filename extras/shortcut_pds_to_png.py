@@ -10,17 +10,27 @@ pds3_navcam_to_png.py  —  robust NAVCAM PDS3 → PNG
     * respects optional label constants (MISSING_CONSTANT, NULL, VALID_MIN/MAX)
 - Percentile contrast stretch (default 0.5–99.5%)
 - Writes an 8-bit PNG
+- Optional decoded-raster cache (--cache DIR or $RASTER_CACHE): the masked frame
+  is stored once, so re-stretching with new --lo/--hi skips the PDS3 decode
 
 Usage:
-  python pds3_navcam_to_png.py <FILE.LBL|FILE.IMG> [out.png] [--lo 0.5] [--hi 99.5]
+  python pds3_navcam_to_png.py <FILE.LBL|FILE.IMG> [out.png] [--lo 0.5] [--hi 99.5] [--cache DIR]
 """
 
+import os
+import sys
 import argparse
 import pathlib
 import numpy as np
 from PIL import Image
 import pvl
 
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from imgconv.raster_cache import RasterCache
+from imgconv.stats import label_flags_from_pvl
+
+DECODER_TAG = "pds3-shortcut-v2"   # bump when decoding/masking changes, to invalidate cached rasters
+
 def _byte_offset(meta, img_obj):
     # Start with whole-label size if present
     offset = int(meta.get('RECORD_BYTES', 0)) * int(meta.get('LABEL_RECORDS', 0))
@@ -101,7 +111,8 @@ def read_pds3_array(lbl_path: pathlib.Path):
 
     return arr_best, meta, dtype_chosen, score_best
 
-def mask_and_stretch(arr, meta, p_lo=0.5, p_hi=99.5):
+def build_mask(arr, meta):
+    """Return (arr as float64 with non-finite values zeroed, invalid-pixel mask)."""
     # Clean NaN/Inf up-front for quiet math
     arr = np.where(np.isfinite(arr), arr, 0.0).astype(np.float64, copy=False)
 
@@ -128,7 +139,27 @@ def mask_and_stretch(arr, meta, p_lo=0.5, p_hi=99.5):
             vmax = float(img_obj['VALID_MAX']); mask |= (arr > vmax)
         except Exception:
             pass
+    return arr, mask
 
+def saturation_fraction(arr, meta):
+    """Fraction of pixels at the label's saturation level (HIGH_REPR_SATURATION / VALID_MAX)."""
+    img_obj = meta['IMAGE']
+    sat = np.zeros(arr.shape, dtype=bool)
+    for key in ('HIGH_REPR_SATURATION', 'HIGH_INSTR_SATURATION'):
+        if key in img_obj:
+            try:
+                sat |= (arr == float(img_obj[key]))
+            except Exception:
+                pass
+    if 'VALID_MAX' in img_obj:
+        try:
+            sat |= (arr > float(img_obj['VALID_MAX']))
+        except Exception:
+            pass
+    return float(sat.mean()) if sat.size else 0.0
+
+def stretch_range(arr, mask, p_lo=0.5, p_hi=99.5):
+    """Percentile (lo, hi) of the valid pixels, falling back to min/max."""
     valid = arr[~mask]
     if valid.size == 0:
         raise RuntimeError("No valid pixels after masking; check dtype or label interpretation.")
@@ -138,29 +169,64 @@ def mask_and_stretch(arr, meta, p_lo=0.5, p_hi=99.5):
         lo, hi = np.nanmin(valid), np.nanmax(valid)
         if not np.isfinite(lo) or not np.isfinite(hi) or hi <= lo:
             raise RuntimeError("Could not determine stretch range.")
+    return lo, hi
+
+def stretch(arr, mask, p_lo=0.5, p_hi=99.5, lohi=None):
+    """Percentile stretch of the valid pixels to uint8; invalid pixels become 0."""
+    lo, hi = lohi if lohi is not None else stretch_range(arr, mask, p_lo, p_hi)
 
     out = np.zeros_like(arr, dtype=np.float64)
     out[~mask] = (arr[~mask] - lo) * (255.0 / (hi - lo + 1e-9))
     out = np.clip(out, 0, 255).astype(np.uint8)
     return out
 
+def mask_and_stretch(arr, meta, p_lo=0.5, p_hi=99.5):
+    arr, mask = build_mask(arr, meta)
+    return stretch(arr, mask, p_lo, p_hi)
+
+def source_files(lbl_path: pathlib.Path):
+    """The files whose contents determine the decoded frame (label and data)."""
+    files = [lbl_path]
+    if lbl_path.suffix.upper() == '.LBL':
+        files.append(lbl_path.with_suffix('.IMG'))
+    return [str(p) for p in files]
+
+def decode_masked(lbl_path: pathlib.Path):
+    """Decode and mask one product. Returns (arr, mask, info) for the raster cache."""
+    arr, meta, chosen, health = read_pds3_array(lbl_path)
+    sat_frac = saturation_fraction(arr, meta)
+    arr, mask = build_mask(arr, meta)
+    return arr, mask, {'dtype': chosen, 'health': float(health), 'sat_frac': sat_frac,
+                       'flags': label_flags_from_pvl(meta)}
+
+def load_masked(lbl_path: pathlib.Path, cache=None):
+    """Like decode_masked, but served from the raster cache when one is given."""
+    if cache is None:
+        return decode_masked(lbl_path)
+    entry = cache.fetch(source_files(lbl_path), DECODER_TAG, lambda: decode_masked(lbl_path))
+    mask = entry.mask if entry.mask is not None else np.zeros(entry.data.shape, dtype=bool)
+    return entry.values(), mask, entry.info
+
 def main():
     ap = argparse.ArgumentParser(description="PDS3 NAVCAM → PNG with robust float handling")
     ap.add_argument("infile", help="Path to .LBL or .IMG")
     ap.add_argument("outfile", nargs='?', help="Output PNG (default: same name .png)")
     ap.add_argument("--lo", type=float, default=0.5, help="low percentile (default 0.5)")
     ap.add_argument("--hi", type=float, default=99.5, help="high percentile (default 99.5)")
+    ap.add_argument("--cache", default=os.environ.get("RASTER_CACHE"),
+                    help="decoded-raster cache directory (default: $RASTER_CACHE, off if unset)")
     args = ap.parse_args()
 
     in_path = pathlib.Path(args.infile)
     lbl_path = in_path if in_path.suffix.upper() == '.LBL' else in_path.with_suffix('.LBL')
     out_path = pathlib.Path(args.outfile) if args.outfile else lbl_path.with_suffix('.png')
 
-    arr, meta, chosen, health = read_pds3_array(lbl_path)
-    print(f"dtype chosen: {chosen} | health: {health:.3f} | shape: {arr.shape}")
-    print(f"raw min/max: {np.nanmin(arr)}, {np.nanmax(arr)}")
+    cache = RasterCache(args.cache) if args.cache else None
+    arr, mask, info = load_masked(lbl_path, cache)
+    print(f"dtype chosen: {info.get('dtype')} | health: {info.get('health', 0.0):.3f} | shape: {arr.shape}")
+    print(f"min/max: {np.min(arr)}, {np.max(arr)}")
 
-    arr8 = mask_and_stretch(arr, meta, p_lo=args.lo, p_hi=args.hi)
+    arr8 = stretch(arr, mask, p_lo=args.lo, p_hi=args.hi)
     Image.fromarray(arr8).save(out_path)
     print("wrote", out_path)
 
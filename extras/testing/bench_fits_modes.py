@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+bench_fits_modes.py
+
+Time the FITS->JPG converters in each FITS2JPGS_MODE (process, thread, hybrid)
+on synthetic FITS sets, e.g. 2k and 10k files:
+
+    python bench_fits_modes.py --counts 2000,10000 --size 1024
+
+Each set is written once under --workdir (HDU 1 float32 frames, like ONC L2c);
+only --unique distinct frames are generated and the rest are hard links, so
+the 10k set does not need 10k frames' worth of disk. The converter runs as a
+subprocess with its output discarded, so timings include its startup and the
+astropy import(s), which is part of what the modes differ in.
+"""
+
+import os
+import sys
+import time
+import shutil
+import argparse
+import subprocess
+
+import numpy as np
+from astropy.io import fits
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+CONVERTERS = {
+    "orex": os.path.join(HERE, "..", "preprocessing", "osiris-rex", "fits_to_jpgs_parallel2.py"),
+    "hyb2": os.path.join(HERE, "..", "preprocessing", "hyb2", "fits_to_jpgs_parallel_hyb2.py"),
+}
+MODES = ("process", "thread", "hybrid")
+
+
+def make_set(root, count, size, unique):
+    """Write count FITS files under root (in 100-file subfolders); reuse an existing set."""
+    marker = os.path.join(root, ".complete")
+    if os.path.exists(marker):
+        return
+    shutil.rmtree(root, ignore_errors=True)
+    rng = np.random.default_rng(0)
+    sources = []
+    for i in range(count):
+        sub = os.path.join(root, f"{i // 100:04d}")
+        os.makedirs(sub, exist_ok=True)
+        path = os.path.join(sub, f"frame{i:06d}.fits")
+        if i < unique:
+            yy, xx = np.mgrid[0:size, 0:size]
+            img = (1000 + 300 * np.sin(xx / 37.0 + i) * np.cos(yy / 53.0)
+                   + rng.normal(0, 20, (size, size))).astype(np.float32)
+            img[rng.integers(0, size, 8), rng.integers(0, size, 8)] = np.nan
+            fits.HDUList([fits.PrimaryHDU(), fits.ImageHDU(img)]).writeto(path)
+            sources.append(path)
+        else:
+            src = sources[i % unique]
+            try:
+                os.link(src, path)
+            except OSError:
+                shutil.copyfile(src, path)
+    open(marker, "w").close()
+
+
+def run(converter, src, dst, mode, env_extra):
+    shutil.rmtree(dst, ignore_errors=True)
+    env = dict(os.environ, FITS2JPGS_MODE=mode, **env_extra)
+    t0 = time.perf_counter()
+    r = subprocess.run([sys.executable, converter, src, dst], env=env,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    secs = time.perf_counter() - t0
+    if r.returncode != 0:
+        raise SystemExit(f"{mode} failed:\n{r.stderr}")
+    return secs
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark FITS2JPGS_MODE settings.")
+    ap.add_argument("--counts", default="2000,10000", help="comma-separated file counts")
+    ap.add_argument("--size", type=int, default=1024, help="frame width/height in pixels")
+    ap.add_argument("--unique", type=int, default=64, help="distinct frames per set")
+    ap.add_argument("--modes", default=",".join(MODES))
+    ap.add_argument("--converter", choices=sorted(CONVERTERS), default="orex")
+    ap.add_argument("--workers", type=int, help="FITS2JPGS_WORKERS (default: converter's)")
+    ap.add_argument("--threads", type=int, help="FITS2JPGS_THREADS (default: converter's)")
+    ap.add_argument("--workdir", default=os.path.join(os.getcwd(), "bench_fits_modes"))
+    ap.add_argument("--keep", action="store_true", help="keep the JPG output folders")
+    args = ap.parse_args()
+
+    env_extra = {"IMAGE_STATS": os.environ.get("IMAGE_STATS", "1")}
+    if args.workers:
+        env_extra["FITS2JPGS_WORKERS"] = str(args.workers)
+    if args.threads:
+        env_extra["FITS2JPGS_THREADS"] = str(args.threads)
+
+    counts = [int(c) for c in args.counts.split(",")]
+    modes = args.modes.split(",")
+    print(f"converter={args.converter} size={args.size}x{args.size} cpus={os.cpu_count()} {env_extra}")
+    print(f"{'files':>7} {'mode':>8} {'seconds':>9} {'files/s':>9} {'vs process':>11}")
+    for count in counts:
+        src = os.path.join(args.workdir, f"fits_{count}_{args.size}")
+        make_set(src, count, args.size, min(args.unique, count))
+        base = None
+        for mode in modes:
+            dst = os.path.join(args.workdir, f"jpg_{count}_{mode}")
+            secs = run(CONVERTERS[args.converter], src, dst, mode, env_extra)
+            if mode == "process":
+                base = secs
+            rel = f"{base / secs:10.2f}x" if base else f"{'':>11}"
+            print(f"{count:7d} {mode:>8} {secs:9.2f} {count / secs:9.1f} {rel}", flush=True)
+            if not args.keep:
+                shutil.rmtree(dst, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+check_raster_cache.py
+
+Regression check for the decoded-raster cache (imgconv/raster_cache.py): a
+converter run with RASTER_CACHE set, on a cold and on a warm cache, must write
+the same JPGs, byte for byte, and the same imageStats records as a run
+without it.
+
+    python check_raster_cache.py --converter hyb2 --count 8 --size 256
+
+The synthetic FITS frames (HDU 1, float32 like ONC L2c) carry NaN, +-inf and
+very large pixels, which are the values a lossy cache would change. Exits with
+status 1 if any output differs, so it can be used as a test.
+"""
+
+import os
+import sys
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+import numpy as np
+from astropy.io import fits
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+CONVERTERS = {
+    "orex": os.path.join(HERE, "..", "preprocessing", "osiris-rex", "fits_to_jpgs_parallel2.py"),
+    "hyb2": os.path.join(HERE, "..", "preprocessing", "hyb2", "fits_to_jpgs_parallel_hyb2.py"),
+}
+
+
+def make_frames(root, count, size):
+    rng = np.random.default_rng(0)
+    os.makedirs(root, exist_ok=True)
+    yy, xx = np.mgrid[0:size, 0:size]
+    for i in range(count):
+        img = (1000 + 300 * np.sin(xx / 37.0 + i) * np.cos(yy / 53.0)
+               + rng.normal(0, 20, (size, size))).astype(np.float32)
+        for value in (np.nan, np.inf, -np.inf, 3.0e38, 1.0e-30):
+            img[rng.integers(0, size, 4), rng.integers(0, size, 4)] = value
+        fits.HDUList([fits.PrimaryHDU(), fits.ImageHDU(img)]).writeto(os.path.join(root, f"frame{i:04d}.fits"))
+
+
+def run(converter, src, dst, cache=None):
+    env = dict(os.environ, IMAGE_STATS="1")
+    env.pop("RASTER_CACHE", None)
+    if cache:
+        env["RASTER_CACHE"] = cache
+    r = subprocess.run([sys.executable, converter, src, dst], env=env,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    if r.returncode != 0:
+        raise SystemExit(f"{converter} failed:\n{r.stderr}")
+
+
+def differences(ref, new):
+    """Paths (relative to the output folder) whose contents differ between two runs."""
+    out = []
+    files = set()
+    for top in (ref, new):
+        for root, _, names in os.walk(top):
+            files.update(os.path.relpath(os.path.join(root, n), top) for n in names)
+    for rel in sorted(files):
+        a, b = os.path.join(ref, rel), os.path.join(new, rel)
+        if not (os.path.exists(a) and os.path.exists(b)):
+            out.append(rel)
+        elif rel.endswith(".npz"):
+            with np.load(a) as za, np.load(b) as zb:
+                if set(za.files) != set(zb.files) or not all(
+                        np.array_equal(za[k], zb[k], equal_nan=za[k].dtype.kind == "f") for k in za.files):
+                    out.append(rel)
+        else:
+            with open(a, "rb") as fa, open(b, "rb") as fb:
+                if fa.read() != fb.read():
+                    out.append(rel)
+    return out
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Check that cached conversions match uncached ones exactly.")
+    ap.add_argument("--converter", choices=sorted(CONVERTERS), default="hyb2")
+    ap.add_argument("--count", type=int, default=8, help="number of FITS frames")
+    ap.add_argument("--size", type=int, default=256, help="frame width/height in pixels")
+    ap.add_argument("--keep", action="store_true", help="keep the work folder")
+    args = ap.parse_args()
+
+    work = tempfile.mkdtemp(prefix="check_raster_cache-")
+    try:
+        src = os.path.join(work, "fits")
+        make_frames(src, args.count, args.size)
+        converter = CONVERTERS[args.converter]
+        cache = os.path.join(work, "cache")
+        run(converter, src, os.path.join(work, "uncached"))
+        failed = False
+        for label in ("cold", "warm"):
+            dst = os.path.join(work, label)
+            run(converter, src, dst, cache)
+            diff = differences(os.path.join(work, "uncached"), dst)
+            print(f"{label} cache: " + (f"{len(diff)} file(s) differ: {', '.join(diff[:10])}" if diff else "identical"))
+            failed |= bool(diff)
+    finally:
+        if args.keep:
+            print("work folder:", work)
+        else:
+            shutil.rmtree(work, ignore_errors=True)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
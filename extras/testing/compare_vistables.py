@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+compare_vistables.py
+
+Regression check for visTables: compare a reference table (e.g. the one made
+by the browser with "npm run preprocess") against another (e.g. the one made
+by cometvis/build_vistable.py), row by row and bit for bit.
+
+    compare_vistables.py <refMeta> <refVisTable> <newMeta> <newVisTable>
+
+Rows are matched by image name ('nm'), so the two metadata files may drop
+different images. Reports images present in only one table, rows that differ
+(and by how many vertices), and the largest differences in b1/b2/d1/d2.
+Exits with status 1 if anything differs by more than --max-bits per row or
+--tol in the metadata, so it can be used as a test.
+"""
+
+import sys
+import json
+import argparse
+
+import numpy as np
+
+BOX_KEYS = ("b1", "b2", "d1", "d2")
+
+
+def load_table(meta_file, vis_file):
+    with open(meta_file, "r", encoding="utf-8") as f:
+        meta = json.load(f)
+    raw = np.fromfile(vis_file, dtype=np.uint8)
+    if len(meta) == 0 or raw.size % len(meta):
+        raise SystemExit(f"{vis_file}: {raw.size} bytes is not a whole number of rows for {len(meta)} entries")
+    return meta, raw.reshape(len(meta), -1)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Compare two visTables (and their metadata) bit for bit.")
+    ap.add_argument("ref_meta")
+    ap.add_argument("ref_vis")
+    ap.add_argument("new_meta")
+    ap.add_argument("new_vis")
+    ap.add_argument("--max-bits", type=int, default=0, help="allowed differing vertices per row (default: 0)")
+    ap.add_argument("--tol", type=float, default=1e-9, help="allowed b1/b2/d1/d2 difference in km")
+    ap.add_argument("--show", type=int, default=10, help="list this many of the worst rows")
+    args = ap.parse_args()
+
+    ref_meta, ref_rows = load_table(args.ref_meta, args.ref_vis)
+    new_meta, new_rows = load_table(args.new_meta, args.new_vis)
+    if ref_rows.shape[1] != new_rows.shape[1]:
+        raise SystemExit(f"Row sizes differ: {ref_rows.shape[1]} vs {new_rows.shape[1]} bytes")
+
+    ref_index = {e["nm"]: i for i, e in enumerate(ref_meta)}
+    new_index = {e["nm"]: i for i, e in enumerate(new_meta)}
+    only_ref = [nm for nm in ref_index if nm not in new_index]
+    only_new = [nm for nm in new_index if nm not in ref_index]
+    common = [nm for nm in ref_index if nm in new_index]
+    failed = bool(only_ref or only_new)
+
+    print(f"Reference: {len(ref_meta)} rows, new: {len(new_meta)} rows, common: {len(common)}, "
+          f"row size {ref_rows.shape[1]} bytes")
+    for label, names in (("only in reference", only_ref), ("only in new", only_new)):
+        if names:
+            print(f"{len(names)} {label}: {', '.join(names[:args.show])}{' ...' if len(names) > args.show else ''}")
+
+    if common:
+        ri = np.array([ref_index[nm] for nm in common])
+        ni = np.array([new_index[nm] for nm in common])
+        xor = ref_rows[ri] ^ new_rows[ni]
+        diff_bits = np.unpackbits(xor, axis=1).sum(axis=1)
+        ref_bits = np.unpackbits(ref_rows[ri], axis=1).sum(axis=1)
+        n_diff = int(np.count_nonzero(diff_bits))
+        print(f"Identical rows: {len(common) - n_diff}/{len(common)}; "
+              f"differing vertices: total {int(diff_bits.sum())}, max per row {int(diff_bits.max())} "
+              f"({int(diff_bits.sum()) / max(int(ref_bits.sum()), 1):.2e} of visible)")
+        for k in np.argsort(-diff_bits)[:args.show]:
+            if diff_bits[k] == 0:
+                break
+            print(f"  {common[k]}: {int(diff_bits[k])} of {int(ref_bits[k])} vertices differ")
+        failed |= bool(diff_bits.max() > args.max_bits)
+
+        worst = {}
+        for key in BOX_KEYS:
+            a = np.array([ref_meta[ref_index[nm]].get(key) for nm in common], dtype=np.float64)
+            b = np.array([new_meta[new_index[nm]].get(key) for nm in common], dtype=np.float64)
+            worst[key] = float(np.nanmax(np.abs(a - b))) if a.size else 0.0
+        print("Max metadata differences (km): " + ", ".join(f"{k}={v:.3g}" for k, v in worst.items()))
+        failed |= any(v > args.tol for v in worst.values())
+
+    print("FAIL" if failed else "PASS")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
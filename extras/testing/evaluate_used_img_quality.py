@@ -4,11 +4,14 @@
 # checks the image quality info stored in the .IMG headers and provides some basic stats.
 
 # This works for NAC and WAC images, but not NAVCAM (which lacks the relevant DATA_QUALITY_ID).
+#
+# If the imageStats_<CAMERA>.npz written by the converters is given as a second
+# argument, DATA_QUALITY_ID is looked up there instead of re-reading every .IMG.
 
 import os, json, re, sys
 
-if len(sys.argv) != 2:
-    print(f"Usage: {sys.argv[0]} <viewFile>"); sys.exit(1)
+if len(sys.argv) not in (2, 3):
+    print(f"Usage: {sys.argv[0]} <viewFile> [imageStats.npz]"); sys.exit(1)
 
 fromDir  = "IMG"
 filesDone = 0
@@ -61,12 +64,25 @@ with open(sys.argv[1], "r") as f:
 
 names = [item["nm"] for item in data if isinstance(item, dict) and "nm" in item]
 
+dqByName = None
+if len(sys.argv) == 3:
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+    from imgconv.stats import load_stats
+    stats = load_stats(sys.argv[2])
+    dqByName = dict(zip(stats["nm"].tolist(), stats["data_quality_id"].tolist()))
+
 for name in names:  
     dateStr = name[1:7]    # get the YYYYMM chars
     fromPath = f'{fromDir}/{dateStr}'
     imgFile = os.path.join(fromPath, name + ".IMG")
 
-    bad_info = tallyStats(imgFile)
+    if dqByName is not None:
+        if name not in dqByName:
+            print(f"SKIP (not in stats): {name}")
+            continue
+        bad_info = dqByName[name] if '1' in dqByName[name] else 0
+    else:
+        bad_info = tallyStats(imgFile)
     if (bad_info):
         badCount += 1
         print(f"BAD QUALITY: {imgFile} DATA_QUALITY_ID={bad_info}")